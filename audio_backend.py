@@ -0,0 +1,804 @@
+# audio_backend.py
+# Audio output backends for MusicPlayer.
+# The player only uses the small AudioBackend interface below (modelled on
+# pygame.mixer.music), so playback can run on pygame, or headless on the
+# NullBackend which decodes the file itself and consumes PCM at real or
+# accelerated rate, optionally writing it to a file sink, or on the
+# StreamBackend which decodes ahead into a ring buffer and feeds an output
+# callback (sounddevice, a pygame channel or a clock-driven sink). Pick one
+# with make_backend() or the MUZIC_AUDIO environment variable.
+import os
+import time
+import threading
+from abc import ABC, abstractmethod
+from collections import deque
+from typing import Callable, List, Optional, Tuple
+
+
+class AudioBackend(ABC):
+    """What MusicPlayer needs from an audio output."""
+
+    @abstractmethod
+    def load(self, path: str) -> None: ...
+
+    @abstractmethod
+    def play(self, start: float = 0.0) -> None: ...
+
+    @abstractmethod
+    def stop(self) -> None: ...
+
+    @abstractmethod
+    def pause(self) -> None: ...
+
+    @abstractmethod
+    def unpause(self) -> None: ...
+
+    @abstractmethod
+    def get_busy(self) -> bool:
+        # like pygame: False while paused or after the track ended
+        ...
+
+    @abstractmethod
+    def set_volume(self, volume: float) -> None: ...
+
+    def can_play(self, fmt: Optional[str]) -> bool:
+        # formats load() accepts; the rest are transcoded first (transcode.py)
+        from decoder import can_decode
+        return can_decode(fmt)
+
+
+class PygameBackend(AudioBackend):
+    def __init__(self):
+        import pygame
+        pygame.mixer.init()
+        self.music = pygame.mixer.music
+
+    def load(self, path: str) -> None:
+        self.music.load(path)
+
+    def can_play(self, fmt: Optional[str]) -> bool:
+        from decoder import PYGAME_FORMATS
+        return fmt in PYGAME_FORMATS
+
+    def play(self, start: float = 0.0) -> None:
+        self.music.play(start=start)
+
+    def stop(self) -> None:
+        self.music.stop()
+
+    def pause(self) -> None:
+        self.music.pause()
+
+    def unpause(self) -> None:
+        self.music.unpause()
+
+    def get_busy(self) -> bool:
+        return self.music.get_busy()
+
+    def set_volume(self, volume: float) -> None:
+        self.music.set_volume(volume)
+
+
+class NullBackend(AudioBackend):
+    """Headless output: decodes with decoder.decode_pcm and consumes the PCM
+    in chunk_ms pieces paced by the clock.
+
+    speed 1.0 is real time, 8.0 plays eight times faster, 0 consumes as fast
+    as possible. sink is an optional file path that receives the raw s16le
+    stream. Every start, first chunk and end of track is appended to
+    .events as (monotonic time, kind, path) and passed to on_event, which is
+    what the playback benchmark measures against.
+    """
+
+    def __init__(self, speed: float = 1.0, sink: Optional[str] = None, chunk_ms: int = 20,
+                 on_event: Optional[Callable[[float, str, str], None]] = None):
+        self.speed = speed
+        self.sink = open(sink, 'wb') if sink else None
+        self.chunk_ms = chunk_ms
+        self.on_event = on_event
+        self.events: List[Tuple[float, str, str]] = []
+        self.path: Optional[str] = None
+        self.pcm = memoryview(b'')
+        self.rate = 44100
+        self.frame_bytes = 4
+        self.volume = 1.0
+        self.cursor = 0
+        self.frames_played = 0
+        self.paused = False
+        self.cond = threading.Condition()
+        self.generation = 0
+        self.thread: Optional[threading.Thread] = None
+
+    def _event(self, kind: str) -> None:
+        t = time.monotonic()
+        self.events.append((t, kind, self.path))
+        if self.on_event:
+            self.on_event(t, kind, self.path)
+
+    def load(self, path: str) -> None:
+        from decoder import decode_pcm
+        self.stop()
+        pcm, rate, ch = decode_pcm(path)
+        self.path = path
+        self.pcm = memoryview(pcm)
+        self.rate = rate
+        self.frame_bytes = 2 * ch
+
+    def play(self, start: float = 0.0) -> None:
+        self.stop()
+        with self.cond:
+            self.cursor = min(int(start * self.rate) * self.frame_bytes, len(self.pcm))
+            self.paused = False
+            self.generation += 1
+            gen = self.generation
+        self._event('start')
+        self.thread = threading.Thread(target=self._run, args=(gen,), daemon=True)
+        self.thread.start()
+
+    def _run(self, gen: int) -> None:
+        chunk = max(1, self.rate * self.chunk_ms // 1000) * self.frame_bytes
+        first = True
+        clock = time.monotonic()
+        while True:
+            with self.cond:
+                while self.paused and gen == self.generation:
+                    self.cond.wait()
+                    clock = time.monotonic()
+                if gen != self.generation:
+                    return
+                piece = self.pcm[self.cursor:self.cursor + chunk]
+                self.cursor += len(piece)
+            if not piece:
+                self._event('end')
+                return
+            if self.sink:
+                self.sink.write(piece)
+            self.frames_played += len(piece) // self.frame_bytes
+            if first:
+                self._event('first_audio')
+                first = False
+            if self.speed > 0:
+                # pace against an absolute clock so sleep jitter doesn't accumulate
+                clock += len(piece) / self.frame_bytes / self.rate / self.speed
+                delay = clock - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+
+    def stop(self) -> None:
+        with self.cond:
+            self.generation += 1
+            self.paused = False
+            self.cond.notify_all()
+        if self.thread and self.thread is not threading.current_thread():
+            self.thread.join(timeout=1.0)
+        self.thread = None
+
+    def pause(self) -> None:
+        with self.cond:
+            self.paused = True
+
+    def unpause(self) -> None:
+        with self.cond:
+            self.paused = False
+            self.cond.notify_all()
+
+    def get_busy(self) -> bool:
+        return bool(self.thread and self.thread.is_alive()) and not self.paused
+
+    def set_volume(self, volume: float) -> None:
+        self.volume = volume
+
+    def position(self) -> float:
+        return self.cursor / self.frame_bytes / self.rate
+
+    def close(self) -> None:
+        self.stop()
+        if self.sink:
+            self.sink.close()
+            self.sink = None
+
+
+# ----------------- Streaming -----------------
+class PcmRing:
+    """Bounded single-producer/single-consumer byte ring.
+
+    The decoder thread writes, the output callback reads; they only share
+    the two running byte counters, so neither takes a lock. The reader gets
+    memoryview slices of the ring itself (two when the data wraps), which it
+    copies straight into the device buffer.
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.buf = bytearray(capacity)
+        self.view = memoryview(self.buf)
+        self.written = 0      # total bytes written, only the producer moves it
+        self.read = 0         # total bytes read, only the consumer moves it
+        self.space = threading.Event()
+
+    def readable(self) -> int:
+        return self.written - self.read
+
+    def writable(self) -> int:
+        return self.capacity - (self.written - self.read)
+
+    def write(self, data, cancelled: Callable[[], bool]) -> bool:
+        """Blocks while the ring is full. Returns False if cancelled first."""
+        data = memoryview(data).cast('B')
+        while len(data):
+            while True:
+                self.space.clear()
+                room = self.writable()
+                if room or cancelled():
+                    break
+                self.space.wait(0.05)
+            if cancelled():
+                return False
+            n = min(room, len(data))
+            pos = self.written % self.capacity
+            first = min(n, self.capacity - pos)
+            self.view[pos:pos + first] = data[:first]
+            self.view[:n - first] = data[first:n]
+            self.written += n
+            data = data[n:]
+        return True
+
+    def peek(self, n: int) -> List[memoryview]:
+        n = min(n, self.readable())
+        pos = self.read % self.capacity
+        first = min(n, self.capacity - pos)
+        views = [self.view[pos:pos + first]]
+        if n > first:
+            views.append(self.view[:n - first])
+        return views
+
+    def advance(self, n: int) -> None:
+        self.read += n
+        self.space.set()
+
+    def clear(self) -> None:
+        self.read = self.written
+        self.space.set()
+
+
+class ClockSink:
+    """Pulls blocks on a timer thread, for headless runs and benchmarks.
+    speed works as in NullBackend; path optionally records the output."""
+
+    def __init__(self, speed: float = 1.0, block_ms: int = 20, path: Optional[str] = None):
+        self.speed = speed
+        self.block_ms = block_ms
+        self.file = open(path, 'wb') if path else None
+        self.thread: Optional[threading.Thread] = None
+        self.running = False
+
+    def open(self, rate: int, channels: int, fill: Callable[[memoryview], None]) -> None:
+        self.close()
+        self.rate, self.frame_bytes, self.fill = rate, 2 * channels, fill
+        self.running = True
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self) -> None:
+        frames = max(1, self.rate * self.block_ms // 1000)
+        block = memoryview(bytearray(frames * self.frame_bytes))
+        clock = time.monotonic()
+        while self.running:
+            self.fill(block)
+            if self.file:
+                self.file.write(block)
+            if self.speed > 0:
+                clock = max(clock + frames / self.rate / self.speed, time.monotonic() - 0.5)
+                delay = clock - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+
+    def set_volume(self, volume: float) -> None:
+        pass
+
+    def close(self) -> None:
+        self.running = False
+        if self.thread:
+            self.thread.join(timeout=1.0)
+            self.thread = None
+        if self.file:
+            self.file.flush()
+
+
+class SoundDeviceSink:
+    """PortAudio output through the optional sounddevice package."""
+
+    def __init__(self, block_ms: int = 20):
+        import sounddevice
+        self.sd = sounddevice
+        self.block_ms = block_ms
+        self.stream = None
+        self.volume = 1.0
+
+    def open(self, rate: int, channels: int, fill: Callable[[memoryview], None]) -> None:
+        self.close()
+
+        def callback(outdata, frames, time_info, status):
+            out = memoryview(outdata).cast('B')
+            fill(out)
+            if self.volume < 1.0:
+                import numpy as np
+                samples = np.frombuffer(out, dtype='<i2')
+                samples[:] = (samples * self.volume).astype('<i2')
+        self.stream = self.sd.RawOutputStream(samplerate=rate, channels=channels, dtype='int16',
+                                              blocksize=max(1, rate * self.block_ms // 1000),
+                                              callback=callback)
+        self.stream.start()
+
+    def set_volume(self, volume: float) -> None:
+        self.volume = volume
+
+    def close(self) -> None:
+        if self.stream is not None:
+            self.stream.stop()
+            self.stream.close()
+            self.stream = None
+
+
+class PygameSink:
+    """Feeds blocks to a pygame mixer channel, keeping one queued ahead."""
+
+    def __init__(self, block_ms: int = 100):
+        import pygame
+        self.pygame = pygame
+        self.block_ms = block_ms
+        self.channel = None
+        self.volume = 1.0
+        self.thread: Optional[threading.Thread] = None
+        self.running = False
+
+    def open(self, rate: int, channels: int, fill: Callable[[memoryview], None]) -> None:
+        self.close()
+        mixer = self.pygame.mixer
+        if mixer.get_init() != (rate, -16, channels):
+            mixer.quit()
+            mixer.init(frequency=rate, size=-16, channels=channels)
+        self.channel = mixer.Channel(0)
+        self.channel.set_volume(self.volume)
+        self.frames = max(1, rate * self.block_ms // 1000)
+        self.block_bytes = self.frames * 2 * channels
+        self.period = self.block_ms / 1000.0
+        self.fill = fill
+        self.running = True
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self) -> None:
+        while self.running:
+            if self.channel.get_queue() is None:
+                block = bytearray(self.block_bytes)
+                self.fill(memoryview(block))
+                self.channel.queue(self.pygame.mixer.Sound(buffer=block))
+            else:
+                time.sleep(self.period / 4)
+
+    def set_volume(self, volume: float) -> None:
+        self.volume = volume
+        if self.channel:
+            self.channel.set_volume(volume)
+
+    def close(self) -> None:
+        self.running = False
+        if self.thread:
+            self.thread.join(timeout=1.0)
+            self.thread = None
+        if self.channel:
+            self.channel.stop()
+
+
+def make_sink(name: Optional[str] = None):
+    name = (name or os.environ.get('MUZIC_AUDIO_SINK') or 'auto').lower()
+    if name == 'clock':
+        return ClockSink(speed=float(os.environ.get('MUZIC_AUDIO_SPEED', '1')))
+    if name in ('auto', 'sounddevice'):
+        try:
+            return SoundDeviceSink()
+        except Exception:
+            if name == 'sounddevice':
+                raise
+    return PygameSink()
+
+
+MAX_CROSSFADE = 12.0
+
+
+def _close(chunks) -> None:
+    close = getattr(chunks, 'close', None)
+    if close:
+        close()
+
+
+class _Lookahead:
+    """The start of the queued next track, decoded a chunk at a time while
+    the current one still plays. chunks is None when it can't be joined."""
+
+    def __init__(self, path: str, chunks, want: int):
+        self.path = path
+        self.chunks = chunks
+        self.want = want
+        self.data = bytearray()
+
+    def step(self) -> bool:
+        if self.chunks is None or len(self.data) >= self.want:
+            return True
+        piece = next(self.chunks, None)
+        if piece is None:
+            self.want = len(self.data)
+            return True
+        self.data += piece
+        return len(self.data) >= self.want
+
+    def finish(self) -> None:
+        while not self.step():
+            pass
+
+    def close(self) -> None:
+        _close(self.chunks)
+
+
+class StreamBackend(AudioBackend):
+    """Decode-ahead playback.
+
+    A decoder thread reads the file in chunk_bytes pieces (decoder.open_pcm)
+    and fills a PcmRing holding buffer_seconds of audio; the sink's output
+    callback drains it. Output starts once prefill_seconds are buffered, so
+    a slow read on network storage is absorbed by the buffer instead of
+    reaching the device. metrics() reports fill level and underruns.
+    source can be swapped for anything with open_pcm's signature.
+
+    Track changes happen in the decoder as well. With a track set by
+    queue_next(), the decoder keeps the last crossfade_seconds of the current
+    track back, pre-decodes the head of the next one while the current one
+    still plays, and writes the equal-power mix of the two into the ring
+    (crossfade 0 gives a gapless join). crossfade_to() does the same for a
+    manual skip, fading out whatever of the old track was still buffered.
+    When the listener reaches a join, on_track_change(path) is called from
+    the audio thread.
+    """
+
+    def __init__(self, sink=None, buffer_seconds: float = 2.0, prefill_seconds: float = 0.25,
+                 chunk_bytes: int = 1 << 15,
+                 on_event: Optional[Callable[[float, str, str], None]] = None):
+        from decoder import open_pcm
+        self.source = open_pcm
+        self.sink = sink or make_sink()
+        self.buffer_seconds = buffer_seconds
+        self.prefill_seconds = prefill_seconds
+        self.chunk_bytes = chunk_bytes
+        self.on_event = on_event
+        self.on_track_change: Optional[Callable[[str], None]] = None
+        self.events: List[Tuple[float, str, str]] = []
+        self.path: Optional[str] = None
+        self.format: Optional[Tuple[int, int]] = None
+        self.rate = 44100
+        self.frame_bytes = 4
+        self.ring: Optional[PcmRing] = None
+        # consumer-side lock: only contended while play/stop swaps streams
+        self.swap = threading.Lock()
+        self.generation = 0
+        self.decoder: Optional[threading.Thread] = None
+        self.active = False      # a stream is loaded and not finished
+        self.primed = False      # prefill reached, output running
+        self.eof = False
+        self.first = False       # first_audio not yet reported for this stream
+        self.paused = False
+        self.volume = 1.0
+        self.frames_played = 0
+        self.crossfade_seconds = 0.0
+        self.next_path: Optional[str] = None
+        # (ring offset, path) of joins the listener hasn't reached yet
+        self.markers = deque()
+        # what a cancelled decoder leaves for crossfade_to: (chunks, held bytes)
+        self.handoff = None
+        self.curves = None
+        self.reset_metrics()
+
+    def reset_metrics(self) -> None:
+        self.underruns = 0
+        self.decode_waits = 0
+        self.max_read_s = 0.0
+        self.min_fill = None
+
+    def _event(self, kind: str) -> None:
+        t = time.monotonic()
+        self.events.append((t, kind, self.path))
+        if self.on_event:
+            self.on_event(t, kind, self.path)
+
+    def load(self, path: str) -> None:
+        self.stop()
+        self.path = path
+
+    def play(self, start: float = 0.0) -> None:
+        self.stop()
+        rate, ch, chunks = self.source(self.path, start, self.chunk_bytes)
+        self._start(rate, ch, chunks)
+
+    def _start(self, rate: int, ch: int, chunks, outgoing=None) -> None:
+        self.rate, self.frame_bytes = rate, 2 * ch
+        capacity = max(self.chunk_bytes * 2, int(self.buffer_seconds * rate) * self.frame_bytes)
+        with self.swap:
+            if outgoing is None:
+                if self.ring is None or self.ring.capacity != capacity:
+                    self.ring = PcmRing(capacity)
+                self.ring.clear()
+                self.markers.clear()
+                self.primed, self.first = False, True
+            else:
+                # the listener keeps hearing what is left in the ring; the new
+                # track becomes audible where the fade starts
+                self.markers.append((self.ring.written, self.path))
+            self.generation += 1
+            gen = self.generation
+            self.active, self.eof, self.paused = True, False, False
+        if outgoing is None:
+            self._event('start')
+        if self.format != (rate, ch):
+            self.sink.open(rate, ch, self._fill)
+            self.format = (rate, ch)
+        self.decoder = threading.Thread(target=self._decode, args=(gen, chunks, outgoing), daemon=True)
+        self.decoder.start()
+
+    # ----------------- Crossfade -----------------
+    def set_crossfade(self, seconds: float) -> None:
+        self.crossfade_seconds = max(0.0, min(MAX_CROSSFADE, float(seconds)))
+
+    def queue_next(self, path: Optional[str]) -> None:
+        # the decoder picks this up on its next chunk and pre-decodes its head
+        self.next_path = path
+
+    def _fade_bytes(self) -> int:
+        return int(self.crossfade_seconds * self.rate) * self.frame_bytes
+
+    def _mix(self, outgoing, incoming) -> bytes:
+        """Equal-power crossfade of two equally long s16le buffers."""
+        import numpy as np
+        ch = self.frame_bytes // 2
+        a = np.frombuffer(outgoing, dtype='<i2').reshape(-1, ch)
+        b = np.frombuffer(incoming, dtype='<i2').reshape(-1, ch)
+        n = len(a)
+        if self.curves is None or len(self.curves[0]) != n:
+            # cos^2 + sin^2 = 1 keeps the summed power constant through the fade
+            t = np.linspace(0.0, np.pi / 2, n, dtype=np.float32)
+            self.curves = (np.cos(t)[:, None], np.sin(t)[:, None])
+        mixed = a * self.curves[0] + b * self.curves[1]
+        return np.clip(mixed, -32768, 32767).astype('<i2').tobytes()
+
+    def _open_next(self, path: str) -> '_Lookahead':
+        try:
+            rate, ch, chunks = self.source(path, 0.0, self.chunk_bytes)
+        except Exception as e:
+            print("Could not open next track:", e)
+            return _Lookahead(path, None, 0)
+        if (rate, ch) != self.format:
+            # a different format needs a new output stream: plain stop-then-load
+            _close(chunks)
+            return _Lookahead(path, None, 0)
+        return _Lookahead(path, chunks, self._fade_bytes())
+
+    def _wait_for_next(self, cancelled: Callable[[], bool]) -> Optional[str]:
+        low = int(0.25 * self.rate) * self.frame_bytes
+        while not self.next_path and not cancelled() and self.ring.readable() > low:
+            time.sleep(0.02)
+        return None if cancelled() else self.next_path
+
+    def crossfade_to(self, path: str) -> bool:
+        """Skips to path with a crossfade from the current position. Returns
+        False (nothing changed) when there is nothing to fade from."""
+        if not self.crossfade_seconds or not self.active or self.paused or not self.decoder:
+            return False
+        try:
+            rate, ch, chunks = self.source(path, 0.0, self.chunk_bytes)
+        except Exception as e:
+            print("Could not open track:", e)
+            return False
+        if (rate, ch) != self.format:
+            _close(chunks)
+            return False
+        with self.swap:
+            self.generation += 1
+        self.ring.space.set()
+        self.decoder.join(timeout=1.0)
+        old_chunks, held = self.handoff or (None, b'')
+        self.handoff = None
+        with self.swap:
+            # take back all but a short lead of what the listener hasn't heard
+            # yet; it becomes the fade-out, mixed while the lead plays
+            ring = self.ring
+            keep = min(ring.readable(), int(self.prefill_seconds * self.rate) * self.frame_bytes)
+            unplayed = b''.join(bytes(v) for v in ring.peek(ring.readable()))[keep:]
+            ring.written = ring.read + keep
+            while self.markers and self.markers[-1][0] > ring.written:
+                self.markers.pop()
+        self.path = path
+        self._start(rate, ch, chunks, outgoing=(unplayed + held, old_chunks))
+        return True
+
+    def _decode(self, gen: int, chunks, outgoing=None) -> None:
+        cancelled = lambda: gen != self.generation
+        ring = self.ring
+        hold = bytearray()    # delay line: the last crossfade seconds, kept back for the mix
+        head = None           # _Lookahead for the queued next track
+
+        def write(data) -> bool:
+            if ring.writable() < len(data):
+                self.decode_waits += 1
+            return ring.write(data, cancelled)
+
+        def join(tail, start):
+            # tail and start overlap for as long as both last; returns the overlap
+            n = min(len(tail), len(start))
+            if write(tail[:len(tail) - n]) and write(self._mix(tail[len(tail) - n:], start[:n])):
+                return n
+            return None
+
+        try:
+            if outgoing is not None:
+                # manual skip: the old stream fades out under the start of this one
+                data, old = outgoing
+                fade_bytes = self._fade_bytes()
+                fade = bytearray(data[:fade_bytes])
+                while old is not None and len(fade) < fade_bytes:
+                    piece = next(old, None)
+                    if piece is None:
+                        break
+                    fade += piece
+                _close(old)
+                del fade[fade_bytes:]
+                start = _Lookahead(self.path, chunks, len(fade))
+                start.finish()
+                n = join(fade, start.data)
+                if n is None:
+                    return
+                hold = start.data[n:]
+            while not cancelled():
+                t = time.perf_counter()
+                data = next(chunks, None)
+                self.max_read_s = max(self.max_read_s, time.perf_counter() - t)
+                nxt = self.next_path
+                if nxt and (head is None or head.path != nxt):
+                    if head:
+                        head.close()
+                    head = self._open_next(nxt)
+                if data is None:
+                    if not nxt:
+                        # give the front end until the buffer runs low to queue a next track
+                        nxt = self._wait_for_next(cancelled)
+                        if nxt:
+                            head = self._open_next(nxt)
+                    if not nxt or head.chunks is None:
+                        break
+                    # join the next track into the same stream
+                    head.finish()
+                    _close(chunks)
+                    chunks, start, path = head.chunks, head.data, head.path
+                    head = None
+                    if self.next_path == path:
+                        self.next_path = None
+                    self.markers.append((ring.written + len(hold) - min(len(hold), len(start)), path))
+                    n = join(hold, start)
+                    if n is None:
+                        return
+                    hold = bytearray(start[n:])
+                    continue
+                hold += data
+                cut = len(hold) - self._fade_bytes()
+                if cut > 0:
+                    if not write(hold[:cut]):
+                        return
+                    del hold[:cut]
+                if head:
+                    # decode the next track's head a chunk at a time alongside this one
+                    head.step()
+            if not cancelled() and write(hold):
+                hold = bytearray()
+        except Exception as e:
+            print("Decode error:", e)
+        finally:
+            if head:
+                head.close()
+            if cancelled():
+                # crossfade_to() may pick the stream up from here
+                self.handoff = (chunks, bytes(hold))
+            else:
+                _close(chunks)
+                self.eof = True
+
+    def _fill(self, out: memoryview) -> None:
+        # runs on the audio thread: copy what is buffered, pad with silence
+        got = 0
+        changed = []
+        with self.swap:
+            ring = self.ring
+            if self.active and not self.paused and ring is not None:
+                if not self.primed:
+                    self.primed = self.eof or ring.readable() >= int(self.prefill_seconds * self.rate) * self.frame_bytes
+                if self.primed:
+                    for view in ring.peek(len(out)):
+                        out[got:got + len(view)] = view
+                        got += len(view)
+                    ring.advance(got)
+                    self.frames_played += got // self.frame_bytes
+                    while self.markers and self.markers[0][0] <= ring.read:
+                        changed.append(self.markers.popleft()[1])
+                    fill = ring.readable()
+                    if not self.eof and (self.min_fill is None or fill < self.min_fill):
+                        self.min_fill = fill
+                    if got < len(out) and not self.eof:
+                        self.underruns += 1
+                        self._event('underrun')
+                    if got and self.first:
+                        self.first = False
+                        self._event('first_audio')
+                    if self.eof and not ring.readable():
+                        self.active = False
+                        self._event('end')
+        if got < len(out):
+            out[got:] = bytes(len(out) - got)
+        for path in changed:
+            self.path = path
+            self._event('track_change')
+            if self.on_track_change:
+                self.on_track_change(path)
+
+    def stop(self) -> None:
+        with self.swap:
+            self.generation += 1
+            self.active = False
+            self.paused = False
+            self.markers.clear()
+        if self.ring is not None:
+            self.ring.space.set()
+        if self.decoder and self.decoder is not threading.current_thread():
+            self.decoder.join(timeout=1.0)
+        self.decoder = None
+        if self.handoff:
+            _close(self.handoff[0])
+            self.handoff = None
+
+    def pause(self) -> None:
+        self.paused = True
+
+    def unpause(self) -> None:
+        self.paused = False
+
+    def get_busy(self) -> bool:
+        return self.active and not self.paused
+
+    def set_volume(self, volume: float) -> None:
+        self.volume = volume
+        self.sink.set_volume(volume)
+
+    def position(self) -> float:
+        return self.frames_played / self.rate
+
+    def metrics(self) -> dict:
+        ring = self.ring
+        per_second = self.rate * self.frame_bytes
+        fill = ring.readable() if ring else 0
+        return {'buffer_seconds': ring.capacity / per_second if ring else self.buffer_seconds,
+                'fill_seconds': fill / per_second,
+                'fill_ratio': fill / ring.capacity if ring else 0.0,
+                'min_fill_seconds': (self.min_fill or 0) / per_second,
+                'underruns': self.underruns,
+                'decode_waits': self.decode_waits,
+                'max_read_ms': self.max_read_s * 1000}
+
+    def close(self) -> None:
+        self.stop()
+        self.sink.close()
+        self.format = None
+
+
+def make_backend(name: Optional[str] = None) -> AudioBackend:
+    name = (name or os.environ.get('MUZIC_AUDIO') or 'pygame').lower()
+    if name == 'null':
+        return NullBackend(speed=float(os.environ.get('MUZIC_AUDIO_SPEED', '1')))
+    if name == 'stream':
+        return StreamBackend(buffer_seconds=float(os.environ.get('MUZIC_AUDIO_BUFFER', '2')))
+    return PygameBackend()
@@ -0,0 +1,183 @@
+# benchmarks/bench_http.py
+# Loopback load test for httpserver.py: a library of synthetic WAV tracks is
+# served on 127.0.0.1 and --clients concurrent listeners each fetch the
+# library listing, then stream tracks in --chunk sized Range requests over
+# one keep-alive connection (as media players do) or whole (--chunk 0).
+# The listeners run in a child process, so the reported peak RSS and CPU are
+# the server's alone: zero-copy sendfile can be compared with a plain
+# read/write loop (--copy). Time to first byte and throughput are measured
+# by the clients.
+#
+#   python -m benchmarks.bench_http --clients 200 --out http.json
+#   python -m benchmarks.bench_http --clients 200 --copy
+import os
+import sys
+import json
+import time
+import queue
+import random
+import asyncio
+import argparse
+import platform
+import tempfile
+import multiprocessing
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BASE_DIR not in sys.path:
+    sys.path.insert(0, BASE_DIR)
+
+from audio_backend import NullBackend
+from player import MusicPlayer
+from service import MusicService
+from httpserver import LibraryHTTPServer
+from benchmarks.bench_playback import make_tracks, summarize
+from benchmarks.bench_structures import git_commit
+
+
+def max_rss_mb() -> float:
+    try:
+        import resource
+    except ImportError:
+        return 0.0
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1 << 20) if sys.platform == 'darwin' else rss / 1024
+
+
+async def request(reader, writer, path: str, headers: str = '') -> tuple:
+    # one keep-alive request; the body is read and dropped
+    writer.write(f'GET {path} HTTP/1.1\r\nHost: bench\r\n{headers}\r\n'.encode())
+    t = time.monotonic()
+    head = await reader.readuntil(b'\r\n\r\n')
+    ttfb = time.monotonic() - t
+    status = int(head.split(b' ', 2)[1])
+    length = 0
+    for line in head.split(b'\r\n'):
+        if line.lower().startswith(b'content-length:'):
+            length = int(line.split(b':', 1)[1])
+    left = length
+    while left:
+        data = await reader.read(min(left, 1 << 16))
+        if not data:
+            raise ConnectionError('short body')
+        left -= len(data)
+    return status, length, ttfb
+
+
+async def listener(port: int, songs: list, rng: random.Random, tracks: int, chunk: int, stats: dict) -> None:
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    try:
+        status, n, ttfb = await request(reader, writer, '/api/library?limit=1000')
+        stats['api'].append(ttfb)
+        for _ in range(tracks):
+            song = rng.choice(songs)
+            if not chunk:
+                status, n, ttfb = await request(reader, writer, song['url'])
+                stats['first_byte'].append(ttfb)
+                stats['bytes'] += n
+                continue
+            offset, first = 0, True
+            while True:
+                status, n, ttfb = await request(reader, writer, song['url'],
+                                                f'Range: bytes={offset}-{offset + chunk - 1}\r\n')
+                if status == 416:
+                    break
+                if first:
+                    stats['first_byte'].append(ttfb)
+                    first = False
+                stats['bytes'] += n
+                stats['ranges'] += 1
+                offset += n
+                if n < chunk:
+                    break
+    except (ConnectionError, asyncio.IncompleteReadError) as e:
+        stats['errors'].append(str(e))
+    finally:
+        writer.close()
+
+
+async def load(port: int, songs: list, args) -> dict:
+    stats = {'api': [], 'first_byte': [], 'bytes': 0, 'ranges': 0, 'errors': []}
+    rng = random.Random(args.seed)
+    wall = time.monotonic()
+    await asyncio.gather(*(listener(port, songs, random.Random(rng.random()), args.per_client,
+                                    args.chunk, stats) for _ in range(args.clients)))
+    stats['wall'] = time.monotonic() - wall
+    return stats
+
+
+def load_process(port: int, songs: list, args, results) -> None:
+    results.put(asyncio.run(load(port, songs, args)))
+
+
+async def run(args) -> dict:
+    folder = tempfile.mkdtemp(prefix='bench-http-')
+    paths = make_tracks(folder, args.tracks, args.track_seconds)
+    service = MusicService(player=MusicPlayer(backend=NullBackend()),
+                           data_dir=os.path.join(folder, 'data'), song_dir=os.path.join(folder, 'songs'))
+    service.load_state()  # load_library() reloads the index from the database
+    for path in paths:
+        service.library.add_reference(path)
+    service.library.save()
+    service.load_library()
+    server = LibraryHTTPServer(service, '127.0.0.1', 0, max_clients=args.clients + 16)
+    server.zero_copy = not args.copy
+    await server.start()
+    songs = (await server.api('/api/library', {'limit': '1000'}))['songs']
+    if not songs:
+        await server.close()
+        raise RuntimeError('the benchmark library is empty')
+    rss_before = max_rss_mb()
+    cpu = time.process_time()
+    results = multiprocessing.Queue()
+    proc = multiprocessing.Process(target=load_process, args=(server.port, songs, args, results))
+    proc.start()
+    # the queue is read off the loop thread so the server keeps serving
+    loop = asyncio.get_running_loop()
+    while True:
+        try:
+            stats = await loop.run_in_executor(None, results.get, True, 1.0)
+            break
+        except queue.Empty:
+            if not proc.is_alive():
+                await server.close()
+                raise RuntimeError(f'load process exited with code {proc.exitcode}')
+    cpu = time.process_time() - cpu
+    proc.join()
+    wall = stats['wall']
+    await server.close()
+    service.shutdown()
+    return {'meta': {'commit': git_commit(), 'python': platform.python_version(),
+                     'platform': platform.platform(), 'clients': args.clients,
+                     'per_client': args.per_client, 'chunk': args.chunk, 'tracks': args.tracks,
+                     'track_seconds': args.track_seconds, 'zero_copy': not args.copy, 'seed': args.seed,
+                     'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S')},
+            'results': {'api': summarize(stats['api']), 'first_byte': summarize(stats['first_byte']),
+                        'transfer': {'mb': stats['bytes'] / 1e6, 'wall_s': wall, 'server_cpu_s': cpu,
+                                     'mb_per_s': stats['bytes'] / 1e6 / wall if wall else 0.0,
+                                     'ranges': stats['ranges'], 'errors': len(stats['errors'])},
+                        'server_memory': {'max_rss_mb_before': rss_before, 'max_rss_mb_after': max_rss_mb()}}}
+
+
+def main(argv=None) -> int:
+    p = argparse.ArgumentParser(description='Loopback HTTP streaming benchmark.')
+    p.add_argument('--clients', type=int, default=100)
+    p.add_argument('--per-client', type=int, default=2, help='tracks streamed by each client')
+    p.add_argument('--chunk', type=int, default=256 * 1024, help='Range request size, 0 = whole file')
+    p.add_argument('--tracks', type=int, default=8)
+    p.add_argument('--track-seconds', type=float, default=20.0)
+    p.add_argument('--copy', action='store_true', help='read/write loop instead of sendfile')
+    p.add_argument('--seed', type=int, default=42)
+    p.add_argument('--out', help='write results as JSON')
+    args = p.parse_args(argv)
+    report = asyncio.run(run(args))
+    for name, r in report['results'].items():
+        print(f'{name:10} ' + '  '.join(f'{k}={v:.3f}' if isinstance(v, float) else f'{k}={v}'
+                                       for k, v in r.items()))
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,227 @@
+# benchmarks/bench_playback.py
+# Headless playback benchmark: drives MusicPlayer on the NullBackend through
+# scripted sessions over synthetic WAV tracks and reports
+#   switch  - time from play() to the first chunk of the new track
+#   seek    - time from seek() to the first chunk at the new position
+#   gap     - silence between the end of one track and the start of the next
+#             when auto-advancing the way the front ends do (poll, then play)
+#   cpu     - process CPU seconds per hour of audio consumed
+# With --backend stream the decode-ahead StreamBackend runs on a ClockSink;
+# --stall-ms/--stall-every inject slow reads (as on network storage) and the
+# buffer metrics, including underruns, are added to the report.
+#
+#   python -m benchmarks.bench_playback --speed 8 --out playback.json
+#   python -m benchmarks.bench_playback --backend stream --stall-ms 300 --stall-every 20
+import os
+import sys
+import json
+import time
+import wave
+import math
+import random
+import argparse
+import platform
+import tempfile
+import threading
+from array import array
+from typing import List, Optional
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BASE_DIR not in sys.path:
+    sys.path.insert(0, BASE_DIR)
+
+from audio_backend import NullBackend, StreamBackend, ClockSink
+from player import MusicPlayer
+from benchmarks.bench_structures import git_commit
+
+
+def make_tracks(folder: str, count: int, seconds: float, rate: int = 44100) -> List[str]:
+    paths = []
+    for i in range(count):
+        freq = 220.0 * (1 + i % 7)
+        frame = array('h')
+        for n in range(int(rate * seconds)):
+            v = int(12000 * math.sin(2 * math.pi * freq * n / rate))
+            frame.extend((v, v))
+        path = os.path.join(folder, f'track{i:03d}.wav')
+        with wave.open(path, 'wb') as w:
+            w.setnchannels(2)
+            w.setsampwidth(2)
+            w.setframerate(rate)
+            w.writeframes(frame.tobytes())
+        paths.append(path)
+    return paths
+
+
+class EventLog:
+    """Collects backend events and lets the script wait for the next one."""
+
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.events = []
+
+    def __call__(self, t: float, kind: str, path: str) -> None:
+        with self.cond:
+            self.events.append((t, kind, path))
+            self.cond.notify_all()
+
+    def mark(self) -> int:
+        with self.cond:
+            return len(self.events)
+
+    def wait_for(self, kind: str, since: int, timeout: float = 30.0) -> Optional[float]:
+        deadline = time.monotonic() + timeout
+        with self.cond:
+            while True:
+                for t, k, _ in self.events[since:]:
+                    if k == kind:
+                        return t
+                left = deadline - time.monotonic()
+                if left <= 0:
+                    return None
+                self.cond.wait(left)
+
+
+def stalling(source, stall_ms: float, every: int):
+    # wraps decoder.open_pcm so every n-th chunk read takes stall_ms longer
+    def open_pcm(path, start=0.0, chunk_bytes=1 << 16):
+        rate, ch, chunks = source(path, start, chunk_bytes)
+
+        def slow():
+            for i, data in enumerate(chunks, 1):
+                if i % every == 0:
+                    time.sleep(stall_ms / 1000)
+                yield data
+        return rate, ch, slow()
+    return open_pcm
+
+
+def summarize(samples: List[float]) -> dict:
+    if not samples:
+        return {'count': 0}
+    s = sorted(samples)
+    pick = lambda q: s[min(len(s) - 1, int(q * len(s)))] * 1000
+    return {'count': len(s), 'mean_ms': sum(s) / len(s) * 1000, 'p50_ms': pick(0.5),
+            'p95_ms': pick(0.95), 'max_ms': s[-1] * 1000}
+
+
+# ----------------- Sessions -----------------
+def session_switch(player, log, tracks, rng, dwell: float) -> List[float]:
+    latencies = []
+    for path in tracks:
+        since = log.mark()
+        t = time.monotonic()
+        player.play(path)
+        first = log.wait_for('first_audio', since)
+        if first is not None:
+            latencies.append(first - t)
+        time.sleep(dwell * rng.random())
+    player.stop()
+    return latencies
+
+
+def session_seek(player, log, tracks, rng, seeks: int, seconds: float) -> List[float]:
+    latencies = []
+    since = log.mark()
+    player.play(tracks[0])
+    log.wait_for('first_audio', since)
+    for _ in range(seeks):
+        since = log.mark()
+        t = time.monotonic()
+        player.seek(rng.uniform(0, seconds * 0.9))
+        first = log.wait_for('first_audio', since)
+        if first is not None:
+            latencies.append(first - t)
+        time.sleep(0.05)
+    player.stop()
+    return latencies
+
+
+def session_continuous(player, log, tracks, tick: float) -> List[float]:
+    # auto-advance like the CLI/GUI: poll is_playing, then start the next track
+    gaps = []
+    since = log.mark()
+    player.play(tracks[0])
+    log.wait_for('first_audio', since)
+    for path in tracks[1:]:
+        while player.is_playing() or player.is_paused():
+            time.sleep(tick)
+        end = log.wait_for('end', since, timeout=1.0)
+        since = log.mark()
+        player.play(path)
+        first = log.wait_for('first_audio', since)
+        if end is not None and first is not None:
+            gaps.append(first - end)
+    while player.is_playing():
+        time.sleep(tick)
+    player.stop()
+    return gaps
+
+
+def run(args) -> dict:
+    rng = random.Random(args.seed)
+    folder = tempfile.mkdtemp(prefix='bench-playback-')
+    tracks = make_tracks(folder, args.tracks, args.track_seconds)
+    log = EventLog()
+    if args.backend == 'stream':
+        backend = StreamBackend(sink=ClockSink(speed=args.speed, path=args.sink),
+                                buffer_seconds=args.buffer, prefill_seconds=args.prefill,
+                                on_event=log)
+        if args.stall_ms:
+            # stalls are wall time, so scale them with the playback speed
+            backend.source = stalling(backend.source, args.stall_ms / max(args.speed, 1), args.stall_every)
+    else:
+        backend = NullBackend(speed=args.speed, sink=args.sink, on_event=log)
+    player = MusicPlayer(backend=backend)
+    player.poll_interval = args.poll
+    cpu, wall = time.process_time(), time.monotonic()
+    results = {
+        'switch': summarize(session_switch(player, log, tracks, rng, args.dwell)),
+        'seek': summarize(session_seek(player, log, tracks, rng, args.seeks, args.track_seconds)),
+        'gap': summarize(session_continuous(player, log, tracks, args.tick)),
+    }
+    cpu, wall = time.process_time() - cpu, time.monotonic() - wall
+    audio_seconds = backend.frames_played / backend.rate
+    results['cpu'] = {'cpu_s': cpu, 'wall_s': wall, 'audio_s': audio_seconds,
+                      'cpu_s_per_playback_hour': cpu / audio_seconds * 3600 if audio_seconds else None}
+    if args.backend == 'stream':
+        results['buffer'] = backend.metrics()
+    backend.close()
+    return {'meta': {'commit': git_commit(), 'python': platform.python_version(),
+                     'platform': platform.platform(), 'seed': args.seed, 'speed': args.speed, 'backend': args.backend,
+                     'tracks': args.tracks, 'track_seconds': args.track_seconds,
+                     'poll_s': args.poll, 'tick_s': args.tick,
+                     'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S')},
+            'results': results}
+
+
+def main(argv=None) -> int:
+    p = argparse.ArgumentParser(description='Headless playback latency benchmark.')
+    p.add_argument('--tracks', type=int, default=10)
+    p.add_argument('--track-seconds', type=float, default=10.0)
+    p.add_argument('--speed', type=float, default=8.0, help='1 = real time, 0 = unpaced')
+    p.add_argument('--seeks', type=int, default=20)
+    p.add_argument('--dwell', type=float, default=0.5, help='max seconds spent on a track before skipping')
+    p.add_argument('--poll', type=float, default=0.1, help='player end-of-track poll interval')
+    p.add_argument('--tick', type=float, default=0.05, help='front-end auto-advance poll interval')
+    p.add_argument('--backend', choices=('null', 'stream'), default='null')
+    p.add_argument('--buffer', type=float, default=2.0, help='stream backend buffer seconds')
+    p.add_argument('--prefill', type=float, default=0.25, help='stream backend prefill seconds')
+    p.add_argument('--stall-ms', type=float, default=0.0, help='inject slow reads of this length')
+    p.add_argument('--stall-every', type=int, default=20, help='stall on every n-th chunk read')
+    p.add_argument('--sink', help='write the consumed PCM to this file')
+    p.add_argument('--seed', type=int, default=36)
+    p.add_argument('--out', help='write results as JSON')
+    args = p.parse_args(argv)
+    report = run(args)
+    for name, r in report['results'].items():
+        print(f'{name:8} ' + '  '.join(f'{k}={v:.3f}' if isinstance(v, float) else f'{k}={v}'
+                                     for k, v in r.items()))
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
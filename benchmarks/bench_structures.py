@@ -0,0 +1,570 @@
+# benchmarks/bench_structures.py
+# Reproducible benchmarks for the core data structures at library scale.
+#
+#   python -m benchmarks.bench_structures --sizes 1000 100000 1000000 --out bench.json
+#   python -m benchmarks.bench_structures compare old.json new.json
+#
+# Synthetic libraries are generated from a fixed seed in three shapes:
+# 'random' (shuffled unique titles), 'sorted' (ascending titles, worst case
+# for the unbalanced BST) and 'duplicates' (1% distinct titles). Every case
+# is timed once without tracing and, unless --no-memory, run again under
+# tracemalloc for peak memory. Results carry the git commit so runs from
+# different commits can be compared case by case.
+import os
+import sys
+import gc
+import json
+import time
+import marshal
+import random
+import argparse
+import platform
+import tempfile
+import subprocess
+import tracemalloc
+from contextlib import redirect_stdout
+from typing import Callable, Dict, List, Tuple
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BASE_DIR not in sys.path:
+    sys.path.insert(0, BASE_DIR)
+
+from playlist_dll import Playlist
+from hashmap import SongMap
+from stack_queue import RecentlyPlayed, UpcomingSongs
+from heap_bst import SongHeap, SongBST
+from bst import BST, Node as BSTNode
+from library_index import LibraryIndex
+from library_db import LibraryDB, TrackedDict
+from metadata import MetadataCache
+from listening_stats import ListeningStats
+from recommend import CoOccurrence
+from sorting import SortIndex, ORDERS
+from facets import FacetIndex
+import snapshot
+
+SHAPES = ('random', 'sorted', 'duplicates')
+DEFAULT_SIZES = (1000, 100000, 1000000)
+SAMPLE = 200   # operations sampled for O(n)-per-op cases
+
+CASES: List[Tuple[str, Callable]] = []
+
+
+def case(name: str):
+    def register(fn):
+        CASES.append((name, fn))
+        return fn
+    return register
+
+
+class Library:
+    def __init__(self, size: int, shape: str, seed: int):
+        self.rng = random.Random(f'{seed}-{size}-{shape}')
+        if shape == 'duplicates':
+            distinct = max(1, size // 100)
+            self.titles = [f'Track {self.rng.randrange(distinct):07d}' for _ in range(size)]
+        else:
+            self.titles = [f'Track {i:07d}' for i in range(size)]
+            if shape == 'random':
+                self.rng.shuffle(self.titles)
+        self.paths = [f'/music/{i % 1000:03d}/{t}-{i}.mp3' for i, t in enumerate(self.titles)]
+        self.size = size
+
+    def playlist(self) -> Playlist:
+        pl = Playlist()
+        for t, p in zip(self.titles, self.paths):
+            pl.insert_song_end(t, p)
+        return pl
+
+    def sample(self, seq, n=SAMPLE):
+        return [seq[self.rng.randrange(len(seq))] for _ in range(n)]
+
+    def zipf_plays(self, n: int) -> List[str]:
+        # a few titles get most plays, like a real listening history
+        weights = [1.0 / (i + 1) for i in range(min(len(self.titles), 10000))]
+        return self.rng.choices(self.titles[:len(weights)], weights=weights, k=n)
+
+
+# ----------------- Cases -----------------
+# Each case does its setup, then returns (timed callable, operation count).
+
+@case('playlist.insert_end')
+def _(lib):
+    def run():
+        lib.playlist()
+    return run, lib.size
+
+
+@case('playlist.find_by_title')
+def _(lib):
+    pl = lib.playlist()
+    keys = lib.sample(lib.titles)
+    return lambda: [pl.find_node_by_title(t) for t in keys], len(keys)
+
+
+@case('playlist.delete_by_title')
+def _(lib):
+    pl = lib.playlist()
+    keys = lib.sample(lib.titles)
+    return lambda: [pl.delete_song_by_title(t) for t in keys], len(keys)
+
+
+@case('playlist.remove_node')
+def _(lib):
+    pl = lib.playlist()
+    nodes = list(pl.iter_nodes())
+    lib.rng.shuffle(nodes)
+    return lambda: [pl.remove_node(n) for n in nodes], len(nodes)
+
+
+@case('playlist.substring_search')
+def _(lib):
+    pl = lib.playlist()
+    queries = [t[-3:] for t in lib.sample(lib.titles, 5)]
+
+    def run():
+        for q in queries:
+            [n for n in pl.iter_nodes() if q in n.title.lower()]
+    return run, len(queries)
+
+
+@case('playlist.shuffle')
+def _(lib):
+    pl = lib.playlist()
+    random.seed(lib.rng.random())
+    return pl.shuffle_playlist, 1
+
+
+@case('songmap.rebuild')
+def _(lib):
+    pl = lib.playlist()
+    sm = SongMap()
+    return lambda: sm.rebuild_from_playlist(pl), lib.size
+
+
+@case('songmap.search_title')
+def _(lib):
+    sm = SongMap()
+    sm.rebuild_from_playlist(lib.playlist())
+    keys = lib.sample(lib.titles, min(lib.size, 100000))
+    return lambda: [sm.search_song(t) for t in keys], len(keys)
+
+
+@case('songmap.search_path')
+def _(lib):
+    sm = SongMap()
+    sm.rebuild_from_playlist(lib.playlist())
+    keys = lib.sample(lib.paths, min(lib.size, 100000))
+    return lambda: [sm.search_path(p) for p in keys], len(keys)
+
+
+@case('songmap.remove')
+def _(lib):
+    sm = SongMap()
+    sm.rebuild_from_playlist(lib.playlist())
+    keys = list(lib.titles)
+    return lambda: [sm.remove_from_hash(t) for t in keys], len(keys)
+
+
+@case('recently_played.push')
+def _(lib):
+    history = RecentlyPlayed(max_size=500)
+    plays = lib.zipf_plays(lib.size)
+    return lambda: [history.push(t) for t in plays], len(plays)
+
+
+@case('upcoming.enqueue_dequeue')
+def _(lib):
+    queue = UpcomingSongs()
+    titles = lib.titles
+
+    def run():
+        for t in titles:
+            queue.enqueue(t)
+        while queue.dequeue() is not None:
+            pass
+    return run, 2 * lib.size
+
+
+@case('upcoming.edit')
+def _(lib):
+    # DJ-style edits in a full queue: play-next, move, remove by position
+    queue = UpcomingSongs(seed=1)
+    for t in lib.titles:
+        queue.enqueue(t)
+    ops = [(lib.rng.randrange(lib.size), lib.rng.randrange(lib.size)) for _ in range(1000)]
+
+    def run():
+        for src, dst in ops:
+            queue.insert_next(lib.titles[src])
+            queue.move(src, dst)
+            queue.remove_at(dst)
+    return run, 3 * len(ops)
+
+
+@case('songheap.add_play')
+def _(lib):
+    heap = SongHeap()
+    plays = lib.zipf_plays(lib.size)
+    return lambda: [heap.add_play(t) for t in plays], len(plays)
+
+
+@case('songheap.get_top10')
+def _(lib):
+    heap = SongHeap()
+    for t in lib.zipf_plays(lib.size):
+        heap.add_play(t)
+    return lambda: [heap.get_top(10) for _ in range(1000)], 1000
+
+
+@case('songheap.rebuild')
+def _(lib):
+    heap = SongHeap()
+    heap.counter.update({t: lib.rng.randrange(1, 500) for t in lib.titles})
+    return heap._rebuild_heap, 1
+
+
+@case('stats.record')
+def _(lib):
+    # plays spread over three years: every add touches an hour, day and month bucket
+    stats = ListeningStats()
+    plays = lib.zipf_plays(lib.size)
+    start = time.time() - 3 * 365 * 86400
+    step = 3 * 365 * 86400 / len(plays)
+
+    def run():
+        for i, t in enumerate(plays):
+            stats.add(t, start + i * step)
+    return run, len(plays)
+
+
+@case('stats.top_window')
+def _(lib):
+    # each window merges only the buckets covering it
+    stats = ListeningStats()
+    plays = lib.zipf_plays(lib.size)
+    now = time.time()
+    start = now - 3 * 365 * 86400
+    step = 3 * 365 * 86400 / len(plays)
+    for i, t in enumerate(plays):
+        stats.add(t, start + i * step)
+    stats.prune(now)
+    windows = ('day', 'week', 'month', 'year', 'trending')
+    return lambda: [stats.window(w, 10, now) for w in windows], len(windows)
+
+
+def sessions(lib, n: int, start: float = 0.0) -> List[Tuple[str, float]]:
+    # (title, time) of n plays in listening sessions of about 12 songs
+    plays, t = [], start
+    for i, title in enumerate(lib.zipf_plays(n)):
+        t += 3600.0 if i % 12 == 0 else 200.0
+        plays.append((title, t))
+    return plays
+
+
+@case('recommend.add')
+def _(lib):
+    model = CoOccurrence()
+    plays = sessions(lib, lib.size)
+
+    def run():
+        for title, t in plays:
+            model.add(title, t)
+    return run, len(plays)
+
+
+@case('recommend.session')
+def _(lib):
+    # autofill's lookup: neighbors of the last few plays, recent ones excluded
+    model = CoOccurrence()
+    for title, t in sessions(lib, lib.size):
+        model.add(title, t)
+    seeds = [lib.sample(lib.titles[:10000], 5) for _ in range(1000)]
+    return lambda: [model.recommend(s, 20, exclude=s) for s in seeds], len(seeds)
+
+
+def tagged(lib) -> List[Tuple[str, dict, int]]:
+    # (path, tags, plays): about ten songs an artist, 40 genres, 60 years
+    rng = random.Random(lib.size)
+    songs = []
+    for i, path in enumerate(lib.paths):
+        artist = f'Artist {rng.randrange(max(1, lib.size // 10))}'
+        songs.append((path, {'artist': artist, 'album': f'{artist} {rng.randrange(3)}',
+                             'genre': f'Genre {rng.randrange(40)}', 'date': str(rng.randrange(1966, 2026))},
+                      int(rng.paretovariate(1.2)) - 1))
+    return songs
+
+
+@case('facets.build')
+def _(lib):
+    songs = tagged(lib)
+    return lambda: FacetIndex().build(songs), len(songs)
+
+
+@case('facets.filter')
+def _(lib):
+    # AND of an equality and two ranges, plus genre counts of the result
+    index = FacetIndex()
+    index.build(tagged(lib))
+    queries = [f'genre="Genre {lib.rng.randrange(40)}" AND year>={lib.rng.randrange(1966, 2026)} AND plays>2'
+               for _ in range(100)]
+    return lambda: [index.counts('genre', index.filter(q)) for q in queries], len(queries)
+
+
+def sortable(lib) -> List[tuple]:
+    # (path, title, tags, plays, last played, added) for SortIndex.build
+    return [(path, title, entry, plays, float(i), float(i))
+            for i, ((path, entry, plays), title) in enumerate(zip(tagged(lib), lib.titles))]
+
+
+@case('sort.build')
+def _(lib):
+    # collation keys for every song plus the title permutation
+    songs = sortable(lib)
+    return lambda: SortIndex().build(songs, ('title',)), len(songs)
+
+
+@case('sort.play')
+def _(lib):
+    # a play moves the song in every cached permutation
+    index = SortIndex()
+    index.build(sortable(lib), ORDERS)
+    picks = [lib.rng.choice(lib.paths) for _ in range(1000)]
+
+    def run():
+        for i, path in enumerate(picks):
+            index.set_plays(path, i, lib.size + i)
+    return run, len(picks)
+
+
+@case('bst.insert')
+def _(lib):
+    def run():
+        tree = BST()
+        for t in lib.titles:
+            tree.insert(t)
+    return run, lib.size
+
+
+@case('bst.inorder')
+def _(lib):
+    tree = SongBST()
+    for t in lib.titles:
+        tree.insert(t)
+    return tree.inorder, lib.size
+
+
+# ----------------- Persistence round-trips -----------------
+def open_db() -> LibraryDB:
+    db = LibraryDB(os.path.join(tempfile.mkdtemp(prefix='bench-'), 'library.db'))
+    db.open()
+    return db
+
+
+@case('persist.play_counts')
+def _(lib):
+    counts = {t: lib.rng.randrange(1, 500) for t in lib.titles}
+    db = open_db()
+
+    def run():
+        with db.transaction() as cur:
+            db.save_plays(cur, [], counts)
+        heap = SongHeap()
+        heap.counter.update(db.load_counts())
+        heap._rebuild_heap()
+    return run, len(counts)
+
+
+@case('persist.autosave')
+def _(lib):
+    # one autosave batch (100 plays) into a log that already holds the library
+    db = open_db()
+    with db.transaction() as cur:
+        db.save_plays(cur, [(t, None, 0.0) for t in lib.titles], {t: 1 for t in lib.titles})
+    plays = [(t, None, 1.0) for t in lib.zipf_plays(100)]
+
+    def run():
+        with db.transaction() as cur:
+            db.save_plays(cur, plays, {t: 2 for t, _, _ in plays})
+    return run, len(plays)
+
+
+@case('persist.history')
+def _(lib):
+    db = open_db()
+    with db.transaction() as cur:
+        db.save_plays(cur, [(t, None, 0.0) for t in lib.zipf_plays(min(lib.size, 5000))], {})
+
+    def run():
+        RecentlyPlayed(max_size=500).stack = db.load_history(500)
+    return run, 500
+
+
+@case('persist.library_index')
+def _(lib):
+    db = open_db()
+    index = LibraryIndex(db)
+    index.manifest = TrackedDict({p: [4000000, 1700000000000000000 + i] for i, p in enumerate(lib.paths)})
+
+    def run():
+        index.manifest.changed = set(index.manifest)
+        index.dirty = True
+        index.save()
+        loaded = LibraryIndex(db)
+        loaded.load()
+        loaded.populate(Playlist(), SongMap())
+    return run, lib.size
+
+
+@case('persist.metadata_cache')
+def _(lib):
+    db = open_db()
+    cache = MetadataCache(db)
+    cache.entries = TrackedDict({p: {'duration': 200, 'size': 4000000, 'mtime': i, 'artist': 'Artist',
+                                     'album': 'Album'} for i, p in enumerate(lib.paths)})
+
+    def run():
+        cache.entries.changed = set(cache.entries)
+        cache.dirty = True
+        cache.save()
+        MetadataCache(db).load()
+    return run, lib.size
+
+
+@case('persist.snapshot')
+def _(lib):
+    # warm start: the library's structures read back from one snapshot file
+    songs = sortable(lib)
+    facets, sorts, tree = FacetIndex(), SortIndex(), BST()
+    facets.build([(path, entry, plays) for path, _, entry, plays, _, _ in songs])
+    sorts.build(songs, ('title',))
+    for t in lib.titles:
+        tree.insert(t)
+    state = marshal.dumps({'playlist': (lib.titles, lib.paths), 'bst': snapshot.dump_bst(tree.root),
+                           'metadata': {path: entry for path, _, entry, _, _, _ in songs},
+                           'facets': facets.dump(), 'sorts': sorts.dump()})
+    path = os.path.join(tempfile.mkdtemp(prefix='bench-'), 'snapshot.bin')
+    snapshot.write(path, state, marshal.dumps({}))
+
+    def run():
+        loaded, _ = snapshot.read(path)
+        playlist = Playlist()
+        for title, song in zip(*loaded['playlist']):
+            playlist.insert_song_end(title, song)
+        snapshot.restore_bst(*loaded['bst'], BSTNode)
+        FacetIndex.restore(loaded['facets'])
+        SortIndex.restore(loaded['sorts'])
+    return run, lib.size
+
+
+# ----------------- Runner -----------------
+def measure(build: Callable, lib: Library, memory: bool) -> Dict:
+    gc.collect()
+    run, ops = build(lib)
+    t = time.perf_counter()
+    run()
+    seconds = time.perf_counter() - t
+    result = {'ops': ops, 'seconds': seconds, 'per_op_us': seconds / max(ops, 1) * 1e6}
+    if memory:
+        del run
+        gc.collect()
+        tracemalloc.start()
+        try:
+            run, _ = build(lib)
+            tracemalloc.reset_peak()
+            base = tracemalloc.get_traced_memory()[0]
+            run()
+            result['peak_kib'] = (tracemalloc.get_traced_memory()[1] - base) / 1024
+        finally:
+            tracemalloc.stop()
+    return result
+
+
+def git_commit() -> str:
+    try:
+        out = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BASE_DIR,
+                             stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+        return out.stdout.strip() or 'unknown'
+    except OSError:
+        return 'unknown'
+
+
+def run_suite(sizes, shapes, seed: int, memory: bool, only=None) -> Dict:
+    sys.setrecursionlimit(max(sys.getrecursionlimit(), 10000))
+    results = []
+    for size in sizes:
+        for shape in shapes:
+            lib = Library(size, shape, seed)
+            for name, build in CASES:
+                if only and not any(name.startswith(o) for o in only):
+                    continue
+                entry = {'case': name, 'size': size, 'shape': shape}
+                try:
+                    # the structures print status lines; keep the report readable
+                    with open(os.devnull, 'w') as sink, redirect_stdout(sink):
+                        entry.update(measure(build, lib, memory))
+                except RecursionError:
+                    # the recursive BST degenerates on sorted input
+                    entry['error'] = 'RecursionError'
+                results.append(entry)
+                summary = entry.get('error') or f"{entry['seconds']:.4f}s {entry['per_op_us']:.3f}us/op"
+                if 'peak_kib' in entry:
+                    summary += f" peak {entry['peak_kib']:.0f}KiB"
+                print(f'{name:32} {size:>8} {shape:10} {summary}', flush=True)
+    return {'meta': {'commit': git_commit(), 'python': platform.python_version(),
+                     'platform': platform.platform(), 'seed': seed,
+                     'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S')},
+            'results': results}
+
+
+def compare(old_path: str, new_path: str, threshold: float) -> int:
+    with open(old_path, encoding='utf-8') as f:
+        old = json.load(f)
+    with open(new_path, encoding='utf-8') as f:
+        new = json.load(f)
+    key = lambda r: (r['case'], r['size'], r['shape'])
+    before = {key(r): r for r in old['results']}
+    print(f"{old['meta']['commit']} -> {new['meta']['commit']}")
+    regressions = 0
+    for r in new['results']:
+        o = before.get(key(r))
+        if not o or 'seconds' not in o or 'seconds' not in r:
+            continue
+        ratio = r['seconds'] / o['seconds'] if o['seconds'] else float('inf')
+        flag = ''
+        if ratio > 1 + threshold:
+            flag = '  REGRESSION'
+            regressions += 1
+        elif ratio < 1 - threshold:
+            flag = '  faster'
+        print(f"{r['case']:32} {r['size']:>8} {r['shape']:10} {o['seconds']:.4f}s -> {r['seconds']:.4f}s x{ratio:.2f}{flag}")
+    return 1 if regressions else 0
+
+
+def main(argv=None) -> int:
+    if argv is None:
+        argv = sys.argv[1:]
+    if argv[:1] == ['compare']:
+        p = argparse.ArgumentParser(prog='bench_structures compare')
+        p.add_argument('old')
+        p.add_argument('new')
+        p.add_argument('--threshold', type=float, default=0.15)
+        args = p.parse_args(argv[1:])
+        return compare(args.old, args.new, args.threshold)
+    p = argparse.ArgumentParser(description='Benchmark the core data structures.')
+    p.add_argument('--sizes', type=int, nargs='+', default=list(DEFAULT_SIZES))
+    p.add_argument('--shapes', nargs='+', choices=SHAPES, default=list(SHAPES))
+    p.add_argument('--only', nargs='+', help='case name prefixes to run')
+    p.add_argument('--seed', type=int, default=35)
+    p.add_argument('--no-memory', action='store_true', help='skip the tracemalloc pass')
+    p.add_argument('--out', help='write results as JSON')
+    args = p.parse_args(argv)
+    report = run_suite(args.sizes, args.shapes, args.seed, not args.no_memory, args.only)
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -25,3 +25,27 @@ class BST:
                 node.right = Node(title)
             else:
                 self._insert(node.right, title)
+
+    def delete(self, title):
+        # Removes one node holding title; returns True if found
+        parent, node = None, self.root
+        while node and node.title != title:
+            parent = node
+            node = node.left if title < node.title else node.right
+        if node is None:
+            return False
+        if node.left and node.right:
+            # replace with in-order successor, then unlink the successor
+            succ_parent, succ = node, node.right
+            while succ.left:
+                succ_parent, succ = succ, succ.left
+            node.title = succ.title
+            parent, node = succ_parent, succ
+        child = node.left or node.right
+        if parent is None:
+            self.root = child
+        elif parent.left is node:
+            parent.left = child
+        else:
+            parent.right = child
+        return True
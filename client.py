@@ -0,0 +1,514 @@
+# client.py
+# Client side of the daemon protocol (see daemon.py).
+# DaemonClient is the bare connection: pipelined calls matched by id, pushed
+# events handed to a callback. RemoteService puts the MusicService interface
+# on top of it, keeping local mirrors of the library and the side-panel lists
+# in step with the daemon's events, so the CLI and GUI run unchanged against
+# either one. open_service() picks: the running daemon, a daemon it starts,
+# or (MUZIC_DAEMON=0, or no Unix sockets) an in-process MusicService.
+import os
+import sys
+import json
+import time
+import asyncio
+import itertools
+import subprocess
+from types import SimpleNamespace
+from typing import Callable, List, Optional, Tuple
+
+from observable import Observable
+from playlist_dll import Playlist
+from hashmap import SongMap
+from bst import BST
+from service import MusicService, BASE_DIR, DATA_DIR
+from daemon import SOCKET_PATH, MAX_LINE
+
+DAEMON_SCRIPT = os.path.join(BASE_DIR, 'daemon.py')
+DAEMON_LOG = os.path.join(DATA_DIR, 'daemon.log')
+
+
+class DaemonError(Exception):
+    pass
+
+
+class DaemonClient:
+    def __init__(self, on_event: Optional[Callable[[str, dict], None]] = None):
+        self.on_event = on_event
+        self.reader = None
+        self.writer = None
+        self.ids = itertools.count(1)
+        self.waiting = {}  # id -> (future, apply)
+        self.read_task = None
+        self.on_close = None
+
+    async def connect(self, path: str = SOCKET_PATH) -> None:
+        self.reader, self.writer = await asyncio.open_unix_connection(path, limit=MAX_LINE)
+        self.read_task = asyncio.get_running_loop().create_task(self._read())
+
+    def send(self, cmd: str, **args) -> asyncio.Future:
+        """Writes the request now and returns a future for its result, so a
+        burst of send() calls goes out pipelined."""
+        rid = next(self.ids)
+        fut = asyncio.get_running_loop().create_future()
+        self.waiting[rid] = (fut, args.pop('_apply', None))
+        self.writer.write(json.dumps({'id': rid, 'cmd': cmd, 'args': args}).encode() + b'\n')
+        return fut
+
+    async def call(self, cmd: str, **args):
+        """args['_apply'], if given, is called with the result on the reader
+        task, before any event that followed the response is delivered."""
+        fut = self.send(cmd, **args)
+        await self.writer.drain()
+        return await fut
+
+    async def _read(self) -> None:
+        try:
+            while True:
+                line = await self.reader.readline()
+                if not line:
+                    break
+                message = json.loads(line)
+                if 'event' in message:
+                    if self.on_event:
+                        self.on_event(message['event'], message.get('data') or {})
+                    continue
+                fut, apply = self.waiting.pop(message.get('id'), (None, None))
+                if fut is None or fut.done():
+                    continue
+                if 'error' in message:
+                    fut.set_exception(DaemonError(message['error']))
+                    continue
+                if apply:
+                    apply(message.get('result'))
+                fut.set_result(message.get('result'))
+        except (ConnectionError, ValueError, asyncio.CancelledError):
+            pass
+        finally:
+            for fut, _ in self.waiting.values():
+                if not fut.done():
+                    fut.set_exception(DaemonError('connection to the daemon closed'))
+            self.waiting.clear()
+            if self.on_close:
+                self.on_close()
+
+    def close(self) -> None:
+        if self.writer:
+            self.writer.close()
+        if self.read_task:
+            self.read_task.cancel()
+
+
+# ----------------- Mirrors -----------------
+class MirrorList(Observable):
+    """A list kept equal to a daemon-side Observable by replaying its events.
+    Offers the at()/len() view the panels and the CLI read. With a limit,
+    only the first limit items are shown (the daemon may keep more), and
+    the events are translated to that window."""
+
+    def __init__(self, convert=lambda v: v, limit: Optional[int] = None):
+        super().__init__()
+        self.items = []
+        self.convert = convert
+        self.limit = limit
+        self.stale = False  # after a remote reset, until the next snapshot
+
+    def reset(self, items) -> None:
+        self.items = [self.convert(v) for v in items]
+        self.stale = False
+        self._notify('reset')
+
+    def apply(self, op: str, index, value) -> None:
+        if op == 'reset':
+            self.stale = True
+            return
+        if self.stale:
+            return
+        if op == 'insert':
+            value = self.convert(value)
+            self.items.insert(index, value)
+        elif op == 'remove':
+            del self.items[index]
+        elif op == 'move':
+            value = self.convert(value)
+            src, dst = index
+            del self.items[src]
+            self.items.insert(dst, value)
+            index = tuple(index)
+        elif op == 'update':
+            value = self.convert(value)
+            self.items[index] = value
+        if self.limit is None:
+            self._notify(op, index, value)
+        else:
+            self._notify_window(op, index, value)
+
+    def _notify_window(self, op: str, index, value) -> None:
+        # the same change as seen through the first limit items
+        limit = self.limit
+        if op == 'insert' and index < limit:
+            self._notify('insert', index, value)
+            if len(self.items) > limit:
+                self._notify('remove', limit)     # pushed out of the window
+        elif op == 'remove' and index < limit:
+            self._notify('remove', index)
+            if len(self.items) >= limit:
+                self._notify('insert', limit - 1, self.items[limit - 1])
+        elif op == 'update' and index < limit:
+            self._notify('update', index, value)
+        elif op == 'move':
+            src, dst = index
+            if src < limit and dst < limit:
+                self._notify('move', index, value)
+            elif src < limit or dst < limit:
+                self._notify('reset')
+
+    def _shown(self) -> list:
+        return self.items if self.limit is None else self.items[:self.limit]
+
+    def at(self, index: int):
+        return self._shown()[index]
+
+    def get_all(self) -> list:
+        return list(self._shown())
+
+    def __iter__(self):
+        return iter(self._shown())
+
+    def __len__(self):
+        return len(self.items) if self.limit is None else min(len(self.items), self.limit)
+
+
+class RemotePlayer:
+    """The slice of MusicPlayer the front ends use, backed by the daemon.
+    The position is extrapolated from the last status, like MusicPlayer
+    does from its own anchor."""
+
+    def __init__(self, service: 'RemoteService'):
+        self.service = service
+        self.current_path = None
+        self.crossfade = False
+        self.anchor_pos = 0.0
+        self.anchor_time = None
+
+    def sync(self, status: dict) -> None:
+        self.current_path = status.get('audio_path')
+        self.anchor_pos = status.get('position') or 0.0
+        self.anchor_time = time.monotonic() if status.get('state') == 'playing' else None
+
+    def position(self) -> float:
+        if self.anchor_time is None:
+            return self.anchor_pos
+        return self.anchor_pos + (time.monotonic() - self.anchor_time)
+
+    def is_playing(self) -> bool:
+        return self.anchor_time is not None
+
+    def supports_crossfade(self) -> bool:
+        return self.crossfade
+
+    def set_crossfade(self, seconds: float) -> None:
+        self.service.spawn(self.service.client.call('set_crossfade', seconds=seconds))
+
+    def set_volume(self, vol: float) -> None:
+        self.service.spawn(self.service.client.call('set_volume', volume=vol))
+
+
+class RemoteService:
+    """MusicService's front-end interface, served by the daemon."""
+
+    def __init__(self, path: str = SOCKET_PATH, history_size: Optional[int] = None):
+        self.path = path
+        self.client = DaemonClient(self._on_event)
+        self.playlist = Playlist()
+        self.song_map = SongMap()
+        self.bst = BST()
+        # the daemon keeps its own history length; this front end shows history_size
+        self.history = MirrorList(limit=history_size)
+        self.upcoming = MirrorList()
+        self.heap = MirrorList(tuple)
+        self.lists = {'history': self.history, 'upcoming': self.upcoming, 'top': self.heap}
+        self.player = RemotePlayer(self)
+        self.current = None
+        self.duration = 0
+        self.state = 'stopped'
+        self.autoplay_queue = True
+        self.autofill = 'session'
+        self.listeners: List[Callable] = []
+        self.tasks = set()
+
+    # ----------------- Events & Scheduling -----------------
+    def subscribe(self, fn: Callable[[str, dict], None]) -> None:
+        self.listeners.append(fn)
+
+    def _emit(self, event: str, **data) -> None:
+        for fn in self.listeners:
+            try:
+                fn(event, data)
+            except Exception as e:
+                print(f'Listener failed on {event}:', e)
+
+    def spawn(self, coro, name: Optional[str] = None) -> asyncio.Task:
+        task = asyncio.get_event_loop().create_task(coro, name=name)
+        self.tasks.add(task)
+
+        def done(t):
+            self.tasks.discard(t)
+            if not t.cancelled() and t.exception():
+                print(f'{t.get_name()} failed:', t.exception())
+        task.add_done_callback(done)
+        return task
+
+    # ----------------- Lifecycle -----------------
+    async def connect(self) -> None:
+        await self.client.connect(self.path)
+        self.client.on_close = lambda: self._emit('message', text='Lost the connection to the player daemon.')
+        hello = self.client.send('hello')
+        await self.client.call('subscribe', snapshot=True, _apply=self._apply_snapshot)
+        self.player.crossfade = (await hello)['crossfade']
+
+    def _apply_snapshot(self, snap: dict) -> None:
+        # rebuilt in place: front ends hold on to these objects
+        self.playlist.head = self.playlist.tail = None
+        self.playlist.size = 0
+        for title, path in snap['songs']:
+            self.playlist.insert_song_end(title, path)
+        self.song_map.rebuild_from_playlist(self.playlist)
+        self.bst.root = None
+        for node in self.playlist.iter_nodes():
+            self.bst.insert(node.title)
+        for name, items in (('history', snap['history']), ('upcoming', snap['upcoming']),
+                            ('top', snap['top'])):
+            self.lists[name].reset(items)
+        self._apply_status(snap['status'])
+
+    def _apply_status(self, status: dict) -> None:
+        self.current = self.song_map.search_path(status['path']) if status.get('path') else None
+        self.duration = status.get('duration') or 0
+        self.state = status.get('state', 'stopped')
+        self.autoplay_queue = status.get('autoplay_queue', True)
+        self.autofill = status.get('autofill', self.autofill)
+        self.player.sync(status)
+
+    def load_state(self) -> None:
+        pass  # the daemon holds the state
+
+    def load_library(self) -> None:
+        pass
+
+    async def start(self, load: bool = True) -> None:
+        if self.client.reader is None:
+            await self.connect()
+
+    def shutdown(self) -> None:
+        for task in list(self.tasks):
+            task.cancel()
+        self.client.on_close = None
+        self.client.close()
+
+    async def close(self) -> None:
+        self.shutdown()
+
+    async def quit_daemon(self) -> None:
+        await self.client.call('shutdown')
+
+    # ----------------- Incoming Events -----------------
+    def _node(self, info: Optional[dict]):
+        return self.song_map.search_path(info['path']) if info else None
+
+    def _on_event(self, event: str, data: dict) -> None:
+        if event == 'list':
+            self.lists[data['name']].apply(data['op'], data['index'], data['value'])
+            if data['op'] == 'reset':
+                self.spawn(self.client.call('snapshot', _apply=self._apply_lists))
+            return
+        if event == 'library':
+            self._apply_library(data)
+            self._emit('library', added=[self._node(n) for n in data['added']],
+                       removed=data['removed'], reason=data['reason'])
+            return
+        if event in ('track', 'ready'):
+            self.current = self._node(data['node'])
+            self.duration = data.get('duration') or 0
+            if self.current is None:
+                return
+            data = dict(data, node=self.current)
+        elif event == 'state':
+            self.state = data['state']
+        if event in ('track', 'ready', 'state'):
+            self.spawn(self.client.call('status', _apply=self.player.sync))
+        self._emit(event, **data)
+
+    def _apply_lists(self, snap: dict) -> None:
+        for name in ('history', 'upcoming', 'top'):
+            self.lists[name].reset(snap[name])
+
+    def _apply_library(self, data: dict) -> None:
+        if data['reason'] == 'shuffle':
+            # the daemon rebuilt its playlist; take the new order wholesale
+            self.spawn(self.client.call('snapshot', _apply=self._apply_snapshot))
+            return
+        for info in data['removed']:
+            node = self.song_map.search_path(info['path'])
+            if node:
+                self.playlist.remove_node(node)
+                self.song_map.remove_from_hash(node.title)
+                self.bst.delete(node.title)
+        for info in data['added']:
+            if not self.song_map.search_path(info['path']):
+                node = self.playlist.insert_song_end(info['title'], info['path'])
+                self.song_map.insert_to_hash(node.title, node)
+                self.bst.insert(node.title)
+
+    # ----------------- Commands -----------------
+    async def play(self, node, fade: bool = False, start: float = 0.0):
+        if node is None:
+            return None
+        return self._node(await self.client.call('play', path=node.path, fade=fade, start=start))
+
+    async def play_title(self, title: str):
+        return self._node(await self.client.call('play', title=title))
+
+    async def play_index(self, index: int):
+        return self._node(await self.client.call('play', index=index))
+
+    async def next(self, fade: bool = True):
+        return self._node(await self.client.call('next', fade=fade))
+
+    async def prev(self):
+        return self._node(await self.client.call('prev'))
+
+    async def play_next_from_queue(self, fade: bool = True):
+        return self._node(await self.client.call('play_next', fade=fade))
+
+    async def pause(self) -> None:
+        await self.client.call('pause')
+
+    async def resume(self) -> None:
+        await self.client.call('resume')
+
+    async def toggle(self) -> None:
+        await self.client.call('toggle')
+
+    async def stop(self) -> None:
+        await self.client.call('stop')
+
+    async def seek(self, position: float) -> None:
+        await self.client.call('seek', position=position)
+        self.player.sync(await self.client.call('status'))
+
+    def set_autoplay_queue(self, enabled: bool) -> None:
+        self.autoplay_queue = enabled
+        self.spawn(self.client.call('set_autoplay', enabled=enabled))
+
+    def set_autofill(self, rule: str) -> None:
+        self.autofill = rule
+        self.spawn(self.client.call('set_autofill', rule=rule))
+
+    async def enqueue(self, title: str, next: bool = False):
+        return self._node(await self.client.call('enqueue', title=title, next=next))
+
+    async def queue_remove(self, index: int):
+        return await self.client.call('queue_remove', index=index)
+
+    async def queue_move(self, src: int, dst: int) -> bool:
+        return await self.client.call('queue_move', src=src, dst=dst)
+
+    async def queue_dedupe(self) -> int:
+        return await self.client.call('queue_dedupe')
+
+    async def top_played(self, window: str = 'all', n: int = 10) -> List[Tuple[str, int]]:
+        return [tuple(item) for item in await self.client.call('top', window=window, n=n)]
+
+    async def _checked(self, method: str, **params):
+        try:
+            return await self.client.call(method, **params)
+        except DaemonError as e:
+            # a bad query or sort order reads the same as in-process
+            if str(e).startswith('ValueError: '):
+                raise ValueError(str(e)[12:])
+            raise
+
+    async def filter_songs(self, query: str, limit: int = 0, facets=('genre', 'year'), top: int = 10,
+                           order: Optional[str] = None, reverse: bool = False) -> dict:
+        return await self._checked('filter', query=query, limit=limit, facets=list(facets), top=top,
+                                   order=order, reverse=reverse)
+
+    async def sorted_titles(self, order: str = 'title', reverse: bool = False, limit: int = 0) -> List[str]:
+        return await self._checked('sorted', order=order, reverse=reverse, limit=limit)
+
+    async def similar(self, title: str, n: int = 10) -> List[Tuple[str, float]]:
+        return [tuple(item) for item in await self.client.call('similar', title=title, n=n)]
+
+    async def search(self, query: str) -> List[str]:
+        return await self.client.call('search', query=query)
+
+    async def shuffle(self) -> None:
+        await self.client.call('shuffle')
+
+    async def delete(self, title: str) -> bool:
+        return await self.client.call('delete', title=title)
+
+    async def add_file(self, path: str, copy: bool = False):
+        # the path must make sense to the daemon, which may run elsewhere
+        return self._node(await self.client.call('add_file', path=os.path.abspath(path), copy=copy))
+
+    async def add_folder(self, folder: str) -> list:
+        return await self.client.call('add_folder', folder=os.path.abspath(folder))
+
+    async def import_playlist(self, path: str):
+        return SimpleNamespace(**await self.client.call('import_playlist', path=os.path.abspath(path)))
+
+    async def export_playlist(self, path: str) -> int:
+        return await self.client.call('export_playlist', path=os.path.abspath(path))
+
+    async def clear_history(self) -> None:
+        await self.client.call('clear_history')
+
+    async def find_duplicates(self) -> List[List[str]]:
+        return await self.client.call('find_duplicates')
+
+    async def analyze_loudness(self, progress=None) -> int:
+        # progress stays in the daemon's log
+        return await self.client.call('analyze_loudness')
+
+
+# ----------------- Connecting -----------------
+def daemon_supported() -> bool:
+    return hasattr(asyncio, 'open_unix_connection') and sys.platform != 'win32'
+
+
+def spawn_daemon(path: str = SOCKET_PATH) -> subprocess.Popen:
+    os.makedirs(DATA_DIR, exist_ok=True)
+    with open(DAEMON_LOG, 'ab') as log:
+        return subprocess.Popen([sys.executable, DAEMON_SCRIPT, '--socket', path],
+                                stdin=subprocess.DEVNULL, stdout=log, stderr=log,
+                                start_new_session=True, cwd=BASE_DIR)
+
+
+async def open_service(history_size: int = 500, path: str = SOCKET_PATH, timeout: float = 10.0):
+    """Returns a connected RemoteService, starting the daemon if none runs,
+    or an in-process MusicService (not yet loaded) when the daemon is
+    disabled (MUZIC_DAEMON=0) or can't be reached. history_size is how many
+    recently played songs the front end keeps (the daemon keeps 500 and the
+    remote mirror shows the latest history_size of them)."""
+    mode = os.environ.get('MUZIC_DAEMON', 'auto').lower()
+    if mode in ('0', 'off', 'no') or not daemon_supported():
+        return MusicService(history_size=history_size)
+    remote = RemoteService(path, history_size)
+    try:
+        await remote.connect()
+        return remote
+    except (OSError, DaemonError):
+        pass
+    proc = spawn_daemon(path)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline and proc.poll() is None:
+        await asyncio.sleep(0.05)
+        remote = RemoteService(path, history_size)
+        try:
+            await remote.connect()
+            return remote
+        except (OSError, DaemonError):
+            continue
+    print(f'Could not start the player daemon (see {DAEMON_LOG}); running in-process.')
+    return MusicService(history_size=history_size)
@@ -0,0 +1,375 @@
+# daemon.py
+# Headless player daemon. One long-lived process owns the library, the queue,
+# the play statistics and the playback engine (a MusicService) and serves the
+# CLI and GUI over a Unix domain socket, so state is loaded once and only one
+# process ever writes data/.
+#
+# Protocol: one JSON object per line (UTF-8), both directions.
+#   request   {"id": 7, "cmd": "play", "args": {"title": "Song"}}
+#   response  {"id": 7, "result": ...}   or   {"id": 7, "error": "message"}
+#   event     {"event": "track", "data": {...}}
+# Requests may be pipelined: a client can send many lines without waiting.
+# They are started in the order received; responses carry the request id and
+# a slow command (e.g. find_duplicates) may answer after later ones.
+# Events are pushed only after a "subscribe" request. Besides the service
+# events (track, ready, state, library, message) there is "list", with
+# {"name": "history" | "upcoming" | "top", "op", "index", "value"} in the
+# observable.py format, so clients can mirror the side panels; subscribing
+# with snapshot=true returns the library, lists and status atomically.
+#
+#   python daemon.py [--socket PATH] [--http [HOST:]PORT]
+# --http (or MUZIC_HTTP) also serves the library over HTTP (httpserver.py).
+import os
+import sys
+import json
+import signal
+import socket
+import asyncio
+import argparse
+from typing import Optional
+
+from playlist_dll import Node
+from service import MusicService, DATA_DIR
+
+PROTOCOL_VERSION = 1
+SOCKET_PATH = os.environ.get('MUZIC_SOCKET') or os.path.join(DATA_DIR, 'muzic.sock')
+MAX_LINE = 1 << 20
+OUTBOX_SIZE = 1000  # a client this far behind is disconnected
+
+
+def node_info(node) -> Optional[dict]:
+    return {'title': node.title, 'path': node.path} if node else None
+
+
+def jsonable(value):
+    # event payloads carry playlist nodes; the wire carries title/path
+    if isinstance(value, Node):
+        return node_info(value)
+    if isinstance(value, dict):
+        return {k: jsonable(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [jsonable(v) for v in value]
+    return value
+
+
+class ClientConnection:
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.reader = reader
+        self.writer = writer
+        self.events = None  # set of subscribed event names, None = not subscribed
+        self.outbox = asyncio.Queue(maxsize=OUTBOX_SIZE)
+        self.closed = False
+
+    def send(self, message: dict) -> None:
+        if self.closed:
+            return
+        try:
+            self.outbox.put_nowait(message)
+        except asyncio.QueueFull:
+            # mirrors can't survive a gap; the client reconnects and resyncs
+            self.close()
+
+    async def pump(self) -> None:
+        try:
+            while True:
+                message = await self.outbox.get()
+                self.writer.write(json.dumps(message, separators=(',', ':')).encode() + b'\n')
+                if self.outbox.empty():
+                    await self.writer.drain()
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            self.close()
+
+    async def flush(self, timeout: float = 1.0) -> None:
+        # lets queued messages (e.g. the answer to "shutdown") go out first
+        deadline = asyncio.get_running_loop().time() + timeout
+        while not self.closed and not self.outbox.empty() and asyncio.get_running_loop().time() < deadline:
+            await asyncio.sleep(0.01)
+
+    def close(self) -> None:
+        if not self.closed:
+            self.closed = True
+            self.writer.close()
+
+
+class PlayerDaemon:
+    def __init__(self, service: MusicService, path: str = SOCKET_PATH):
+        self.service = service
+        self.path = path
+        self.clients = set()
+        self.server = None
+        self.stopped = asyncio.Event()
+        self.commands = {name[4:]: getattr(self, name) for name in dir(self) if name.startswith('cmd_')}
+        service.subscribe(self.broadcast)
+        for name, model in (('history', service.history), ('upcoming', service.upcoming),
+                            ('top', service.heap)):
+            model.subscribe(lambda op, index, value, name=name:
+                            self.broadcast('list', name=name, op=op, index=index, value=value))
+
+    async def serve(self) -> None:
+        if await socket_alive(self.path):
+            raise RuntimeError(f'a daemon is already listening on {self.path}')
+        if os.path.exists(self.path):
+            os.unlink(self.path)  # left behind by a daemon that crashed
+        # bound under umask 077, so the socket is 0600 from the moment it exists
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        old = os.umask(0o077)
+        try:
+            sock.bind(self.path)
+        except OSError:
+            sock.close()
+            raise
+        finally:
+            os.umask(old)
+        self.server = await asyncio.start_unix_server(self.handle, sock=sock, limit=MAX_LINE)
+
+    async def close(self) -> None:
+        if self.server:
+            self.server.close()
+            await self.server.wait_closed()
+        await asyncio.gather(*(conn.flush() for conn in self.clients))
+        for conn in list(self.clients):
+            conn.close()
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+
+    def broadcast(self, event: str, data: Optional[dict] = None, **fields) -> None:
+        message = None
+        for conn in list(self.clients):
+            if conn.events is not None and (not conn.events or event in conn.events):
+                if message is None:
+                    message = {'event': event, 'data': jsonable(data if data is not None else fields)}
+                conn.send(message)
+
+    async def handle(self, reader, writer) -> None:
+        conn = ClientConnection(reader, writer)
+        self.clients.add(conn)
+        pump = asyncio.create_task(conn.pump())
+        pending = set()
+        try:
+            while not conn.closed:
+                try:
+                    line = await reader.readline()
+                except (ConnectionError, ValueError):  # ValueError: line over MAX_LINE
+                    break
+                if not line:
+                    break
+                if not line.strip():
+                    continue
+                # each request runs as its own task so pipelined ones overlap
+                task = asyncio.create_task(self.dispatch(conn, line))
+                pending.add(task)
+                task.add_done_callback(pending.discard)
+        finally:
+            self.clients.discard(conn)
+            for task in pending:
+                task.cancel()
+            conn.close()
+            pump.cancel()
+
+    async def dispatch(self, conn: ClientConnection, line: bytes) -> None:
+        rid = None
+        try:
+            request = json.loads(line)
+            rid = request.get('id')
+            handler = self.commands.get(request.get('cmd'))
+            if handler is None:
+                raise ValueError(f"unknown command: {request.get('cmd')}")
+            result = await handler(conn, **(request.get('args') or {}))
+            conn.send({'id': rid, 'result': jsonable(result)})
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            conn.send({'id': rid, 'error': f'{type(e).__name__}: {e}'})
+
+    # ----------------- Session -----------------
+    async def cmd_hello(self, conn):
+        return {'version': PROTOCOL_VERSION, 'pid': os.getpid(),
+                'crossfade': self.service.player.supports_crossfade()}
+
+    async def cmd_subscribe(self, conn, events=None, snapshot=False):
+        # events=None/[]: everything. The snapshot is taken in the same step,
+        # so every later change arrives as an event after this response
+        conn.events = set(events or ())
+        return self.snapshot() if snapshot else None
+
+    async def cmd_unsubscribe(self, conn):
+        conn.events = None
+
+    def snapshot(self) -> dict:
+        s = self.service
+        return {'songs': [[n.title, n.path] for n in s.playlist.iter_nodes()],
+                'history': s.history.get_all(),
+                'upcoming': list(s.upcoming),
+                'top': [list(s.heap.at(i)) for i in range(len(s.heap))],
+                'status': s.status()}
+
+    async def cmd_snapshot(self, conn):
+        return self.snapshot()
+
+    async def cmd_status(self, conn):
+        return self.service.status()
+
+    async def cmd_ping(self, conn):
+        return 'pong'
+
+    async def cmd_shutdown(self, conn):
+        self.stopped.set()
+
+    # ----------------- Playback -----------------
+    async def cmd_play(self, conn, path=None, title=None, index=None, fade=False, start=0.0):
+        s = self.service
+        if index is not None:
+            return await s.play_index(int(index))
+        node = s.song_map.search_path(path) if path else s.song_map.search_song(title or '')
+        return await s.play(node, fade=fade, start=float(start))
+
+    async def cmd_next(self, conn, fade=True):
+        return await self.service.next(fade=fade)
+
+    async def cmd_prev(self, conn):
+        return await self.service.prev()
+
+    async def cmd_play_next(self, conn, fade=True):
+        return await self.service.play_next_from_queue(fade=fade)
+
+    async def cmd_pause(self, conn):
+        await self.service.pause()
+
+    async def cmd_resume(self, conn):
+        await self.service.resume()
+
+    async def cmd_toggle(self, conn):
+        await self.service.toggle()
+
+    async def cmd_stop(self, conn):
+        await self.service.stop()
+
+    async def cmd_seek(self, conn, position):
+        await self.service.seek(float(position))
+
+    async def cmd_set_volume(self, conn, volume):
+        self.service.player.set_volume(float(volume))
+
+    async def cmd_set_crossfade(self, conn, seconds):
+        self.service.player.set_crossfade(float(seconds))
+
+    async def cmd_set_autoplay(self, conn, enabled):
+        self.service.set_autoplay_queue(bool(enabled))
+
+    # ----------------- Library & Queue -----------------
+    async def cmd_set_autofill(self, conn, rule):
+        self.service.set_autofill(rule)
+
+    async def cmd_enqueue(self, conn, title, next=False):
+        return await self.service.enqueue(title, next=bool(next))
+
+    async def cmd_queue_remove(self, conn, index):
+        return await self.service.queue_remove(int(index))
+
+    async def cmd_queue_move(self, conn, src, dst):
+        return await self.service.queue_move(int(src), int(dst))
+
+    async def cmd_queue_dedupe(self, conn):
+        return await self.service.queue_dedupe()
+
+    async def cmd_top(self, conn, window='all', n=10):
+        return await self.service.top_played(window, int(n))
+
+    async def cmd_filter(self, conn, query, limit=0, facets=('genre', 'year'), top=10, order=None, reverse=False):
+        return await self.service.filter_songs(query, int(limit), facets, int(top), order, bool(reverse))
+
+    async def cmd_sorted(self, conn, order='title', reverse=False, limit=0):
+        return await self.service.sorted_titles(order, bool(reverse), int(limit))
+
+    async def cmd_similar(self, conn, title, n=10):
+        return await self.service.similar(title, int(n))
+
+    async def cmd_search(self, conn, query):
+        return await self.service.search(query)
+
+    async def cmd_shuffle(self, conn):
+        await self.service.shuffle()
+
+    async def cmd_delete(self, conn, title):
+        return await self.service.delete(title)
+
+    async def cmd_add_file(self, conn, path, copy=False):
+        return await self.service.add_file(path, copy=copy)
+
+    async def cmd_add_folder(self, conn, folder):
+        return await self.service.add_folder(folder)
+
+    async def cmd_import_playlist(self, conn, path):
+        importer = await self.service.import_playlist(path)
+        return {'matched': importer.matched, 'added': importer.added, 'missing': importer.missing}
+
+    async def cmd_export_playlist(self, conn, path):
+        return await self.service.export_playlist(path)
+
+    async def cmd_clear_history(self, conn):
+        await self.service.clear_history()
+
+    async def cmd_find_duplicates(self, conn):
+        return await self.service.find_duplicates()
+
+    async def cmd_analyze_loudness(self, conn):
+        return await self.service.analyze_loudness()
+
+
+async def socket_alive(path: str) -> bool:
+    try:
+        _, writer = await asyncio.open_unix_connection(path)
+    except (OSError, ValueError):
+        return False
+    writer.close()
+    return True
+
+
+async def run(path: str = SOCKET_PATH, http: Optional[str] = None) -> int:
+    service = MusicService(history_size=500)
+    daemon = PlayerDaemon(service, path)
+    try:
+        await daemon.serve()
+    except RuntimeError as e:
+        print(e)
+        return 1
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, daemon.stopped.set)
+    await service.start()
+    print(f'Music Manager daemon listening on {path} (pid {os.getpid()})', flush=True)
+    web = None
+    if http:
+        from httpserver import LibraryHTTPServer
+        host, _, port = http.rpartition(':')
+        web = LibraryHTTPServer(service, host or '127.0.0.1', int(port))
+        await web.start()
+        print(f'Serving the library on http://{web.host}:{web.port}/', flush=True)
+    try:
+        await daemon.stopped.wait()
+    finally:
+        if web:
+            await web.close()
+        await daemon.close()
+        await service.close()
+    return 0
+
+
+def main(argv=None) -> int:
+    p = argparse.ArgumentParser(description='Music Manager player daemon.')
+    p.add_argument('--socket', default=SOCKET_PATH, help='Unix socket to listen on')
+    p.add_argument('--http', default=os.environ.get('MUZIC_HTTP'), metavar='[HOST:]PORT',
+                   help='also serve the library over HTTP')
+    args = p.parse_args(argv)
+    if not hasattr(asyncio, 'start_unix_server'):
+        print('The daemon needs Unix domain sockets, which this platform lacks.')
+        return 1
+    return asyncio.run(run(args.socket, args.http))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,174 @@
+# decoder.py
+# Decodes audio files to 16-bit PCM for the offline analysis stages and the
+# streaming playback backend. WAV is read with the standard library;
+# everything else goes through ffmpeg when it is on PATH, falling back to
+# pygame's decoder. probe_format() names a file's container from its first
+# bytes, so a mislabelled extension does not decide how it is played.
+import os
+import shutil
+import subprocess
+import wave
+from typing import Iterator, Optional, Tuple
+
+FFMPEG = shutil.which('ffmpeg')
+
+# extension -> format, for every file the library scanner picks up
+FORMATS = {'.mp3': 'mp3', '.flac': 'flac', '.ogg': 'ogg', '.oga': 'ogg', '.opus': 'opus',
+           '.m4a': 'm4a', '.mp4': 'm4a', '.aac': 'aac', '.wav': 'wav', '.aif': 'aiff',
+           '.aiff': 'aiff', '.wma': 'wma'}
+# what SDL_mixer (pygame) decodes by itself
+PYGAME_FORMATS = frozenset({'mp3', 'ogg', 'flac', 'wav'})
+
+
+def probe_format(path: str) -> Optional[str]:
+    """The format of an audio file from its magic bytes, else its extension."""
+    try:
+        with open(path, 'rb') as f:
+            head = f.read(64)
+    except OSError:
+        head = b''
+    if head[:4] == b'fLaC':
+        return 'flac'
+    if head[:4] == b'OggS':
+        return 'opus' if b'OpusHead' in head else 'ogg'
+    if head[:4] == b'RIFF' and head[8:12] == b'WAVE':
+        return 'wav'
+    if head[:4] == b'FORM' and head[8:12] in (b'AIFF', b'AIFC'):
+        return 'aiff'
+    if head[4:8] == b'ftyp':
+        return 'm4a'
+    if head[:4] == b'\x30\x26\xb2\x75':
+        return 'wma'    # ASF header GUID
+    if head[:3] == b'ID3':
+        return 'mp3'
+    if len(head) > 1 and head[0] == 0xFF and head[1] & 0xE0 == 0xE0:
+        # MPEG frame sync: layer bits 00 mark an ADTS (AAC) stream
+        return 'aac' if head[1] & 0x06 == 0 else 'mp3'
+    return FORMATS.get(os.path.splitext(path)[1].lower())
+
+
+def can_decode(fmt: Optional[str]) -> bool:
+    # decode_pcm/open_pcm: WAV always, the rest through ffmpeg or pygame
+    return fmt == 'wav' or (fmt is not None and (FFMPEG is not None or fmt in PYGAME_FORMATS))
+
+
+def _decode_wav(path: str) -> Tuple[bytes, int, int]:
+    with wave.open(path, 'rb') as w:
+        if w.getsampwidth() != 2:
+            raise ValueError('only 16-bit WAV is supported')
+        return w.readframes(w.getnframes()), w.getframerate(), w.getnchannels()
+
+
+def _decode_ffmpeg(path: str, sample_rate: Optional[int], channels: Optional[int],
+                   max_seconds: Optional[float]) -> Tuple[bytes, int, int]:
+    rate = sample_rate or 44100
+    ch = channels or 2
+    cmd = [FFMPEG, '-v', 'error', '-nostdin', '-i', path]
+    if max_seconds:
+        cmd += ['-t', str(max_seconds)]
+    cmd += ['-f', 's16le', '-acodec', 'pcm_s16le', '-ac', str(ch), '-ar', str(rate), '-']
+    out = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True)
+    return out.stdout, rate, ch
+
+
+def _decode_pygame(path: str) -> Tuple[bytes, int, int]:
+    import pygame
+    if not pygame.mixer.get_init():
+        pygame.mixer.init()
+    rate, size, ch = pygame.mixer.get_init()
+    if abs(size) != 16:
+        raise ValueError('pygame mixer is not running in 16-bit mode')
+    return pygame.mixer.Sound(path).get_raw(), rate, ch
+
+
+def decode_pcm(path: str, sample_rate: Optional[int] = None, channels: Optional[int] = None,
+               max_seconds: Optional[float] = None) -> Tuple[bytes, int, int]:
+    """Returns (interleaved s16le bytes, sample_rate, channels).
+
+    sample_rate/channels are honoured when ffmpeg is available; other
+    decoders return the native format and callers convert as needed."""
+    if not os.path.exists(path):
+        raise FileNotFoundError(path)
+    if path.lower().endswith('.wav'):
+        pcm, rate, ch = _decode_wav(path)
+    elif FFMPEG:
+        pcm, rate, ch = _decode_ffmpeg(path, sample_rate, channels, max_seconds)
+    else:
+        pcm, rate, ch = _decode_pygame(path)
+    if max_seconds:
+        pcm = pcm[:int(max_seconds * rate) * ch * 2]
+    return pcm, rate, ch
+
+
+def decode_array(path: str, sample_rate: Optional[int] = None, mono: bool = False,
+                 max_seconds: Optional[float] = None):
+    """Decodes to a float32 NumPy array in [-1, 1], shape (frames, channels)
+    or (frames,) when mono. Resamples linearly if the decoder could not."""
+    import numpy as np
+    pcm, rate, ch = decode_pcm(path, sample_rate, 1 if mono else None, max_seconds)
+    data = np.frombuffer(pcm, dtype='<i2').astype(np.float32) / 32768.0
+    data = data[:len(data) - len(data) % ch].reshape(-1, ch)
+    if mono:
+        data = data.mean(axis=1) if ch > 1 else data[:, 0]
+    if sample_rate and rate != sample_rate and len(data):
+        n = int(len(data) * sample_rate / rate)
+        src = np.arange(len(data), dtype=np.float64)
+        dst = np.linspace(0, len(data) - 1, n)
+        if data.ndim == 1:
+            data = np.interp(dst, src, data).astype(np.float32)
+        else:
+            data = np.stack([np.interp(dst, src, data[:, c]) for c in range(data.shape[1])],
+                            axis=1).astype(np.float32)
+        rate = sample_rate
+    return data, rate
+
+
+def open_pcm(path: str, start: float = 0.0, chunk_bytes: int = 1 << 16
+             ) -> Tuple[int, int, Iterator[bytes]]:
+    """Streaming variant of decode_pcm for playback. Returns (sample_rate,
+    channels, chunks) where chunks yields s16le pieces of about chunk_bytes
+    from start seconds on; only the pygame fallback decodes up front."""
+    if not os.path.exists(path):
+        raise FileNotFoundError(path)
+    if path.lower().endswith('.wav'):
+        w = wave.open(path, 'rb')
+        if w.getsampwidth() != 2:
+            w.close()
+            raise ValueError('only 16-bit WAV is supported')
+        rate, ch = w.getframerate(), w.getnchannels()
+        w.setpos(min(int(start * rate), w.getnframes()))
+
+        def chunks():
+            try:
+                frames = max(1, chunk_bytes // (2 * ch))
+                while True:
+                    data = w.readframes(frames)
+                    if not data:
+                        return
+                    yield data
+            finally:
+                w.close()
+        return rate, ch, chunks()
+    if FFMPEG:
+        rate, ch = 44100, 2
+        cmd = [FFMPEG, '-v', 'error', '-nostdin']
+        if start:
+            cmd += ['-ss', str(start)]
+        cmd += ['-i', path, '-f', 's16le', '-acodec', 'pcm_s16le',
+                '-ac', str(ch), '-ar', str(rate), '-']
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+
+        def chunks():
+            try:
+                while True:
+                    data = proc.stdout.read(chunk_bytes)
+                    if not data:
+                        return
+                    yield data
+            finally:
+                proc.kill()
+                proc.wait()
+        return rate, ch, chunks()
+    pcm, rate, ch = _decode_pygame(path)
+    view = memoryview(pcm)[int(start * rate) * 2 * ch:]
+    return rate, ch, (view[i:i + chunk_bytes] for i in range(0, len(view), chunk_bytes))
@@ -0,0 +1,228 @@
+# duplicates.py
+# Duplicate detection across the library.
+# Pass 1 groups byte-identical files by content hash (only files sharing a
+# size are hashed). Pass 2 compares audio fingerprints of one representative
+# per group: 32-bit spectral sub-fingerprints (Haitsma/Kalker style) are
+# sampled into an LSH index, so only colliding pairs get the exact
+# bit-error-rate check instead of all n^2 pairs.
+import os
+import hashlib
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterable, List, Optional
+
+FP_RATE = 11025
+FP_FRAME = 2048
+FP_HOP = 256
+FP_SECONDS = 120
+FP_BANDS = 33            # 33 band energies -> 32 difference bits
+LSH_SAMPLE_RATE = 32     # index 1 in 32 sub-fingerprint values
+LSH_MIN_HITS = 2
+LSH_MAX_POSTING = 50
+MAX_BER = 0.35           # bit error rate under which two tracks match
+MAX_SHIFT = 16           # frames of misalignment tried when verifying
+
+
+def content_hash(path: str, chunk_size: int = 1 << 20) -> str:
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            h.update(chunk)
+    return h.hexdigest()
+
+
+# ----------------- Fingerprints -----------------
+def compute_fingerprint(path: str):
+    """Returns a uint32 array with one sub-fingerprint per analysis frame."""
+    import numpy as np
+    from decoder import decode_array
+    samples, _ = decode_array(path, FP_RATE, mono=True, max_seconds=FP_SECONDS)
+    if len(samples) < FP_FRAME * 2:
+        return np.zeros(0, dtype=np.uint32)
+    n_frames = 1 + (len(samples) - FP_FRAME) // FP_HOP
+    frames = np.lib.stride_tricks.as_strided(
+        samples, shape=(n_frames, FP_FRAME),
+        strides=(samples.strides[0] * FP_HOP, samples.strides[0]))
+    power = np.abs(np.fft.rfft(frames * np.hanning(FP_FRAME).astype(np.float32), axis=1)) ** 2
+    # log-spaced bands between 300 Hz and 2 kHz carry most of the robust energy
+    edges = np.geomspace(300, 2000, FP_BANDS + 1)
+    bins = np.round(edges * FP_FRAME / FP_RATE).astype(int)
+    csum = np.cumsum(power, axis=1)
+    energy = csum[:, bins[1:] - 1] - csum[:, bins[:-1] - 1]
+    # silent frames produce the same bits in every track; leave them out
+    loud = energy.sum(axis=1) > 1e-3 * np.median(energy.sum(axis=1))
+    energy = energy[loud]
+    if len(energy) < 2:
+        return np.zeros(0, dtype=np.uint32)
+    diff = energy[:, :-1] - energy[:, 1:]
+    bits = (diff[1:] - diff[:-1]) > 0
+    weights = (1 << np.arange(32, dtype=np.uint64)).astype(np.uint64)
+    return (bits.astype(np.uint64) @ weights).astype(np.uint32)
+
+
+def _fingerprint_worker(path: str) -> Optional[bytes]:
+    try:
+        return compute_fingerprint(path).tobytes()
+    except Exception as e:
+        print(f'Could not fingerprint {path}: {e}')
+        return None
+
+
+def bit_error_rate(a, b, max_shift: int = MAX_SHIFT) -> float:
+    # best BER over small time offsets, since encoders add different delays
+    import numpy as np
+    best = 1.0
+    for shift in range(-max_shift, max_shift + 1):
+        x = a[shift:] if shift >= 0 else a
+        y = b if shift >= 0 else b[-shift:]
+        n = min(len(x), len(y))
+        if n < 32:
+            continue
+        xor = np.bitwise_xor(x[:n], y[:n])
+        errors = np.unpackbits(xor.view(np.uint8)).sum()
+        best = min(best, errors / (32.0 * n))
+    return best
+
+
+class FingerprintLSH:
+    """Candidate search over sub-fingerprints.
+
+    Each 32-bit sub-fingerprint is a locality-sensitive hash of a ~23 ms
+    window: near-duplicates share many exact values, unrelated tracks almost
+    none. A consistent 1/SAMPLE_RATE sample of values is indexed so memory
+    stays small; values shared by too many tracks (silence, test tones) are
+    ignored, and pairs colliding MIN_HITS times become candidates.
+    """
+
+    def __init__(self, sample_rate: int = LSH_SAMPLE_RATE, min_hits: int = LSH_MIN_HITS,
+                 max_posting: int = LSH_MAX_POSTING):
+        self.sample_rate = sample_rate
+        self.min_hits = min_hits
+        self.max_posting = max_posting
+        self.postings: Dict[int, List[str]] = defaultdict(list)
+
+    def sample(self, fp):
+        import numpy as np
+        values = np.unique(fp)
+        with np.errstate(over='ignore'):
+            mixed = values.astype(np.uint64) * np.uint64(2654435761) & np.uint64(0xFFFFFFFF)
+        # top bits of a multiplicative hash are well mixed, low bits are not
+        return values[mixed < np.uint64(2 ** 32 // self.sample_rate)]
+
+    def add(self, key: str, fp) -> None:
+        for value in self.sample(fp).tolist():
+            self.postings[value].append(key)
+
+    def candidate_pairs(self):
+        hits = defaultdict(int)
+        for keys in self.postings.values():
+            if len(keys) < 2 or len(keys) > self.max_posting:
+                continue
+            for i in range(len(keys)):
+                for j in range(i + 1, len(keys)):
+                    a, b = keys[i], keys[j]
+                    hits[(a, b) if a < b else (b, a)] += 1
+        return [pair for pair, n in hits.items() if n >= self.min_hits]
+
+
+class _UnionFind:
+    def __init__(self):
+        self.parent = {}
+
+    def find(self, x):
+        self.parent.setdefault(x, x)
+        while self.parent[x] != x:
+            self.parent[x] = self.parent[self.parent[x]]
+            x = self.parent[x]
+        return x
+
+    def union(self, a, b):
+        ra, rb = self.find(a), self.find(b)
+        if ra != rb:
+            self.parent[rb] = ra
+
+
+# ----------------- Detector -----------------
+class DuplicateFinder:
+    """Finds duplicate groups among paths.
+
+    Content hashes are stored in the metadata cache ('sha'), fingerprints in
+    cache_dir as raw uint32 files named by content hash, so renamed copies and
+    later runs reuse earlier work.
+    """
+
+    def __init__(self, metadata, cache_dir: str, workers: Optional[int] = None,
+                 max_ber: float = MAX_BER):
+        self.metadata = metadata
+        self.cache_dir = cache_dir
+        self.workers = workers
+        self.max_ber = max_ber
+
+    def _hash(self, path: str) -> str:
+        sha = self.metadata.get(path).get('sha')
+        if sha is None:
+            sha = content_hash(path)
+            self.metadata.update(path, sha=sha)
+        return sha
+
+    def exact_groups(self, paths: Iterable[str]) -> Dict[str, List[str]]:
+        # sha -> paths; files with a unique size cannot have a byte-identical twin
+        by_size = defaultdict(list)
+        for path in paths:
+            try:
+                by_size[os.path.getsize(path)].append(path)
+            except OSError:
+                continue
+        groups = {}
+        for same_size in by_size.values():
+            if len(same_size) == 1:
+                groups[f'size:{same_size[0]}'] = same_size
+                continue
+            for path in same_size:
+                groups.setdefault(self._hash(path), []).append(path)
+        return groups
+
+    def _fp_path(self, sha: str) -> str:
+        return os.path.join(self.cache_dir, sha + '.u32')
+
+    def fingerprints(self, reps: Dict[str, str]) -> Dict[str, object]:
+        """reps: group key -> representative path. Returns key -> fingerprint."""
+        import numpy as np
+        os.makedirs(self.cache_dir, exist_ok=True)
+        result, todo = {}, []
+        for key, path in reps.items():
+            sha = self._hash(path)
+            fp_file = self._fp_path(sha)
+            if os.path.exists(fp_file):
+                result[key] = np.fromfile(fp_file, dtype=np.uint32)
+            else:
+                todo.append((key, path, fp_file))
+        if todo:
+            with ProcessPoolExecutor(max_workers=self.workers) as pool:
+                paths = [path for _, path, _ in todo]
+                for (key, _path, fp_file), raw in zip(todo, pool.map(_fingerprint_worker, paths, chunksize=4)):
+                    if raw is None:
+                        continue
+                    with open(fp_file, 'wb') as f:
+                        f.write(raw)
+                    result[key] = np.frombuffer(raw, dtype=np.uint32)
+        return result
+
+    def find(self, paths: Iterable[str]) -> List[List[str]]:
+        groups = self.exact_groups(paths)
+        reps = {key: members[0] for key, members in groups.items()}
+        fps = self.fingerprints(reps)
+        lsh = FingerprintLSH()
+        for key, fp in fps.items():
+            lsh.add(key, fp)
+        uf = _UnionFind()
+        for a, b in lsh.candidate_pairs():
+            if bit_error_rate(fps[a], fps[b]) <= self.max_ber:
+                uf.union(a, b)
+        merged = defaultdict(list)
+        for key, members in groups.items():
+            merged[uf.find(key)].extend(members)
+        return [sorted(members) for members in merged.values() if len(members) > 1]
@@ -0,0 +1,393 @@
+# facets.py
+# Faceted browsing: "genre=synthwave AND year>=2020 AND plays>5".
+# Every song gets a small integer id and every facet value (an artist, a
+# genre, a year, a play count...) a bitmap of the ids that have it, so a
+# filter is a few big-integer ANDs/ORs done in C and a facet count is a
+# popcount. A bitmap is a Python int plus an offset (its lowest set bit,
+# rounded down to a word), so it costs its span rather than the whole id
+# range; ids are handed out in artist/album order when the index is built,
+# which keeps each artist's and album's songs in one short run.
+#
+#   query  := and ('OR' and)*
+#   and    := not ('AND' not)*
+#   not    := 'NOT' not | '(' query ')' | field op value
+#   op     := = != < <= > >=      (ordering for year and plays only)
+# Values may be quoted ("drum and bass"); matching ignores case.
+import os
+import re
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+FIELDS = ('artist', 'album', 'genre', 'year', 'format', 'plays')
+NUMERIC = ('year', 'plays')
+TOKEN = re.compile(r'\s*(?:(\(|\))|(!=|>=|<=|=|<|>)|"([^"]*)"|([^\s()=!<>"]+))')
+COMPARE = {'<': int.__lt__, '<=': int.__le__, '>': int.__gt__, '>=': int.__ge__}
+YEAR = re.compile(r'\d{4}')
+NONE = (None, None)
+
+
+def bucket(field: str, key: int) -> int:
+    # coarse ranges for the numeric facets: decades, and plays by power of two
+    return key // 10 if field == 'year' else key.bit_length()
+
+
+def bucket_bounds(field: str, b: int) -> Tuple[int, int]:
+    if field == 'year':
+        return b * 10, b * 10 + 9
+    return (0, 0) if b == 0 else (1 << (b - 1), (1 << b) - 1)
+
+
+class Bitmap:
+    __slots__ = ('off', 'bits')
+
+    def __init__(self, off: int = 0, bits: int = 0):
+        self.off = off
+        self.bits = bits
+        self._trim()
+
+    def _trim(self) -> None:
+        if not self.bits:
+            self.off = 0
+            return
+        low = ((self.bits & -self.bits).bit_length() - 1) & ~63
+        if low:
+            self.bits >>= low
+            self.off += low
+
+    @classmethod
+    def from_ids(cls, ids: List[int]) -> 'Bitmap':
+        # ids in ascending order
+        if not ids:
+            return cls()
+        off = ids[0] & ~63
+        if ids[-1] - ids[0] + 1 == len(ids):
+            # one run, as an artist's or album's songs are after build()
+            return cls(off, ((1 << len(ids)) - 1) << (ids[0] - off))
+        buf = bytearray(((ids[-1] - off) >> 3) + 1)
+        for i in ids:
+            i -= off
+            buf[i >> 3] |= 1 << (i & 7)
+        return cls(off, int.from_bytes(buf, 'little'))
+
+    def __and__(self, other: 'Bitmap') -> 'Bitmap':
+        lo = max(self.off, other.off)
+        return Bitmap(lo, (self.bits >> (lo - self.off)) & (other.bits >> (lo - other.off)))
+
+    def __or__(self, other: 'Bitmap') -> 'Bitmap':
+        lo = min(self.off, other.off)
+        return Bitmap(lo, (self.bits << (self.off - lo)) | (other.bits << (other.off - lo)))
+
+    def __sub__(self, other: 'Bitmap') -> 'Bitmap':
+        shift = other.off - self.off
+        bits = other.bits << shift if shift >= 0 else other.bits >> -shift
+        return Bitmap(self.off, self.bits & ~bits)
+
+    def __len__(self) -> int:
+        return self.bits.bit_count()
+
+    def __bool__(self) -> bool:
+        return self.bits != 0
+
+    def __iter__(self) -> Iterator[int]:
+        # ids in ascending order; the scan for set bits runs in C
+        s = bin(self.bits)[:1:-1]
+        i = s.find('1')
+        while i >= 0:
+            yield self.off + i
+            i = s.find('1', i + 1)
+
+    def add(self, i: int) -> None:
+        if not self.bits:
+            self.off = i & ~63
+        elif i < self.off:
+            low = i & ~63
+            self.bits <<= self.off - low
+            self.off = low
+        self.bits |= 1 << (i - self.off)
+
+    def discard(self, i: int) -> None:
+        i -= self.off
+        if i >= 0 and self.bits >> i & 1:
+            self.bits ^= 1 << i
+            self._trim()
+
+
+def union(bitmaps: List[Bitmap]) -> Bitmap:
+    # pairwise, so the big shifts happen log(n) times per id instead of n
+    if not bitmaps:
+        return Bitmap()
+    while len(bitmaps) > 1:
+        bitmaps = [bitmaps[i] | bitmaps[i + 1] if i + 1 < len(bitmaps) else bitmaps[i]
+                   for i in range(0, len(bitmaps), 2)]
+    return bitmaps[0]
+
+
+def text_value(value) -> tuple:
+    value = str(value).strip() if value else ''
+    return (value.lower(), value) if value else NONE
+
+
+def facet_values(path: str, entry: dict, plays: int) -> tuple:
+    # one (key, label) per field in FIELDS; key None = no value
+    if entry:
+        date = entry.get('date')
+        year = YEAR.search(str(date)) if date else None
+        tags = (text_value(entry.get('artist')), text_value(entry.get('album')), text_value(entry.get('genre')),
+                (int(year.group()), year.group()) if year else NONE)
+    else:
+        tags = (NONE, NONE, NONE, NONE)
+    # the probed format (decoder.probe_format) where the tags have been read
+    ext = path[path.rfind('.') + 1:].lower() if '.' in os.path.basename(path) else None
+    ext = (entry or {}).get('codec') or ext
+    return tags + ((ext, ext) if ext else NONE, (plays, str(plays)))
+
+
+class FacetIndex:
+    def __init__(self):
+        self.paths: List[Optional[str]] = []      # id -> path, None once removed
+        self.ids: Dict[str, int] = {}
+        self.rows: List[Optional[tuple]] = []     # id -> facet_values()
+        self.bitmaps: Dict[str, Dict[object, Bitmap]] = {f: {} for f in FIELDS}
+        self.labels: Dict[str, Dict[object, str]] = {f: {} for f in FIELDS}   # key -> value as tagged
+        self.buckets: Dict[str, Dict[int, Bitmap]] = {f: {} for f in NUMERIC}  # for range queries
+        self.all = Bitmap()
+
+    def build(self, songs: Iterable[Tuple[str, dict, int]]) -> None:
+        """Indexes (path, metadata entry, plays) from scratch, numbering the
+        songs in artist/album/year order."""
+        rows = [(facet_values(path, entry, plays), path) for path, entry, plays in songs]
+        rows.sort(key=lambda r: (r[0][0][0] or '', r[0][1][0] or '', r[0][3][0] or 0, r[1]))
+        self.__init__()
+        self.rows = [row for row, _ in rows]
+        self.paths = [path for _, path in rows]
+        self.ids = {path: i for i, path in enumerate(self.paths)}
+        for column, field in enumerate(FIELDS):
+            members: Dict[object, List[int]] = {}
+            labels = self.labels[field]
+            for i, row in enumerate(self.rows):
+                key, label = row[column]
+                if key is not None:
+                    ids = members.get(key)
+                    if ids is None:
+                        ids = members[key] = []
+                        labels[key] = label
+                    ids.append(i)
+            self.bitmaps[field] = {key: Bitmap.from_ids(ids) for key, ids in members.items()}
+            if field in NUMERIC:
+                grouped: Dict[int, List[int]] = {}
+                for key, ids in members.items():
+                    grouped.setdefault(bucket(field, key), []).extend(ids)
+                self.buckets[field] = {b: Bitmap.from_ids(sorted(ids)) for b, ids in grouped.items()}
+        self.all = Bitmap(0, (1 << len(rows)) - 1)
+
+    # ----------------- Updates -----------------
+    def _set(self, i: int, row: tuple) -> None:
+        self.rows[i] = row
+        for field, (key, label) in zip(FIELDS, row):
+            if key is not None:
+                self.bitmaps[field].setdefault(key, Bitmap()).add(i)
+                self.labels[field].setdefault(key, label)
+                if field in NUMERIC:
+                    self.buckets[field].setdefault(bucket(field, key), Bitmap()).add(i)
+
+    def _unset(self, i: int) -> None:
+        for field, (key, _) in zip(FIELDS, self.rows[i]):
+            bitmap = self.bitmaps[field].get(key)
+            if bitmap is not None:
+                bitmap.discard(i)
+                if not bitmap:
+                    del self.bitmaps[field][key]
+                    self.labels[field].pop(key, None)
+            if field in NUMERIC and key is not None:
+                b = bucket(field, key)
+                coarse = self.buckets[field][b]
+                coarse.discard(i)
+                if not coarse:
+                    del self.buckets[field][b]
+        self.rows[i] = None
+
+    def update(self, path: str, entry: dict, plays: int) -> None:
+        # new songs are numbered at the end until the next build()
+        row = facet_values(path, entry, plays)
+        i = self.ids.get(path)
+        if i is None:
+            i = self.ids[path] = len(self.paths)
+            self.paths.append(path)
+            self.rows.append(None)
+            self.all.add(i)
+        elif self.rows[i] == row:
+            return
+        else:
+            self._unset(i)
+        self._set(i, row)
+
+    def set_plays(self, path: str, plays: int) -> None:
+        i = self.ids.get(path)
+        if i is not None and self.rows[i][-1][0] != plays:
+            row = self.rows[i][:-1] + ((plays, str(plays)),)
+            self._unset(i)
+            self._set(i, row)
+
+    def remove(self, path: str) -> None:
+        i = self.ids.pop(path, None)
+        if i is not None:
+            self._unset(i)
+            self.paths[i] = None
+            self.all.discard(i)
+
+    # ----------------- Queries -----------------
+    def filter(self, query: str) -> Bitmap:
+        """Songs matching query (all songs for an empty one); raises
+        ValueError on a malformed query."""
+        tokens = []
+        pos, query = 0, query.strip()
+        while pos < len(query):
+            m = TOKEN.match(query, pos)
+            if not m or m.end() == pos:
+                raise ValueError(f'unexpected {query[pos:].strip()[:20]!r}')
+            paren, op, quoted, word = m.groups()
+            if word is not None and word.upper() in ('AND', 'OR', 'NOT'):
+                tokens.append(('kw', word.upper()))
+            elif word is not None or quoted is not None:
+                tokens.append(('value', word if word is not None else quoted))
+            else:
+                tokens.append(('op', paren or op))
+            pos = m.end()
+        if not tokens:
+            return self.all
+        parser = _Parser(self, tokens)
+        result = parser.query()
+        if parser.pos < len(tokens):
+            raise ValueError(f'unexpected {tokens[parser.pos][1]!r}')
+        return result
+
+    def match(self, field: str, op: str, value: str) -> Bitmap:
+        if field not in FIELDS:
+            raise ValueError(f'unknown facet {field!r} (one of {", ".join(FIELDS)})')
+        values = self.bitmaps[field]
+        if field in NUMERIC:
+            try:
+                key = int(value)
+            except ValueError:
+                raise ValueError(f'{field} needs a number, not {value!r}')
+        elif op in COMPARE:
+            raise ValueError(f'{field} can only be compared with = or !=')
+        else:
+            key = value.strip().lower()
+        if op == '=':
+            return values.get(key) or Bitmap()
+        if op == '!=':
+            return self.all - values[key] if key in values else self.all
+        # whole buckets inside the range, exact values from the edge buckets
+        test = COMPARE[op]
+        parts = []
+        for b, bitmap in self.buckets[field].items():
+            lo, hi = bucket_bounds(field, b)
+            if test(lo, key) and test(hi, key):
+                parts.append(bitmap)
+            elif test(lo, key) or test(hi, key):
+                keys = range(lo, hi + 1) if hi - lo < len(values) else [k for k in values if lo <= k <= hi]
+                parts += [values[k] for k in keys if k in values and test(k, key)]
+        return union(parts)
+
+    def counts(self, field: str, within: Optional[Bitmap] = None, top: int = 10) -> List[Tuple[str, int]]:
+        """The most common values of field among within (default: all)."""
+        values = self.bitmaps[field]
+        if within is None or within is self.all:
+            counts = [(len(bitmap), key) for key, bitmap in values.items()]
+        elif len(within) < len(values):
+            # fewer songs than values (e.g. artists of a narrow filter): tally the rows
+            column = FIELDS.index(field)
+            tally: Dict[object, int] = {}
+            for i in within:
+                key = self.rows[i][column][0] if self.rows[i] else None
+                if key is not None:
+                    tally[key] = tally.get(key, 0) + 1
+            counts = [(n, key) for key, n in tally.items()]
+        else:
+            counts = [(len(bitmap & within), key) for key, bitmap in values.items()]
+        counts.sort(key=lambda c: (-c[0], str(c[1])))
+        return [(self.labels[field][key], n) for n, key in counts[:top] if n]
+
+    def paths_of(self, bitmap: Bitmap, limit: int = 0) -> List[str]:
+        out = []
+        for i in bitmap:
+            path = self.paths[i]
+            if path is not None:
+                out.append(path)
+                if len(out) == limit:
+                    break
+        return out
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    # ----------------- Snapshot -----------------
+    def dump(self) -> tuple:
+        # plain values for snapshot.py; bitmaps as (offset, bits)
+        def plain(maps):
+            return {field: {key: (b.off, b.bits) for key, b in m.items()} for field, m in maps.items()}
+        return (self.paths, self.rows, plain(self.bitmaps), self.labels, plain(self.buckets),
+                (self.all.off, self.all.bits))
+
+    @classmethod
+    def restore(cls, state: tuple) -> 'FacetIndex':
+        def bitmaps(maps):
+            return {field: {key: Bitmap(*b) for key, b in m.items()} for field, m in maps.items()}
+        paths, rows, plain, labels, buckets, everything = state
+        index = cls()
+        index.paths, index.rows, index.labels = paths, rows, labels
+        index.ids = {path: i for i, path in enumerate(paths) if path is not None}
+        index.bitmaps, index.buckets = bitmaps(plain), bitmaps(buckets)
+        index.all = Bitmap(*everything)
+        return index
+
+
+class _Parser:
+    def __init__(self, index: FacetIndex, tokens: list):
+        self.index = index
+        self.tokens = tokens
+        self.pos = 0
+
+    def peek(self, kind: str, text: Optional[str] = None) -> bool:
+        if self.pos < len(self.tokens):
+            k, t = self.tokens[self.pos]
+            return k == kind and (text is None or t == text)
+        return False
+
+    def take(self, kind: str, what: str) -> str:
+        if not self.peek(kind):
+            found = repr(self.tokens[self.pos][1]) if self.pos < len(self.tokens) else 'end of query'
+            raise ValueError(f'expected {what}, found {found}')
+        self.pos += 1
+        return self.tokens[self.pos - 1][1]
+
+    def query(self) -> Bitmap:
+        result = self.conjunction()
+        while self.peek('kw', 'OR'):
+            self.pos += 1
+            result = result | self.conjunction()
+        return result
+
+    def conjunction(self) -> Bitmap:
+        result = self.negation()
+        while self.peek('kw', 'AND'):
+            self.pos += 1
+            result = result & self.negation()
+        return result
+
+    def negation(self) -> Bitmap:
+        if self.peek('kw', 'NOT'):
+            self.pos += 1
+            return self.index.all - self.negation()
+        if self.peek('op', '('):
+            self.pos += 1
+            result = self.query()
+            if not self.peek('op', ')'):
+                raise ValueError('missing )')
+            self.pos += 1
+            return result
+        field = self.take('value', 'a facet name').lower()
+        op = self.take('op', 'a comparison')
+        if op in '()':
+            raise ValueError(f'expected a comparison after {field}')
+        return self.index.match(field, op, self.take('value', 'a value'))
@@ -1,19 +1,17 @@
-import sys, os, json
+import sys, os
+import asyncio
 from urllib.request import urlopen
 from PyQt6.QtWidgets import (
     QApplication, QWidget, QVBoxLayout, QHBoxLayout, QListWidget, QLabel,
-    QPushButton, QSlider, QCheckBox, QLineEdit, QFrame, QListWidgetItem, QStyle
+    QPushButton, QSlider, QCheckBox, QLineEdit, QFrame, QListWidgetItem, QStyle, QSpinBox, QMenu, QComboBox
 )
-from PyQt6.QtCore import Qt, QTimer, pyqtSignal
-from PyQt6.QtGui import QFont, QPixmap, QColor
-from playlist_dll import Playlist
-from hashmap import SongMap
-from heap_bst import SongHeap
-from bst import BST
-from stack_queue import RecentlyPlayed, UpcomingSongs
-from player import MusicPlayer
-import pygame
-import time
+from PyQt6.QtCore import Qt, QTimer, QEvent, pyqtSignal
+from PyQt6.QtGui import QFont, QPixmap, QColor, QPainter
+from client import open_service
+from observable import Observable
+from waveform import PeaksCache, PeaksWorker
+import instrument
+from instrument import timed
 
 # Suppress all Qt warnings (optional)
 os.environ["QT_LOGGING_RULES"] = "qt*=false"
@@ -21,8 +19,7 @@ os.environ["QT_LOGGING_RULES"] = "qt*=false"
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 DATA_DIR = os.path.join(BASE_DIR, 'data')
 SONG_DIR = os.path.join(BASE_DIR, "songs")
-PLAY_COUNTS = os.path.join(DATA_DIR, 'play_counts.json')
-RECENT_HISTORY = os.path.join(DATA_DIR, 'recently_played.json')
+PEAKS_DIR = os.path.join(DATA_DIR, 'peaks')
 DEFAULT_COVER_URL = "https://i.redd.it/wo1p6792qi371.png"
 DEFAULT_COVER_PATH = os.path.join(DATA_DIR, 'default_cover.png')
 
@@ -42,53 +39,47 @@ def cache_default_cover():
         except Exception as e:
             print(f"Failed to cache default cover: {e}")
 
-def load_play_counts(heap: SongHeap):
-    if os.path.exists(PLAY_COUNTS):
-        try:
-            with open(PLAY_COUNTS, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                for title, cnt in data.items():
-                    heap.counter[title] = cnt
-            heap._rebuild_heap()
-        except Exception as e:
-            print('Could not load play counts:', e)
+# ----------------- asyncio Bridge -----------------
+class AsyncioPump:
+    """Runs an asyncio loop in short slices on the Qt thread.
 
-def save_play_counts(heap: SongHeap, force=False):
-    """Save play counts with debouncing to reduce I/O frequency."""
-    if hasattr(save_play_counts, 'last_save') and not force:
-        if time.time() - save_play_counts.last_save < 5:  # Debounce for 5 seconds
-            return
-    try:
-        ensure_dirs()
-        with open(PLAY_COUNTS, 'w', encoding='utf-8') as f:
-            json.dump(heap.counter, f, indent=2)
-        save_play_counts.last_save = time.time()
-    except Exception as e:
-        print('Could not save play counts:', e)
-save_play_counts.last_save = 0
-
-def load_recent_history(history: RecentlyPlayed):
-    if os.path.exists(RECENT_HISTORY):
-        try:
-            with open(RECENT_HISTORY, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                history.stack = data.get('history', [])
-        except Exception as e:
-            print('Could not load recently played history:', e)
+    Fallback for when qasync isn't installed: every `interval_ms` the loop
+    runs whatever is ready (callbacks from worker threads, due timers, task
+    steps) and hands control back to Qt. kick() runs a slice right away so
+    commands issued from the UI don't wait for the next tick.
+    """
+
+    def __init__(self, loop, interval_ms=50):
+        self.loop = loop
+        self.timer = QTimer()
+        self.timer.timeout.connect(self.tick)
+        self.timer.start(interval_ms)
 
-def save_recent_history(history: RecentlyPlayed, force=False):
-    """Save recent history with debouncing to reduce I/O frequency."""
-    if hasattr(save_recent_history, 'last_save') and not force:
-        if time.time() - save_recent_history.last_save < 5:  # Debounce for 5 seconds
+    def tick(self):
+        if self.loop.is_running() or self.loop.is_closed():
             return
+        self.loop.call_soon(self.loop.stop)
+        self.loop.run_forever()
+
+    def kick(self):
+        QTimer.singleShot(0, self.tick)
+
+    def stop(self):
+        self.timer.stop()
+
+
+def make_event_loop(app):
+    # qasync integrates both loops properly; otherwise pump asyncio from a timer
     try:
-        ensure_dirs()
-        with open(RECENT_HISTORY, 'w', encoding='utf-8') as f:
-            json.dump({'history': history.stack}, f, indent=2)
-        save_recent_history.last_save = time.time()
-    except Exception as e:
-        print('Could not save recently played history:', e)
-save_recent_history.last_save = 0
+        import qasync
+    except ImportError:
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        return loop, AsyncioPump(loop)
+    loop = qasync.QEventLoop(app)
+    asyncio.set_event_loop(loop)
+    return loop, None
+
 
 # ----------------- Simplified Slider Class -----------------
 class ClickableSlider(QSlider):
@@ -145,9 +136,163 @@ class ClickableSlider(QSlider):
         else:
             super().mouseDoubleClickEvent(event)
 
+class WaveformSlider(ClickableSlider):
+    """Seek bar drawn from a track's precomputed min/max peaks.
+
+    The waveform is rendered into two pixmaps (played / unplayed colours)
+    whenever the peaks or the widget width change; a repaint only blits them
+    split at the handle position. Without peaks it falls back to the plain bar.
+    """
+    PLAYED_COLOR = QColor("#E56A00")
+    REST_COLOR = QColor(90, 90, 90)
+
+    def __init__(self, orientation):
+        super().__init__(orientation)
+        self.peaks = None
+        self.played_pix = None
+        self.rest_pix = None
+        self.setMinimumHeight(40)
+
+    def set_peaks(self, peaks):
+        self.peaks = peaks
+        self.played_pix = self.rest_pix = None
+        self.update()
+
+    def resizeEvent(self, event):
+        self.played_pix = self.rest_pix = None
+        super().resizeEvent(event)
+
+    def _render(self, color):
+        mins, maxs = self.peaks
+        w, h = self.width(), self.height()
+        n = len(mins)
+        pix = QPixmap(w, h)
+        pix.fill(Qt.GlobalColor.transparent)
+        painter = QPainter(pix)
+        painter.setPen(color)
+        mid = h / 2
+        scale = (h / 2 - 1) / 127
+        for x in range(w):
+            a = x * n // w
+            b = max(a + 1, (x + 1) * n // w)
+            top = int(mid - max(maxs[a:b]) * scale)
+            bottom = int(mid - min(mins[a:b]) * scale)
+            painter.drawLine(x, top, x, max(bottom, top + 1))
+        painter.end()
+        return pix
+
+    def paintEvent(self, event):
+        if not self.peaks:
+            super().paintEvent(event)
+            return
+        if self.played_pix is None or self.played_pix.width() != self.width():
+            self.played_pix = self._render(self.PLAYED_COLOR)
+            self.rest_pix = self._render(self.REST_COLOR)
+        w, h = self.width(), self.height()
+        split = QStyle.sliderPositionFromValue(self.minimum(), self.maximum(), self.value(), w)
+        painter = QPainter(self)
+        painter.drawPixmap(0, 0, self.played_pix, 0, 0, split, h)
+        painter.drawPixmap(split, 0, self.rest_pix, split, 0, w - split, h)
+        painter.fillRect(max(split - 1, 0), 0, 2, h, QColor("#ffffff"))
+        painter.end()
+
+# ----------------- Delta-Driven List Panels -----------------
+class ListPanel:
+    """Mirrors the first `limit` items of an Observable structure into a
+    QListWidget.
+
+    Change events are queued and applied once per event-loop tick, so a burst
+    of plays costs one repaint and work proportional to the changes. The
+    widget always holds a prefix of the model; rows that scrolled out of the
+    window and back are refilled from the model at the end of the batch.
+    """
+
+    def __init__(self, widget, model, fmt, limit=None):
+        self.widget = widget
+        self.model = model
+        self.fmt = fmt
+        self.limit = limit if limit is not None else sys.maxsize
+        self.pending = []
+        self.scheduled = False
+        model.subscribe(self.on_change)
+
+    def on_change(self, op, index, value):
+        self.pending.append((op, index, value))
+        if not self.scheduled:
+            self.scheduled = True
+            QTimer.singleShot(0, self.flush)
+
+    def _insert(self, index, value):
+        w = self.widget
+        if index < self.limit and index <= w.count():
+            w.insertItem(index, self.fmt(value))
+            if w.count() > self.limit:
+                w.takeItem(self.limit)
+
+    def _remove(self, index):
+        if index < self.widget.count():
+            self.widget.takeItem(index)
+
+    @timed('gui.panel_flush')
+    def flush(self):
+        self.scheduled = False
+        events, self.pending = self.pending, []
+        w = self.widget
+        w.setUpdatesEnabled(False)
+        for op, index, value in events:
+            if op == 'insert':
+                self._insert(index, value)
+            elif op == 'remove':
+                self._remove(index)
+            elif op == 'move':
+                src, dst = index
+                self._remove(src)
+                self._insert(dst, value)
+            elif op == 'update':
+                if index < w.count():
+                    w.item(index).setText(self.fmt(value))
+            elif op == 'reset':
+                w.clear()
+        n = min(self.limit, len(self.model))
+        for k in range(w.count(), n):
+            w.addItem(self.fmt(self.model.at(k)))
+        while w.count() > n:
+            w.takeItem(w.count() - 1)
+        w.setUpdatesEnabled(True)
+
+    def refresh(self):
+        self.pending.append(('reset', None, None))
+        self.flush()
+
+    def set_model(self, model):
+        self.model.unsubscribe(self.on_change)
+        self.model = model
+        model.subscribe(self.on_change)
+        self.refresh()
+
+
+class RankedList(Observable):
+    # a fetched top list (windowed stats), shown through a ListPanel
+    def __init__(self):
+        super().__init__()
+        self.items = []
+
+    def set(self, items):
+        self.items = items
+        self._notify('reset')
+
+    def at(self, index):
+        return self.items[index]
+
+    def __len__(self):
+        return len(self.items)
+
 # ----------------- Main GUI Class -----------------
 class ModernMusicPlayer(QWidget):
-    def __init__(self):
+    # emitted by the waveform worker thread with (path, peaks)
+    peaks_ready = pyqtSignal(str, object)
+
+    def __init__(self, service, pump=None):
         super().__init__()
         self.setWindowTitle("Music Player")
         
@@ -158,45 +303,65 @@ class ModernMusicPlayer(QWidget):
         self.setMinimumSize(min_width, min_height)
         self.showMaximized()
 
-        # Core modules
-        self.playlist = Playlist()
-        self.song_map = SongMap()
-        self.history = RecentlyPlayed(max_size=20)
-        self.heap = SongHeap()
-        self.bst = None
-        self.player = MusicPlayer()
+        # Core modules live in the service (the player daemon, or in-process
+        # with MUZIC_DAEMON=0); the GUI issues commands and follows its events
+        self.service = service
+        self.service.subscribe(self.on_service_event)
+        self.pump = pump
+        self.playlist = self.service.playlist
+        self.song_map = self.service.song_map
+        self.history = self.service.history
+        self.heap = self.service.heap
+        self.bst = self.service.bst
+        self.player = self.service.player
+        self.upcoming = self.service.upcoming
+        self.top_window = 'all'
+        self.windowed_top = RankedList()
+        self.peaks_worker = PeaksWorker(PeaksCache(PEAKS_DIR), self.peaks_ready.emit)
+        self.peaks_ready.connect(self.on_peaks_ready)
+        self.default_cover = None
         self.current_node = None
         self.playing = False
-        self.upcoming = UpcomingSongs()
         self.slider_being_dragged = False
         self.current_position = 0
         self.autoplay_enabled = True
         self.song_duration = 0
-        self.play_start_offset = 0
+        self.time_text = "0:00"
         self.previous_volume = 80  # Store previous volume for mute/unmute
 
-        # Cache for UI optimizations
-        self.last_top_played = []
-        self.last_recently_played = []
-        self.last_upcoming = []
-
-        # Timer for UI sync
+        # Single-shot timer for UI sync; only armed while playing (see schedule_progress)
         self.progress_timer = QTimer(self)
+        self.progress_timer.setSingleShot(True)
         self.progress_timer.timeout.connect(self.update_progress)
-        self.progress_timer.start(200)
 
         # Load data
-        cache_default_cover()
-        load_play_counts(self.heap)
-        load_recent_history(self.history)
+        with instrument.phase('startup.load_data'):
+            ensure_dirs()
+            cache_default_cover()
+            self.service.load_state()
 
         # Setup UI
-        self.setup_ui()
-        self.load_songs()
+        with instrument.phase('startup.setup_ui'):
+            self.setup_ui()
+            # Side panels follow their data structures through change events
+            self.top_panel = ListPanel(self.top_played_list, self.heap, lambda v: f"{v[0]} · {v[1]} plays", limit=10)
+            self.recent_panel = ListPanel(self.history_list, self.history, str, limit=20)
+            self.upcoming_panel = ListPanel(self.upcoming_list, self.upcoming, str)
+        with instrument.phase('startup.load_songs'):
+            self.load_songs()
+        # watcher, auto-advance and autosave start once the loop runs
+        self.run(self.service.start(load=False))
         self.update_top_played_ui()
         self.update_recently_played_ui()
         self.update_upcoming_ui()
 
+    def run(self, coro):
+        # schedules a service command on the asyncio loop
+        task = self.service.spawn(coro)
+        if self.pump:
+            self.pump.kick()
+        return task
+
     # ----------------- UI Setup -----------------
     def setup_ui(self):
         main_layout = QHBoxLayout(self)
@@ -249,29 +414,25 @@ class ModernMusicPlayer(QWidget):
         pl_header.addStretch()
         side_layout.addLayout(pl_header)
 
-        # Sort Toggle
-        self.sort_toggle = QCheckBox("Alphabetical")
-        self.sort_toggle.setStyleSheet("""
-            QCheckBox {
-                color: #cccccc;
-                font-size: 13px;
-                spacing: 8px;
-                max-width: 120px;
-            }
-            QCheckBox::indicator {
-                width: 30px;
-                height: 20px;
-                border-radius: 10px;
-                background-color: rgba(60, 60, 60, 0.7);
-                border: 1px solid rgba(80, 80, 80, 0.5);
-            }
-            QCheckBox::indicator:checked {
-                background-color: #D94F00;
-                border: 1px solid #D94F00;
+        # Sort order (sorting.py): cached permutations kept by the service
+        self.sort_box = QComboBox()
+        for label, order in (("Playlist order", 'playlist'), ("Title", 'title'), ("Artist", 'artist'),
+                             ("Album", 'album'), ("Duration", 'duration'), ("Most played", 'plays'),
+                             ("Recently added", 'added'), ("Recently played", 'played')):
+            self.sort_box.addItem(label, order)
+        self.sort_box.setStyleSheet("""
+            QComboBox {
+                background-color: #1A1A1A;
+                color: #ffffff;
+                border: 1px solid #333333;
+                border-radius: 6px;
+                padding: 5px;
+                font-size: 12px;
             }
         """)
-        self.sort_toggle.stateChanged.connect(self.update_playlist_display)
-        side_layout.addWidget(self.sort_toggle)
+        self.sorted_view = None  # (order, titles), reused while the search box changes
+        self.sort_box.currentIndexChanged.connect(lambda _: self.update_playlist_display())
+        side_layout.addWidget(self.sort_box)
 
         # Search Bar
         self.search_input = QLineEdit()
@@ -296,6 +457,19 @@ class ModernMusicPlayer(QWidget):
         self.search_input.textChanged.connect(self.update_playlist_display)
         side_layout.addWidget(self.search_input)
 
+        # Facet filter (facets.py), applied when Enter is pressed
+        self.facet_input = QLineEdit()
+        self.facet_input.setPlaceholderText("⚙ Filter: genre=synthwave AND year>=2020 AND plays>5")
+        self.facet_input.setStyleSheet(self.search_input.styleSheet())
+        self.facet_input.returnPressed.connect(self.update_playlist_display)
+        self.facet_input.textChanged.connect(lambda text: text or self.update_playlist_display())
+        side_layout.addWidget(self.facet_input)
+        self.facet_label = QLabel("")
+        self.facet_label.setWordWrap(True)
+        self.facet_label.setStyleSheet("color: #999999; font-size: 11px;")
+        self.facet_label.hide()
+        side_layout.addWidget(self.facet_label)
+
         # Playlist List
         self.list_widget = QListWidget()
         self.list_widget.setStyleSheet("""
@@ -459,8 +633,50 @@ class ModernMusicPlayer(QWidget):
             }
         """)
         self.autoplay_checkbox.setChecked(True)
+        self.autoplay_checkbox.toggled.connect(self.service.set_autoplay_queue)
         side_layout.addWidget(self.autoplay_checkbox)
 
+        # What to queue when the upcoming list runs dry (recommend.py)
+        self.autofill_box = QComboBox()
+        for label, rule in (("Autofill: off", 'off'), ("Autofill: like this song", 'track'),
+                            ("Autofill: like this session", 'session')):
+            self.autofill_box.addItem(label, rule)
+        self.autofill_box.setCurrentIndex(max(0, self.autofill_box.findData(self.service.autofill)))
+        self.autofill_box.setStyleSheet("""
+            QComboBox {
+                background-color: #1A1A1A;
+                color: #ffffff;
+                border: 1px solid #333333;
+                border-radius: 6px;
+                padding: 5px;
+                font-size: 12px;
+            }
+        """)
+        self.autofill_box.currentIndexChanged.connect(
+            lambda _: self.service.set_autofill(self.autofill_box.currentData()))
+        side_layout.addWidget(self.autofill_box)
+
+        # Crossfade between tracks (0 = gapless); mixed by the stream backend
+        self.crossfade_spin = QSpinBox()
+        self.crossfade_spin.setRange(0, 12)
+        self.crossfade_spin.setPrefix("Crossfade ")
+        self.crossfade_spin.setSuffix(" s")
+        self.crossfade_spin.setStyleSheet("""
+            QSpinBox {
+                background-color: #1A1A1A;
+                color: #ffffff;
+                border: 1px solid #333333;
+                border-radius: 6px;
+                padding: 5px;
+                font-size: 12px;
+            }
+        """)
+        self.crossfade_spin.setEnabled(self.player.supports_crossfade())
+        if not self.player.supports_crossfade():
+            self.crossfade_spin.setToolTip("Needs the stream audio backend (MUZIC_AUDIO=stream)")
+        self.crossfade_spin.valueChanged.connect(self.player.set_crossfade)
+        side_layout.addWidget(self.crossfade_spin)
+
         main_layout.addWidget(sidebar)
 
         # Center Content
@@ -545,7 +761,32 @@ class ModernMusicPlayer(QWidget):
             color: #D94F00;
             letter-spacing: 1px;
         """)
-        top_card_layout.addWidget(top_header)
+        self.top_window_box = QComboBox()
+        for label, window in (("All time", 'all'), ("Today", 'day'), ("This week", 'week'),
+                              ("This month", 'month'), ("This year", 'year'), ("Trending", 'trending')):
+            self.top_window_box.addItem(label, window)
+        self.top_window_box.setStyleSheet("""
+            QComboBox {
+                background-color: rgba(30, 30, 30, 0.9);
+                color: #dddddd;
+                border: 1px solid rgba(80, 80, 80, 0.6);
+                border-radius: 6px;
+                padding: 3px 8px;
+                font-size: 12px;
+            }
+            QComboBox QAbstractItemView {
+                background-color: #1e1e1e;
+                color: #dddddd;
+                selection-background-color: #D94F00;
+            }
+        """)
+        self.top_window_box.currentIndexChanged.connect(
+            lambda _: self.set_top_window(self.top_window_box.currentData()))
+        top_header_row = QHBoxLayout()
+        top_header_row.addWidget(top_header)
+        top_header_row.addStretch()
+        top_header_row.addWidget(self.top_window_box)
+        top_card_layout.addLayout(top_header_row)
         
         self.top_played_list = QListWidget()
         self.top_played_list.setStyleSheet("""
@@ -669,7 +910,7 @@ class ModernMusicPlayer(QWidget):
         self.current_time_label.setStyleSheet("color: #999999; font-size: 12px; min-width: 40px;")
         progress_layout.addWidget(self.current_time_label)
 
-        self.progress_slider = ClickableSlider(Qt.Orientation.Horizontal)
+        self.progress_slider = WaveformSlider(Qt.Orientation.Horizontal)
         self.progress_slider.setStyleSheet("""
             QSlider::groove:horizontal {
                 background: rgba(60, 60, 60, 0.7);
@@ -835,52 +1076,102 @@ class ModernMusicPlayer(QWidget):
         self.upcoming_list.itemDoubleClicked.connect(self.enqueue_selected_from_upcoming)
         self.history_list.itemDoubleClicked.connect(self.play_selected_recently_played)
         self.top_played_list.itemDoubleClicked.connect(self.play_selected_top_played)
+        for widget, handler in ((self.list_widget, self.library_menu), (self.upcoming_list, self.upcoming_menu)):
+            widget.setContextMenuPolicy(Qt.ContextMenuPolicy.CustomContextMenu)
+            widget.customContextMenuRequested.connect(handler)
 
     # ----------------- Load Songs -----------------
     def load_songs(self):
-        ensure_dirs()
-        self.playlist.load_from_folder(SONG_DIR)
-        self.song_map.rebuild_from_playlist(self.playlist)
-        self.build_bst_from_playlist()
+        self.service.load_library()
         self.update_playlist_display()
 
-    # ----------------- BST Sorting -----------------
-    def build_bst_from_playlist(self):
-        self.bst = BST()
+    # ----------------- Service Events -----------------
+    @timed('gui.on_service_event')
+    def on_service_event(self, event, data):
+        # called on the Qt thread: the asyncio loop runs there too
+        if event == 'track':
+            self.show_node(data['node'])
+            if self.top_window != 'all':
+                self.run(self.refresh_windowed_top())
+            if self.sorted_view and self.sorted_view[0] in ('plays', 'played'):
+                self.sorted_view = None
+                self.update_playlist_display()
+        elif event == 'ready':
+            self.on_play_ready(data['node'], data['duration'])
+        elif event == 'state':
+            self.set_playing(data['state'] == 'playing')
+        elif event == 'library':
+            self.sorted_view = None
+            self.update_playlist_display()
+        elif event == 'message':
+            self.song_label.setText(data['text'])
+
+    def closeEvent(self, event):
+        self.peaks_worker.stop()
+        if self.pump:
+            self.pump.stop()
+        self.service.shutdown()
+        super().closeEvent(event)
+
+    # ----------------- Playlist Display -----------------
+    @timed('gui.update_playlist_display')
+    def update_playlist_display(self):
+        if self.facet_input.text().strip():
+            self.run(self.show_facet_filter())
+            return
+        if self.sort_box.currentData() != 'playlist':
+            self.run(self.show_sorted())
+            return
+        self.facet_label.hide()
+        self.list_widget.clear()
+        filter_text = self.search_input.text().strip().lower() if self.search_input else ""
         cur = self.playlist.head
         while cur:
-            self.bst.insert(cur.title)
+            if not filter_text or filter_text in cur.title.lower():
+                self.list_widget.addItem(cur.title)
             cur = cur.next
 
-    def get_bst_sorted_titles(self):
-        result = []
-        def inorder(node):
-            if not node:
-                return
-            inorder(node.left)
-            result.append(node.title)
-            inorder(node.right)
-        inorder(self.bst.root)
-        return result
+    async def show_sorted(self):
+        order = self.sort_box.currentData()
+        if self.sorted_view is None or self.sorted_view[0] != order:
+            titles = await self.service.sorted_titles(order)
+            if order != self.sort_box.currentData():
+                return  # superseded
+            self.sorted_view = (order, titles)
+        self.facet_label.hide()
+        filter_text = self.search_input.text().strip().lower()
+        self.list_widget.clear()
+        self.list_widget.addItems([t for t in self.sorted_view[1] if not filter_text or filter_text in t.lower()])
 
-    # ----------------- Playlist Display -----------------
-    def update_playlist_display(self):
+    async def show_facet_filter(self):
+        # the matches come from the facet bitmaps; the search box narrows them by title
+        query = self.facet_input.text().strip()
+        order = self.sort_box.currentData()
+        try:
+            result = await self.service.filter_songs(query, facets=('genre', 'year', 'artist'), top=3,
+                                                     order=None if order == 'playlist' else order)
+        except ValueError as e:
+            self.facet_label.setText(f"⚠ {e}")
+            self.facet_label.show()
+            return
+        if query != self.facet_input.text().strip() or order != self.sort_box.currentData():
+            return  # superseded
+        filter_text = self.search_input.text().strip().lower()
+        titles = [t for t in result['titles'] if not filter_text or filter_text in t.lower()]
         self.list_widget.clear()
-        filter_text = self.search_input.text().strip().lower() if self.search_input else ""
-        if self.sort_toggle.isChecked():
-            sorted_titles = self.get_bst_sorted_titles()
-            for title in sorted_titles:
-                if not filter_text or filter_text in title.lower():
-                    self.list_widget.addItem(title)
-        else:
-            cur = self.playlist.head
-            while cur:
-                if not filter_text or filter_text in cur.title.lower():
-                    self.list_widget.addItem(cur.title)
-                cur = cur.next
+        self.list_widget.addItems(titles)
+        summary = [f"{result['count']} songs" + (" (indexing...)" if result['indexing'] else "")]
+        for field, counts in result['facets'].items():
+            if counts:
+                summary.append(f"{field}: " + ", ".join(f"{value} {n}" for value, n in counts))
+        self.facet_label.setText(" · ".join(summary))
+        self.facet_label.show()
 
     # ----------------- Cover Art (DEFAULT ONLY) -----------------
     def load_default_cover(self):
+        if self.default_cover is not None:
+            self.cover_label.setPixmap(self.default_cover)
+            return
         try:
             pix = QPixmap()
             if os.path.exists(DEFAULT_COVER_PATH):
@@ -892,6 +1183,7 @@ class ModernMusicPlayer(QWidget):
                 with open(DEFAULT_COVER_PATH, 'wb') as f:
                     f.write(data)
             pix = pix.scaled(630, 730, Qt.AspectRatioMode.KeepAspectRatio, Qt.TransformationMode.SmoothTransformation)
+            self.default_cover = pix
             self.cover_label.setPixmap(pix)
         except Exception as e:
             print(f"Error loading default cover: {e}")
@@ -936,70 +1228,69 @@ class ModernMusicPlayer(QWidget):
     def enqueue_selected_from_upcoming(self, item):
         self.play_next_from_upcoming()
 
-    def play_node(self, node):
+    @timed('gui.play_node')
+    def play_node(self, node, fade=False):
+        # The service switches the UI first (show_node), the audio follows
+        # (on_play_ready). fade: crossfade from the current track
+        self.run(self.service.play(node, fade=fade))
+
+    def audio_on_current(self):
+        # False while a play request for the shown track is still on its way
+        return bool(self.current_node) and self.player.current_path == self.current_node.path
+
+    def on_play_ready(self, node, duration):
+        if node is not self.current_node:
+            return
+        self.set_duration(duration)
+        self.schedule_progress()
+
+    def set_duration(self, duration):
+        if duration == self.song_duration:
+            return
+        self.song_duration = duration
+        self.progress_slider.setMaximum(max(duration, 1))
+        self.total_time_label.setText(self.format_time(duration))
+
+    def show_node(self, node):
+        # everything about a track change except starting the audio
         self.current_node = node
         self.song_label.setText(f"🎵 {node.title}")
         self.current_position = 0
-        self.play_start_offset = 0
         self.slider_being_dragged = False
-        self.playing = True
-        self.play_pause_btn.setText("||")
-        self.player.play(node.path)
-        self.history.push(node.title)
-        self.heap.add_play(node.title)
-        save_play_counts(self.heap)
-        save_recent_history(self.history)
+        self.set_playing(True)
         # Always load default cover (no per-song reading)
         self.load_default_cover()
-        # Try to read duration (mutagen) but don't crash if unavailable
-        try:
-            from mutagen import File as MutagenFile
-            mf = MutagenFile(node.path)
-            dur = int(getattr(mf.info, 'length', 0))
-            self.song_duration = dur
-        except Exception:
-            self.song_duration = 0
-        self.progress_slider.setMaximum(max(self.song_duration, 1))
+        # Waveform is loaded/computed off the GUI thread; a newer track cancels it
+        self.progress_slider.set_peaks(None)
+        self.peaks_worker.request(node.path)
+        # Duration from the cache if known; a miss is parsed on the play worker
+        self.set_duration(self.service.duration)
         self.progress_slider.setValue(0)
-        self.total_time_label.setText(self.format_time(self.song_duration))
-        self.current_time_label.setText("0:00")
-        self.update_top_played_ui()
-        self.update_recently_played_ui()
-        self.update_upcoming_ui()
+        self.set_time_label(0)
+        self.schedule_progress()
+        # Top/recent/upcoming panels update themselves from change events
         # Highlight the current song in the playlist
-        for i in range(self.list_widget.count()):
-            item = self.list_widget.item(i)
-            if item.text() == node.title:
-                self.list_widget.setCurrentItem(item)
-                self.list_widget.scrollToItem(item, QListWidget.ScrollHint.PositionAtCenter)
-                break
+        items = self.list_widget.findItems(node.title, Qt.MatchFlag.MatchExactly)
+        if items:
+            self.list_widget.setCurrentItem(items[0])
+            self.list_widget.scrollToItem(items[0], QListWidget.ScrollHint.PositionAtCenter)
+
+    def set_playing(self, playing):
+        self.playing = playing
+        self.play_pause_btn.setText("||" if playing else "|> ")
+        self.schedule_progress()
 
     def toggle_play_pause(self):
-        if self.playing:
-            self.player.pause()
-            self.playing = False
-            self.play_pause_btn.setText("|> ")
+        if self.current_node:
+            self.run(self.service.toggle())
         else:
-            if self.current_node:
-                if self.player.is_paused():
-                    self.player.resume()
-                    self.playing = True
-                    self.play_pause_btn.setText("||")
-                else:
-                    self.play_node(self.current_node)
-            else:
-                self.play_selected()
+            self.play_selected()
 
     def next_song(self):
-        if self.current_node and self.current_node.next:
-            self.play_node(self.current_node.next)
-        else:
-            self.playing = False
-            self.play_pause_btn.setText("|> ")
+        self.run(self.service.next())
 
     def prev_song(self):
-        if self.current_node and self.current_node.prev:
-            self.play_node(self.current_node.prev)
+        self.run(self.service.prev())
 
     def set_volume(self, val):
         self.player.set_volume(val / 100)
@@ -1026,73 +1317,144 @@ class ModernMusicPlayer(QWidget):
         self.vol_slider.setValue(new_volume)
 
     # ----------------- Progress -----------------
+    def schedule_progress(self):
+        """Arms the progress timer for the next useful moment.
+
+        That is just after the displayed second rolls over. Auto-advance is the
+        service's job, so nothing is armed while hidden, minimized or not playing.
+        """
+        if not self.playing or not self.isVisible() or self.isMinimized():
+            self.progress_timer.stop()
+            return
+        pos = self.player.position()
+        self.progress_timer.start(1000 - int((pos % 1) * 1000) + 5)
+
+    def set_time_label(self, seconds):
+        text = self.format_time(seconds)
+        if text != self.time_text:
+            self.time_text = text
+            self.current_time_label.setText(text)
+
+    @timed('gui.update_progress')
     def update_progress(self):
         if not self.playing:
             return
+        if not self.audio_on_current():
+            # audio hasn't caught up with the shown track yet
+            self.schedule_progress()
+            return
         try:
             if not self.slider_being_dragged:
-                pos = pygame.mixer.music.get_pos() // 1000
-                if pos < 0:
-                    pos = 0
-                absolute_pos = self.play_start_offset + pos
-                self.current_position = absolute_pos
-                self.progress_slider.blockSignals(True)
-                self.progress_slider.setValue(absolute_pos)
-                self.progress_slider.blockSignals(False)
-                self.current_time_label.setText(self.format_time(absolute_pos))
-            if self.song_duration > 0 and self.current_position >= self.song_duration - 1:
-                self.playing = False
-                self.play_pause_btn.setText("|> ")
-                if self.autoplay_checkbox.isChecked() and self.upcoming.size > 0:
-                    self.play_next_from_upcoming()
-                else:
-                    self.next_song()
+                pos = int(self.player.position())
+                if pos != self.current_position:
+                    self.current_position = pos
+                    self.progress_slider.blockSignals(True)
+                    self.progress_slider.setValue(pos)
+                    self.progress_slider.blockSignals(False)
+                    self.set_time_label(pos)
         except Exception as e:
             # Keep errors visible in console but avoid crashing UI
             print(f"Error in update_progress: {e}")
+        self.schedule_progress()
+
+    def changeEvent(self, event):
+        # minimizing stops the per-second wakeups, restoring re-syncs them
+        # (showMaximized() in __init__ fires events before the timer exists)
+        if event.type() == QEvent.Type.WindowStateChange and hasattr(self, 'progress_timer'):
+            if self.playing and not self.isMinimized():
+                self.update_progress()
+            else:
+                self.schedule_progress()
+        super().changeEvent(event)
+
+    def showEvent(self, event):
+        super().showEvent(event)
+        if hasattr(self, 'progress_timer'):
+            self.schedule_progress()
+
+    def hideEvent(self, event):
+        super().hideEvent(event)
+        if hasattr(self, 'progress_timer'):
+            self.schedule_progress()
+
+    def on_peaks_ready(self, path, peaks):
+        if self.current_node and self.current_node.path == path:
+            self.progress_slider.set_peaks(peaks)
 
     # ----------------- Top & Recent -----------------
+    @timed('gui.update_top_played_ui')
     def update_top_played_ui(self):
-        top = self.heap.get_top(10)
-        if top != self.last_top_played:
-            self.top_played_list.clear()
-            for t, c in top:
-                item = QListWidgetItem(f"{t} · {c} plays")
-                self.top_played_list.addItem(item)
-            self.last_top_played = top
+        self.top_panel.refresh()
+
+    def set_top_window(self, window):
+        # 'all' follows the heap live; windows are fetched and refreshed per track
+        self.top_window = window
+        if window == 'all':
+            self.top_panel.set_model(self.heap)
+            return
+        self.top_panel.set_model(self.windowed_top)
+        self.run(self.refresh_windowed_top())
+
+    async def refresh_windowed_top(self):
+        window = self.top_window
+        top = await self.service.top_played(window, 10)
+        if window == self.top_window:
+            self.windowed_top.set(top)
 
+    @timed('gui.update_recently_played_ui')
     def update_recently_played_ui(self):
-        recent = self.history.get_all()
-        if recent != self.last_recently_played:
-            self.history_list.clear()
-            for t in recent:
-                self.history_list.addItem(t)
-            self.last_recently_played = recent
+        self.recent_panel.refresh()
 
     # ----------------- Upcoming Queue -----------------
+    @timed('gui.update_upcoming_ui')
     def update_upcoming_ui(self):
-        upcoming = [self.upcoming.queue[(self.upcoming.front + i) % self.upcoming.capacity] for i in range(self.upcoming.size)]
-        if upcoming != self.last_upcoming:
-            self.upcoming_list.clear()
-            for t in upcoming:
-                if t:
-                    self.upcoming_list.addItem(t)
-            self.last_upcoming = upcoming
+        self.upcoming_panel.refresh()
 
     def add_to_upcoming(self, title):
-        self.upcoming.enqueue(title)
-        self.update_upcoming_ui()
+        self.run(self.service.enqueue(title))
 
     def play_next_from_upcoming(self):
         self.slider_being_dragged = False
-        title = self.upcoming.dequeue()
-        if not title:
-            self.song_label.setText("No upcoming songs")
+        self.run(self.service.play_next_from_queue())
+
+    def show_menu(self, widget, pos, actions):
+        menu = QMenu(self)
+        for text, fn in actions:
+            menu.addAction(text).triggered.connect(lambda checked=False, fn=fn: fn())
+        menu.exec(widget.mapToGlobal(pos))
+
+    def library_menu(self, pos):
+        item = self.list_widget.itemAt(pos)
+        if not item:
             return
-        node = self.song_map.search_song(title)
-        if node:
-            self.play_node(node)
-        self.update_upcoming_ui()
+        title = item.text()
+        self.show_menu(self.list_widget, pos, [
+            ("Play next", lambda: self.run(self.service.enqueue(title, next=True))),
+            ("Add to queue", lambda: self.add_to_upcoming(title)),
+            ("Queue similar songs", lambda: self.run(self.enqueue_similar(title))),
+        ])
+
+    async def enqueue_similar(self, title):
+        similar = await self.service.similar(title, 5)
+        if not similar:
+            self.song_label.setText(f"Nothing similar to {title} yet")
+        for other, _ in similar:
+            await self.service.enqueue(other)
+
+    def upcoming_menu(self, pos):
+        item = self.upcoming_list.itemAt(pos)
+        if not item:
+            return
+        row, last = self.upcoming_list.row(item), len(self.upcoming) - 1
+        actions = []
+        if row > 0:
+            actions += [("Move to top", lambda: self.run(self.service.queue_move(row, 0))),
+                        ("Move up", lambda: self.run(self.service.queue_move(row, row - 1)))]
+        if row < last:
+            actions.append(("Move down", lambda: self.run(self.service.queue_move(row, row + 1))))
+        actions += [("Remove", lambda: self.run(self.service.queue_remove(row))),
+                    ("Remove duplicates", lambda: self.run(self.service.queue_dedupe()))]
+        self.show_menu(self.upcoming_list, pos, actions)
 
     # ----------------- Time Formatting -----------------
     def format_time(self, seconds: float) -> str:
@@ -1102,7 +1464,7 @@ class ModernMusicPlayer(QWidget):
 
     # ----------------- Slider Handlers -----------------
     def slider_position_changed(self, position: int):
-        self.current_time_label.setText(self.format_time(position))
+        self.set_time_label(position)
         if not self.slider_being_dragged and self.current_node and self.playing:
             self.seek_to(position)
 
@@ -1117,28 +1479,27 @@ class ModernMusicPlayer(QWidget):
 
     def seek_to(self, position: int):
         try:
-            pygame.mixer.music.stop()
-            pygame.mixer.music.load(self.current_node.path)
-            self.play_start_offset = int(position)
-            pygame.mixer.music.play(start=float(position))
+            self.run(self.service.seek(position))
             self.current_position = int(position)
             self.progress_slider.blockSignals(True)
             self.progress_slider.setValue(self.current_position)
             self.progress_slider.blockSignals(False)
-            self.current_time_label.setText(self.format_time(self.current_position))
+            self.set_time_label(self.current_position)
+            self.schedule_progress()
         except Exception as e:
             print(f"Seek error: {e}")
 
 # ----------------- Run -----------------
 if __name__ == "__main__":
-    # initialize pygame mixer (safe to call even if not used immediately)
-    try:
-        pygame.mixer.init()
-    except Exception:
-        # If pygame fails to initialize, player.play/is_playing behavior may be affected.
-        print("Warning: pygame mixer failed to initialize; audio playback may not work.")
-
+    # the audio backend (pygame unless MUZIC_AUDIO=null) is set up by MusicPlayer
     app = QApplication(sys.argv)
-    gui = ModernMusicPlayer()
-    gui.show()
-    sys.exit(app.exec())
\ No newline at end of file
+    loop, pump = make_event_loop(app)
+    with instrument.phase('startup.total'):
+        service = loop.run_until_complete(open_service(history_size=20))
+        gui = ModernMusicPlayer(service, pump)
+        gui.show()
+    QTimer.singleShot(0, lambda: instrument.mark('startup.first_event_loop_tick'))
+    if pump:
+        sys.exit(app.exec())
+    with loop:
+        loop.run_forever()
\ No newline at end of file
@@ -1,24 +1,46 @@
 # hashmap.py
 # Simple hash map wrapper for song title lookup (case-insensitive)
+import os
 from typing import Optional
 
+from instrument import timed
+
+
+def normalize_path(path: str) -> str:
+    # canonical key for path lookups (absolute, case-folded on Windows)
+    return os.path.normcase(os.path.abspath(path))
+
+
 class SongMap:
     def __init__(self):
         # map lowercase title -> Node (from playlist_dll)
         self.map = {}
+        # map normalized path -> Node, used to resolve imported playlists
+        self.paths = {}
 
     def insert_to_hash(self, title: str, node) -> None:
         self.map[title.lower()] = node
+        path = getattr(node, 'path', None)
+        if path:
+            self.paths[normalize_path(path)] = node
 
     def remove_from_hash(self, title: str) -> None:
-        self.map.pop(title.lower(), None)
+        node = self.map.pop(title.lower(), None)
+        path = getattr(node, 'path', None)
+        if path:
+            self.paths.pop(normalize_path(path), None)
 
     def search_song(self, title: str):
         return self.map.get(title.lower())
 
+    def search_path(self, path: str):
+        return self.paths.get(normalize_path(path))
+
+    @timed('songmap.rebuild_from_playlist')
     def rebuild_from_playlist(self, playlist) -> None:
         # playlist: Playlist instance
         self.map.clear()
+        self.paths.clear()
         cur = playlist.head
         while cur:
             self.insert_to_hash(cur.title, cur)
@@ -1,37 +1,84 @@
-import heapq
+import bst
+from observable import Observable
+from instrument import timed
 
-class SongHeap:
+class SongHeap(Observable):
+    # Change notifications use ranking positions (0 = most played) with
+    # (title, count) values
     def __init__(self):
+        super().__init__()
         # Map to track play counts: {title: count}
         # Named 'counter' to match main.py expectations
         self.counter = {}
         # Backward-compat alias if other modules reference count_map
         self.count_map = self.counter
-        # Heap as list of (-count, title) for max-heap behavior
-        self.heap_list = []
+        # Titles ordered by play count (descending). Equal counts form a
+        # contiguous block, so an increment is one swap with the first title
+        # of its block instead of a full re-heapify.
+        self.ranking = []
+        self.rank = {}          # title -> index in ranking
+        self.block_start = {}   # count -> index of the first title with that count
 
+    @timed('songheap.add_play')
     def add_play(self, title):
-        # Increment play count and rebuild heap
-        if title in self.counter:
-            self.counter[title] += 1
+        count = self.counter.get(title, 0)
+        self.counter[title] = count + 1
+        if count == 0:
+            i = len(self.ranking)
+            self.ranking.append(title)
+            self.rank[title] = i
+            self.block_start.setdefault(1, i)
+            self._notify('insert', i, (title, 1))
+            return
+        i = self.rank[title]
+        j = self.block_start[count]
+        if i != j:
+            other = self.ranking[j]
+            self.ranking[i], self.ranking[j] = other, title
+            self.rank[title], self.rank[other] = j, i
+        # title closes the (count + 1) block; the count block now starts after it
+        if j + 1 < len(self.ranking) and self.counter[self.ranking[j + 1]] == count:
+            self.block_start[count] = j + 1
+        else:
+            del self.block_start[count]
+        self.block_start.setdefault(count + 1, j)
+        if i != j:
+            self._notify('move', (i, j), (title, count + 1))
+            self._notify('move', (j + 1, i), (other, count))
         else:
-            self.counter[title] = 1
-        self._rebuild_heap()
+            self._notify('update', j, (title, count + 1))
 
     def _rebuild_heap(self):
-        # Rebuild the heap from current counters
-        self.heap_list = [(-count, title) for title, count in self.counter.items()]
-        heapq.heapify(self.heap_list)
+        # Rebuild the ranking from current counters (after bulk loads)
+        self.ranking = sorted(self.counter, key=lambda t: (-self.counter[t], t))
+        self.rank = {title: i for i, title in enumerate(self.ranking)}
+        self.block_start = {}
+        for i, title in enumerate(self.ranking):
+            self.block_start.setdefault(self.counter[title], i)
+        self._notify('reset')
+
+    def restore(self, counter, ranking):
+        # counts with a ranking saved earlier (warm start): no sort needed
+        self.counter.clear()
+        self.counter.update(counter)
+        self.ranking = ranking
+        self.rank = {title: i for i, title in enumerate(ranking)}
+        self.block_start = {}
+        for i, title in enumerate(ranking):
+            self.block_start.setdefault(counter[title], i)
+        self._notify('reset')
 
+    @timed('songheap.get_top')
     def get_top(self, n=10):
-        # Return top n songs as list of (title, count) tuples without modifying original heap
-        heap_copy = self.heap_list[:]
-        heapq.heapify(heap_copy)
-        top = []
-        for _ in range(min(n, len(heap_copy))):
-            count_neg, title = heapq.heappop(heap_copy)
-            top.append((title, -count_neg))
-        return top
+        # Return top n songs as list of (title, count) tuples
+        return [(title, self.counter[title]) for title in self.ranking[:n]]
+
+    def at(self, index):
+        title = self.ranking[index]
+        return title, self.counter[title]
+
+    def __len__(self):
+        return len(self.ranking)
 
     def show_top(self, n=10):
         # Pretty-print top N songs (used by console app)
@@ -44,23 +91,11 @@ class SongHeap:
             print(f"{i}. {title} — {cnt} plays")
 
 
-class Node:
-    def __init__(self, title):
-        self.title = title
-        self.left = None
-        self.right = None
+# The console app's tree: bst.BST with duplicate titles ignored
+Node = bst.Node
 
 
-class BST:
-    def __init__(self):
-        self.root = None
-
-    def insert(self, title):
-        if self.root is None:
-            self.root = Node(title)
-        else:
-            self._insert(self.root, title)
-
+class BST(bst.BST):
     def _insert(self, node, title):
         if title < node.title:
             if node.left is None:
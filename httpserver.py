@@ -0,0 +1,365 @@
+# httpserver.py
+# Serves the library to other devices over HTTP from the in-memory index
+# (Playlist, SongMap, SongHeap) the service already keeps. One asyncio task
+# per connection with keep-alive; audio bodies go out with loop.sendfile(),
+# i.e. os.sendfile() straight from the page cache, so a listener costs a
+# socket and a small header buffer no matter how large the file.
+#   GET /api/library?offset=0&limit=100   songs in playlist order, or
+#       &sort=artist&desc=1               by title, artist, album, duration,
+#                                         plays, added or played (sorting.py)
+#   GET /api/search?q=text&limit=100      substring match on the title
+#   GET /api/filter?q=genre%3Djazz&limit=100   facet query (facets.py), with counts
+#   GET /api/top?n=10&window=week         most played: all, day, week, month,
+#                                         year or trending
+#   GET /api/similar?id=<id>&n=10         songs often heard with that one
+#   GET /api/status                       what the player is doing
+#   GET|HEAD /stream/<id>                 the audio file, with Range support
+# Song ids are derived from the file path, so they stay valid across restarts
+# without exposing paths.
+#
+#   python httpserver.py --host 0.0.0.0 --port 8080   (or daemon.py --http)
+import os
+import sys
+import json
+import asyncio
+import hashlib
+import argparse
+import mimetypes
+from email.utils import formatdate
+from typing import Dict, Optional, Tuple
+from urllib.parse import urlsplit, parse_qs, unquote
+
+from hashmap import normalize_path
+from listening_stats import WINDOWS
+
+MAX_HEADER = 16 * 1024
+IDLE_TIMEOUT = 15.0
+AUDIO_TYPES = {'.mp3': 'audio/mpeg', '.flac': 'audio/flac', '.ogg': 'audio/ogg', '.oga': 'audio/ogg',
+               '.opus': 'audio/ogg', '.m4a': 'audio/mp4', '.aac': 'audio/aac', '.wav': 'audio/wav'}
+REASONS = {200: 'OK', 206: 'Partial Content', 304: 'Not Modified', 400: 'Bad Request',
+           404: 'Not Found', 405: 'Method Not Allowed', 416: 'Range Not Satisfiable',
+           431: 'Request Header Fields Too Large', 503: 'Service Unavailable'}
+
+
+def song_id(path: str) -> str:
+    return hashlib.sha1(normalize_path(path).encode('utf-8', 'surrogateescape')).hexdigest()[:16]
+
+
+def parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """Returns (start, end) inclusive for a single 'bytes=' range, None to
+    send the whole file (no header, or multiple ranges) and raises
+    ValueError if the range can't be satisfied."""
+    if not header or not header.startswith('bytes=') or ',' in header:
+        return None
+    first, _, last = header[6:].strip().partition('-')
+    if not first:
+        # suffix range: the last N bytes
+        n = int(last)
+        if n <= 0:
+            raise ValueError(header)
+        return max(size - n, 0), size - 1
+    start = int(first)
+    end = int(last) if last else size - 1
+    if start >= size or end < start:
+        raise ValueError(header)
+    return start, min(end, size - 1)
+
+
+def int_arg(query: dict, key: str, default: int, high: int) -> int:
+    value = query.get(key, '')
+    return min(int(value), high) if value.isdigit() else default
+
+
+class HTTPError(Exception):
+    def __init__(self, status: int, message: str = ''):
+        super().__init__(message or REASONS.get(status, ''))
+        self.status = status
+
+
+class LibraryHTTPServer:
+    def __init__(self, service, host: str = '127.0.0.1', port: int = 8080, max_clients: int = 1024):
+        self.service = service
+        self.host = host
+        self.port = port
+        self.max_clients = max_clients
+        self.zero_copy = True  # False: plain read/write loop (for comparison)
+        self.connections: Dict[asyncio.StreamWriter, asyncio.Task] = {}
+        self.server = None
+        self.ids: Optional[Dict[str, object]] = None  # song id -> node, rebuilt after library changes
+        service.subscribe(self._on_event)
+
+    def _on_event(self, event, data) -> None:
+        if event == 'library':
+            self.ids = None
+
+    def node_for(self, sid: str):
+        if self.ids is None:
+            self.ids = {song_id(node.path): node for node in self.service.playlist.iter_nodes()}
+        return self.ids.get(sid)
+
+    async def start(self) -> None:
+        self.server = await asyncio.start_server(self.handle, self.host, self.port, limit=MAX_HEADER)
+        self.port = self.server.sockets[0].getsockname()[1]  # when started on port 0
+
+    async def close(self) -> None:
+        if self.server:
+            self.server.close()
+        # closing the transports ends idle keep-alive reads with EOF, so the
+        # handlers return on their own instead of being cancelled
+        handlers = list(self.connections.values())
+        for writer in list(self.connections):
+            writer.close()
+        await asyncio.gather(*handlers, return_exceptions=True)
+        if self.server:
+            await self.server.wait_closed()
+
+    # ----------------- Connections -----------------
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self.connections[writer] = asyncio.current_task()
+        try:
+            if len(self.connections) > self.max_clients:
+                await self.send(writer, 503, b'busy\n', 'text/plain', keep_alive=False)
+                return
+            keep_alive = True
+            while keep_alive:
+                try:
+                    head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), IDLE_TIMEOUT)
+                except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+                    return
+                except asyncio.LimitOverrunError:
+                    await self.send(writer, 431, b'', 'text/plain', keep_alive=False)
+                    return
+                keep_alive = await self.respond(writer, head)
+        except ConnectionError:
+            pass
+        except Exception as e:
+            print('HTTP handler failed:', e)
+        finally:
+            self.connections.pop(writer, None)
+            writer.close()
+
+    async def respond(self, writer, head: bytes) -> bool:
+        try:
+            lines = head.decode('latin-1').split('\r\n')
+            method, target, version = lines[0].split(' ', 2)
+            headers = {}
+            for line in lines[1:]:
+                if ':' in line:
+                    k, v = line.split(':', 1)
+                    headers[k.strip().lower()] = v.strip()
+        except ValueError:
+            await self.send(writer, 400, b'', 'text/plain', keep_alive=False)
+            return False
+        conn = headers.get('connection', '').lower()
+        keep_alive = conn != 'close' if version == 'HTTP/1.1' else conn == 'keep-alive'
+        if 'content-length' in headers or 'transfer-encoding' in headers:
+            keep_alive = False  # no request bodies here; don't try to resync
+        url = urlsplit(target)
+        query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        try:
+            if method not in ('GET', 'HEAD'):
+                raise HTTPError(405)
+            if url.path.startswith('/stream/'):
+                await self.send_audio(writer, unquote(url.path[8:]), headers, method == 'HEAD', keep_alive)
+                return keep_alive
+            body = json.dumps(await self.api(url.path, query)).encode()
+            await self.send(writer, 200, body, 'application/json', keep_alive, head_only=method == 'HEAD')
+        except HTTPError as e:
+            await self.send(writer, e.status, (str(e) + '\n').encode(), 'text/plain', keep_alive)
+        return keep_alive
+
+    async def send(self, writer, status: int, body: bytes, ctype: str, keep_alive: bool = True,
+                   extra: Optional[dict] = None, head_only: bool = False) -> None:
+        headers = {'Content-Type': ctype, 'Content-Length': str(len(body))}
+        headers.update(extra or {})
+        writer.write(self.head(status, headers, keep_alive) + (b'' if head_only else body))
+        await writer.drain()
+
+    def head(self, status: int, headers: dict, keep_alive: bool) -> bytes:
+        lines = [f'HTTP/1.1 {status} {REASONS.get(status, "")}',
+                 f'Date: {formatdate(usegmt=True)}',
+                 'Connection: ' + ('keep-alive' if keep_alive else 'close')]
+        lines += [f'{k}: {v}' for k, v in headers.items()]
+        return ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1')
+
+    # ----------------- JSON API -----------------
+    def song(self, node) -> dict:
+        sid = song_id(node.path)
+        return {'id': sid, 'title': node.title, 'url': f'/stream/{sid}'}
+
+    async def api(self, path: str, query: dict):
+        s = self.service
+        limit = int_arg(query, 'limit', 100, 1000)
+        if path == '/api/library':
+            offset = int_arg(query, 'offset', 0, sys.maxsize)
+            sort = query.get('sort', 'playlist')
+            if sort != 'playlist':
+                try:
+                    perm = await s._sort_order(sort)  # a new order is sorted off the loop
+                except ValueError as e:
+                    raise HTTPError(400, str(e))
+                n = len(perm)
+                if query.get('desc') in ('1', 'true'):
+                    paths = perm[max(0, n - offset - limit):max(0, n - offset)][::-1]
+                else:
+                    paths = perm[offset:offset + limit]
+                songs = []
+                for p in paths:
+                    node = s.song_map.search_path(p)
+                    if node:
+                        songs.append(self.song(node))
+                return {'total': n, 'offset': offset, 'sort': sort, 'songs': songs}
+            songs = []
+            for i, node in enumerate(s.playlist.iter_nodes()):
+                if i >= offset + limit:
+                    break
+                if i >= offset:
+                    songs.append(self.song(node))
+            return {'total': len(s.playlist), 'offset': offset, 'songs': songs}
+        if path == '/api/search':
+            q = query.get('q', '').lower()
+            songs = []
+            for node in s.playlist.iter_nodes():
+                if q in node.title.lower():
+                    songs.append(self.song(node))
+                    if len(songs) >= limit:
+                        break
+            return {'query': q, 'songs': songs}
+        if path == '/api/filter':
+            index = s.facets
+            try:
+                matched = index.filter(query.get('q', ''))
+            except ValueError as e:
+                raise HTTPError(400, str(e))
+            songs = []
+            for p in index.paths_of(matched, limit):
+                node = s.song_map.search_path(p)
+                if node:
+                    songs.append(self.song(node))
+            return {'query': query.get('q', ''), 'count': len(matched), 'songs': songs,
+                    'facets': {field: index.counts(field, matched, 10) for field in ('genre', 'year', 'artist')}}
+        if path == '/api/top':
+            n = int_arg(query, 'n', 10, 100)
+            window = query.get('window', 'all')
+            if window == 'all':
+                ranked = s.heap.get_top(n)
+            elif window == 'trending' or window in WINDOWS:
+                ranked = s.stats.window(window, n)
+            else:
+                raise HTTPError(400, 'unknown window')
+            top = []
+            for title, plays in ranked:
+                node = s.song_map.search_song(title)
+                if node:
+                    top.append(dict(self.song(node), plays=plays))
+            return {'window': window, 'top': top}
+        if path == '/api/similar':
+            node = self.node_for(query.get('id', ''))
+            if node is None:
+                raise HTTPError(404, 'no such song')
+            n = int_arg(query, 'n', 10, 100)
+            similar = []
+            for title, weight in s.co_plays.similar(node.title, s.co_plays.k):
+                other = s.song_map.search_song(title)
+                if other:
+                    similar.append(dict(self.song(other), weight=round(weight, 3)))
+                    if len(similar) >= n:
+                        break
+            return {'song': self.song(node), 'similar': similar}
+        if path == '/api/status':
+            status = s.status()
+            current = s.current
+            return {'state': status['state'], 'song': self.song(current) if current else None,
+                    'position': status['position'], 'duration': status['duration'],
+                    'queue': status['queue'], 'songs': status['songs']}
+        raise HTTPError(404)
+
+    # ----------------- Audio -----------------
+    async def send_audio(self, writer, sid: str, headers: dict, head_only: bool, keep_alive: bool) -> None:
+        node = self.node_for(sid)
+        if node is None:
+            raise HTTPError(404, 'no such song')
+        try:
+            f = open(node.path, 'rb')
+        except OSError:
+            raise HTTPError(404, 'file missing')
+        with f:
+            st = os.fstat(f.fileno())
+            size = st.st_size
+            etag = f'"{st.st_size:x}-{st.st_mtime_ns:x}"'
+            extra = {'Accept-Ranges': 'bytes', 'ETag': etag,
+                     'Last-Modified': formatdate(st.st_mtime, usegmt=True),
+                     'Content-Type': AUDIO_TYPES.get(os.path.splitext(node.path)[1].lower())
+                     or mimetypes.guess_type(node.path)[0] or 'application/octet-stream'}
+            if headers.get('if-none-match') == etag:
+                writer.write(self.head(304, {'ETag': etag}, keep_alive))
+                await writer.drain()
+                return
+            rng = headers.get('range')
+            if rng and headers.get('if-range') not in (None, etag):
+                rng = None  # the file changed since the client's partial copy
+            try:
+                span = parse_range(rng, size)
+            except ValueError:
+                writer.write(self.head(416, {'Content-Range': f'bytes */{size}', 'Content-Length': '0'},
+                                       keep_alive))
+                await writer.drain()
+                return
+            status, (start, end) = (206, span) if span else (200, (0, size - 1))
+            count = end - start + 1 if size else 0
+            extra['Content-Length'] = str(count)
+            if status == 206:
+                extra['Content-Range'] = f'bytes {start}-{end}/{size}'
+            writer.write(self.head(status, extra, keep_alive))
+            await writer.drain()
+            if head_only or not count:
+                return
+            if self.zero_copy:
+                # os.sendfile where the platform has it; asyncio falls back to
+                # chunked reads elsewhere (or for TLS transports)
+                await asyncio.get_running_loop().sendfile(writer.transport, f, start, count)
+                return
+            f.seek(start)
+            while count > 0:
+                data = f.read(min(count, 1 << 16))
+                if not data:
+                    break
+                count -= len(data)
+                writer.write(data)
+                await writer.drain()
+
+
+async def run(host: str, port: int) -> int:
+    from service import MusicService
+    service = MusicService()
+    # never claims data/: a GUI or daemon started later must still own it
+    # (run daemon.py --http to serve a library that is being changed)
+    service.read_only = True
+    service.load_state()
+    service.load_library()
+    service.loop = asyncio.get_running_loop()
+    server = LibraryHTTPServer(service, host, port)
+    try:
+        await service.build_indexes()  # /api/filter and sorted listings
+        await server.start()
+        print(f'Serving {len(service.playlist)} songs on http://{host}:{server.port}/', flush=True)
+        await asyncio.Event().wait()
+    finally:
+        await server.close()
+        service.shutdown()
+    return 0
+
+
+def main(argv=None) -> int:
+    p = argparse.ArgumentParser(description='Serve the music library over HTTP.')
+    p.add_argument('--host', default='127.0.0.1', help='0.0.0.0 to serve the whole LAN')
+    p.add_argument('--port', type=int, default=8080)
+    args = p.parse_args(argv)
+    try:
+        return asyncio.run(run(args.host, args.port))
+    except KeyboardInterrupt:
+        return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
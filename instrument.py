@@ -0,0 +1,180 @@
+# instrument.py
+# Opt-in timing counters and histograms for the hot paths.
+# Set MUZIC_PROFILE=1 before starting the app to enable it; the report is
+# written to profile.txt / profile.json (prefix from MUZIC_PROFILE_OUT) at
+# exit. When disabled, @timed returns the function untouched and span()
+# returns a shared no-op context, so instrumented code runs at full speed.
+import os
+import sys
+import json
+import time
+import atexit
+import functools
+import threading
+from contextlib import contextmanager, nullcontext
+from typing import Dict, List
+
+ENABLED = os.environ.get('MUZIC_PROFILE', '') not in ('', '0')
+OUT_PREFIX = os.environ.get('MUZIC_PROFILE_OUT', 'profile')
+
+_T0 = time.perf_counter()
+_NULL = nullcontext()
+_lock = threading.Lock()
+
+
+class Stat:
+    """Count/total/min/max plus a log2 histogram of microseconds."""
+    __slots__ = ('count', 'total', 'min', 'max', 'buckets')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = float('inf')
+        self.max = 0.0
+        self.buckets: Dict[int, int] = {}
+
+    def add(self, seconds: float) -> None:
+        self.count += 1
+        self.total += seconds
+        self.min = min(self.min, seconds)
+        self.max = max(self.max, seconds)
+        b = int(seconds * 1e6).bit_length()
+        self.buckets[b] = self.buckets.get(b, 0) + 1
+
+    def percentile(self, q: float) -> float:
+        # upper edge of the bucket holding the q-th sample
+        target = q * self.count
+        seen = 0
+        for b in sorted(self.buckets):
+            seen += self.buckets[b]
+            if seen >= target:
+                return min((1 << b) / 1e6, self.max)
+        return self.max
+
+    def to_dict(self) -> dict:
+        return {'count': self.count, 'total_s': self.total,
+                'mean_s': self.total / self.count if self.count else 0.0,
+                'min_s': self.min if self.count else 0.0, 'max_s': self.max,
+                'p50_s': self.percentile(0.5), 'p99_s': self.percentile(0.99),
+                'histogram_us_log2': {str(1 << b): n for b, n in sorted(self.buckets.items())}}
+
+
+stats: Dict[str, Stat] = {}
+counters: Dict[str, int] = {}
+phases: List[tuple] = []          # (name, start offset, duration) in seconds
+marks: List[tuple] = []           # (name, offset) in seconds
+_open: Dict[str, float] = {}      # started intervals awaiting finish()
+
+
+def record(name: str, seconds: float) -> None:
+    with _lock:
+        st = stats.get(name)
+        if st is None:
+            st = stats[name] = Stat()
+        st.add(seconds)
+
+
+def count(name: str, n: int = 1) -> None:
+    if ENABLED:
+        with _lock:
+            counters[name] = counters.get(name, 0) + n
+
+
+def timed(name: str):
+    def decorate(fn):
+        if not ENABLED:
+            return fn
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            t = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                record(name, time.perf_counter() - t)
+        return wrapper
+    return decorate
+
+
+@contextmanager
+def _span(name: str, phase: bool):
+    t = time.perf_counter()
+    try:
+        yield
+    finally:
+        dt = time.perf_counter() - t
+        record(name, dt)
+        if phase:
+            with _lock:
+                phases.append((name, t - _T0, dt))
+
+
+def span(name: str):
+    return _span(name, False) if ENABLED else _NULL
+
+
+def phase(name: str):
+    # like span, but also kept in order for the startup timeline
+    return _span(name, True) if ENABLED else _NULL
+
+
+def mark(name: str) -> None:
+    if ENABLED:
+        with _lock:
+            marks.append((name, time.perf_counter() - _T0))
+
+
+def start(name: str) -> None:
+    # begin an interval that may finish on another thread (e.g. first audio)
+    if ENABLED:
+        _open[name] = time.perf_counter()
+
+
+def finish(name: str) -> None:
+    if ENABLED:
+        t = _open.pop(name, None)
+        if t is not None:
+            record(name, time.perf_counter() - t)
+
+
+# ----------------- Reports -----------------
+def snapshot() -> dict:
+    with _lock:
+        return {'stats': {k: v.to_dict() for k, v in sorted(stats.items())},
+                'counters': dict(counters),
+                'phases': [{'name': n, 'start_s': s, 'duration_s': d} for n, s, d in phases],
+                'marks': [{'name': n, 'at_s': t} for n, t in marks]}
+
+
+def dump_text(stream=None) -> None:
+    stream = stream or sys.stderr
+    snap = snapshot()
+    ms = lambda s: f'{s * 1000:9.3f}'
+    stream.write(f"{'name':40} {'count':>8} {'total ms':>9} {'mean ms':>9} {'p50 ms':>9} {'p99 ms':>9} {'max ms':>9}\n")
+    for name, st in snap['stats'].items():
+        stream.write(f"{name:40} {st['count']:8d} {ms(st['total_s'])} {ms(st['mean_s'])} "
+                     f"{ms(st['p50_s'])} {ms(st['p99_s'])} {ms(st['max_s'])}\n")
+    for name, n in sorted(snap['counters'].items()):
+        stream.write(f'{name:40} {n:8d}\n')
+    for p in snap['phases']:
+        stream.write(f"phase {p['name']:34} at {ms(p['start_s'])} ms  took {ms(p['duration_s'])} ms\n")
+    for m in snap['marks']:
+        stream.write(f"mark  {m['name']:34} at {ms(m['at_s'])} ms\n")
+
+
+def export_json(path: str) -> None:
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(snapshot(), f, indent=2)
+
+
+def _write_reports() -> None:
+    try:
+        with open(OUT_PREFIX + '.txt', 'w', encoding='utf-8') as f:
+            dump_text(f)
+        export_json(OUT_PREFIX + '.json')
+    except OSError as e:
+        print('Could not write profile:', e)
+
+
+if ENABLED:
+    atexit.register(_write_reports)
@@ -0,0 +1,398 @@
+# library_db.py
+# Embedded SQLite store for everything the app keeps between runs: the
+# library index (songs added by reference, registered folders, scan
+# manifest), the metadata cache, play counts and the play log, the upcoming
+# queue and saved playlists. The in-memory structures (Playlist, SongMap,
+# SongHeap, BST, RecentlyPlayed) are caches hydrated from it at startup;
+# changes are written back in batched transactions by the autosave.
+# The database runs in WAL mode, so a read-only second process can load it
+# while the owner writes. The old JSON files are imported once (migrate()).
+import os
+import json
+import time
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Optional, Tuple
+
+SCHEMA_VERSION = 4
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS folders (
+    path TEXT PRIMARY KEY,
+    position INTEGER NOT NULL
+);
+-- a song is known to the index if it was added by reference or was found in
+-- a registered folder (then size/mtime are the scan manifest)
+CREATE TABLE IF NOT EXISTS songs (
+    path TEXT PRIMARY KEY,
+    title TEXT NOT NULL,
+    title_norm TEXT NOT NULL,
+    reference INTEGER NOT NULL DEFAULT 0,
+    size INTEGER,
+    mtime INTEGER
+);
+CREATE INDEX IF NOT EXISTS songs_title ON songs (title_norm);
+-- when each song first entered the library (any source), for the "date
+-- added" order. Kept after it leaves, so a file that comes back keeps its date
+CREATE TABLE IF NOT EXISTS added (
+    path TEXT PRIMARY KEY,
+    added_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS metadata (
+    path TEXT PRIMARY KEY,
+    size INTEGER,
+    mtime INTEGER,
+    duration INTEGER NOT NULL DEFAULT 0,
+    artist TEXT,
+    album TEXT,
+    artist_norm TEXT,
+    album_norm TEXT,
+    extra TEXT            -- JSON: remaining tags, loudness, content hash
+);
+CREATE INDEX IF NOT EXISTS metadata_artist ON metadata (artist_norm);
+CREATE INDEX IF NOT EXISTS metadata_album ON metadata (album_norm);
+CREATE TABLE IF NOT EXISTS play_counts (
+    title TEXT PRIMARY KEY,
+    count INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS play_counts_count ON play_counts (count DESC);
+-- every play, oldest first: the recently played list is its tail
+CREATE TABLE IF NOT EXISTS plays (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    title TEXT NOT NULL,
+    path TEXT,
+    played_at REAL
+);
+CREATE INDEX IF NOT EXISTS plays_title ON plays (title);
+-- Space-Saving counters of listening_stats, per (level, bucket start)
+CREATE TABLE IF NOT EXISTS stat_buckets (
+    level INTEGER NOT NULL,     -- 0 hour, 1 day, 2 month
+    start INTEGER NOT NULL,
+    title TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    error INTEGER NOT NULL,
+    PRIMARY KEY (level, start, title)
+) WITHOUT ROWID;
+-- song pairs heard in the same session (recommend.py), a < b
+CREATE TABLE IF NOT EXISTS co_plays (
+    a TEXT NOT NULL,
+    b TEXT NOT NULL,
+    weight REAL NOT NULL,
+    PRIMARY KEY (a, b)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS queue (
+    position INTEGER PRIMARY KEY,
+    title TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS playlists (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT UNIQUE NOT NULL,
+    updated_at REAL
+);
+CREATE TABLE IF NOT EXISTS playlist_items (
+    playlist_id INTEGER NOT NULL REFERENCES playlists (id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    path TEXT NOT NULL,
+    PRIMARY KEY (playlist_id, position)
+);
+"""
+
+METADATA_COLUMNS = ('size', 'mtime', 'duration', 'artist', 'album')
+
+
+def norm(text: Optional[str]) -> Optional[str]:
+    # same folding as the title keys in SongMap
+    return text.lower() if text else None
+
+
+def metadata_row(path: str, entry: dict) -> tuple:
+    extra = {k: v for k, v in entry.items() if k not in METADATA_COLUMNS}
+    return (path, entry.get('size'), entry.get('mtime'), int(entry.get('duration', 0) or 0),
+            entry.get('artist'), entry.get('album'), norm(entry.get('artist')), norm(entry.get('album')),
+            json.dumps(extra) if extra else None)
+
+
+def metadata_entry(row) -> dict:
+    entry = json.loads(row[6]) if row[6] else {}
+    for key, value in zip(METADATA_COLUMNS, row[1:6]):
+        if value is not None:
+            entry[key] = value
+    return entry
+
+
+class TrackedDict(dict):
+    """dict that remembers which keys were set or removed, so a save only
+    writes those rows. Only item assignment, del and pop are tracked."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.changed = set()
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self.changed.add(key)
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self.changed.add(key)
+
+    def pop(self, key, *default):
+        if key in self:
+            self.changed.add(key)
+        return super().pop(key, *default)
+
+    def take(self) -> set:
+        changed, self.changed = self.changed, set()
+        return changed
+
+
+class LibraryDB:
+    def __init__(self, path: str, read_only: bool = False):
+        self.path = path
+        self.read_only = read_only
+        self.conn: Optional[sqlite3.Connection] = None
+        # one connection shared by the loop thread and the executor
+        self.lock = threading.RLock()
+
+    def open(self) -> None:
+        if self.conn is not None:
+            return
+        if self.read_only:
+            # another process owns the file; never create or migrate it
+            self.conn = sqlite3.connect(f'file:{self.path}?mode=ro', uri=True,
+                                        check_same_thread=False, isolation_level=None)
+            return
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        self.conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        # WAL + NORMAL: a crash can lose the last autosave, never corrupt
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute('PRAGMA foreign_keys=ON')
+        with self.transaction() as cur:
+            # executescript() would commit on its own
+            for statement in SCHEMA.split(';'):
+                if statement.strip():
+                    cur.execute(statement)
+            self.set_meta(cur, 'schema_version', SCHEMA_VERSION)
+
+    def close(self) -> None:
+        with self.lock:
+            if self.conn is not None:
+                self.conn.close()
+                self.conn = None
+
+    @property
+    def writable(self) -> bool:
+        return self.conn is not None and not self.read_only
+
+    @contextmanager
+    def transaction(self):
+        """One write transaction: everything inside commits together or not
+        at all."""
+        with self.lock:
+            cur = self.conn.cursor()
+            cur.execute('BEGIN IMMEDIATE')
+            try:
+                yield cur
+            except BaseException:
+                cur.execute('ROLLBACK')
+                raise
+            cur.execute('COMMIT')
+
+    def query(self, sql: str, params: tuple = ()) -> list:
+        with self.lock:
+            if self.conn is None:
+                return []
+            return self.conn.execute(sql, params).fetchall()
+
+    def get_meta(self, key: str) -> Optional[str]:
+        rows = self.query('SELECT value FROM meta WHERE key = ?', (key,))
+        return rows[0][0] if rows else None
+
+    def set_meta(self, cur, key: str, value) -> None:
+        cur.execute('INSERT OR REPLACE INTO meta VALUES (?, ?)', (key, str(value)))
+
+    def bump_meta(self, cur, key: str) -> None:
+        # generation counters: a warm-start snapshot is only trusted while they match
+        row = cur.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        self.set_meta(cur, key, int(row[0]) + 1 if row else 1)
+
+    def generations(self) -> Tuple[int, int]:
+        # (index_gen, metadata_gen)
+        return int(self.get_meta('index_gen') or 0), int(self.get_meta('metadata_gen') or 0)
+
+    # ----------------- Library Index -----------------
+    def load_index(self) -> Tuple[Dict[str, str], List[str], Dict[str, list]]:
+        references, manifest = {}, {}
+        for path, title, reference, size, mtime in self.query(
+                'SELECT path, title, reference, size, mtime FROM songs'):
+            if reference:
+                references[path] = title
+            if size is not None:
+                manifest[path] = [size, mtime]
+        folders = [row[0] for row in self.query('SELECT path FROM folders ORDER BY position')]
+        return references, folders, manifest
+
+    def load_added(self) -> Dict[str, float]:
+        return dict(self.query('SELECT path, added_at FROM added'))
+
+    def save_added(self, cur, added: Iterable[Tuple[str, float]]) -> None:
+        cur.executemany('INSERT OR REPLACE INTO added VALUES (?, ?)', added)
+
+    def save_index(self, cur, paths: Iterable[str], references: dict, manifest: dict,
+                   folders: Optional[List[str]] = None) -> None:
+        upserts, deletes = [], []
+        for path in paths:
+            ref = path in references
+            scanned = manifest.get(path)
+            if not ref and scanned is None:
+                deletes.append((path,))
+                continue
+            title = references.get(path) or os.path.splitext(os.path.basename(path))[0]
+            size, mtime = scanned if scanned is not None else (None, None)
+            upserts.append((path, title, title.lower(), int(ref), size, mtime))
+        cur.executemany('DELETE FROM songs WHERE path = ?', deletes)
+        cur.executemany('INSERT OR REPLACE INTO songs VALUES (?, ?, ?, ?, ?, ?)', upserts)
+        if folders is not None:
+            cur.execute('DELETE FROM folders')
+            cur.executemany('INSERT INTO folders VALUES (?, ?)', [(f, i) for i, f in enumerate(folders)])
+        self.bump_meta(cur, 'index_gen')
+
+    # ----------------- Metadata -----------------
+    def load_metadata(self) -> Dict[str, dict]:
+        return {row[0]: metadata_entry(row) for row in self.query(
+            'SELECT path, size, mtime, duration, artist, album, extra FROM metadata')}
+
+    def save_metadata(self, cur, entries: Dict[str, Optional[dict]]) -> None:
+        # entries: path -> entry, or None for a dropped entry
+        cur.executemany('DELETE FROM metadata WHERE path = ?',
+                        [(p,) for p, e in entries.items() if e is None])
+        cur.executemany('INSERT OR REPLACE INTO metadata VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                        [metadata_row(p, e) for p, e in entries.items() if e is not None])
+        self.bump_meta(cur, 'metadata_gen')
+
+    # ----------------- Play Stats -----------------
+    def load_counts(self) -> Dict[str, int]:
+        return dict(self.query('SELECT title, count FROM play_counts'))
+
+    def load_history(self, limit: Optional[int]) -> List[str]:
+        """The recently played list, oldest first: distinct titles by their
+        last play after the last clear."""
+        floor = int(self.get_meta('history_floor') or 0)
+        sql = 'SELECT title FROM plays WHERE id > ? GROUP BY title ORDER BY MAX(id) DESC'
+        rows = self.query(sql + (' LIMIT ?' if limit is not None else ''),
+                          (floor, limit) if limit is not None else (floor,))
+        return [row[0] for row in reversed(rows)]
+
+    def save_plays(self, cur, plays: List[tuple], counts: Dict[str, int]) -> None:
+        # plays: (title, path, played_at); counts: the new totals
+        cur.executemany('INSERT INTO plays (title, path, played_at) VALUES (?, ?, ?)', plays)
+        cur.executemany('INSERT OR REPLACE INTO play_counts VALUES (?, ?)', counts.items())
+
+    def clear_history(self, cur) -> None:
+        # the play log stays (it feeds statistics); history starts after it
+        row = cur.execute('SELECT MAX(id) FROM plays').fetchone()
+        self.set_meta(cur, 'history_floor', row[0] or 0)
+
+    def timed_plays(self) -> list:
+        # (title, played_at) of every play with a timestamp, oldest first
+        return self.query('SELECT title, played_at FROM plays WHERE played_at IS NOT NULL ORDER BY id')
+
+    def last_plays(self, n: int) -> list:
+        rows = self.query('SELECT title, played_at FROM plays WHERE played_at IS NOT NULL '
+                          'ORDER BY id DESC LIMIT ?', (n,))
+        return rows[::-1]
+
+    def last_play_id(self) -> int:
+        return self.query('SELECT MAX(id) FROM plays')[0][0] or 0
+
+    def plays_since(self, play_id: int) -> list:
+        # (title, played_at) logged after play_id, oldest first
+        return self.query('SELECT title, played_at FROM plays WHERE id > ? ORDER BY id', (play_id,))
+
+    def last_played(self) -> Dict[str, float]:
+        # title -> time of its latest play
+        return dict(self.query('SELECT title, MAX(played_at) FROM plays '
+                               'WHERE played_at IS NOT NULL GROUP BY title'))
+
+    def load_co_plays(self) -> list:
+        return self.query('SELECT a, b, weight FROM co_plays')
+
+    def save_co_plays(self, cur, rows: list) -> None:
+        cur.executemany('INSERT OR REPLACE INTO co_plays VALUES (?, ?, ?)', rows)
+
+    def load_stat_rows(self) -> list:
+        return self.query('SELECT level, start, title, count, error FROM stat_buckets')
+
+    def save_stat_buckets(self, cur, buckets: list, pruned: List[int]) -> None:
+        # buckets: (level, start, [(title, count, error)]) replaced whole
+        for level, start, counters in buckets:
+            cur.execute('DELETE FROM stat_buckets WHERE level = ? AND start = ?', (level, start))
+            cur.executemany('INSERT INTO stat_buckets VALUES (?, ?, ?, ?, ?)',
+                            [(level, start, t, c, e) for t, c, e in counters])
+        for level, horizon in enumerate(pruned):
+            cur.execute('DELETE FROM stat_buckets WHERE level = ? AND start < ?', (level, horizon))
+
+    # ----------------- Queue & Playlists -----------------
+    def load_queue(self) -> List[str]:
+        return [row[0] for row in self.query('SELECT title FROM queue ORDER BY position')]
+
+    def save_queue(self, cur, titles: List[str]) -> None:
+        cur.execute('DELETE FROM queue')
+        cur.executemany('INSERT INTO queue VALUES (?, ?)', enumerate(titles))
+
+    def save_playlist(self, name: str, paths: List[str]) -> None:
+        with self.transaction() as cur:
+            cur.execute('INSERT INTO playlists (name, updated_at) VALUES (?, ?) '
+                        'ON CONFLICT (name) DO UPDATE SET updated_at = excluded.updated_at',
+                        (name, time.time()))
+            pid = cur.execute('SELECT id FROM playlists WHERE name = ?', (name,)).fetchone()[0]
+            cur.execute('DELETE FROM playlist_items WHERE playlist_id = ?', (pid,))
+            cur.executemany('INSERT INTO playlist_items VALUES (?, ?, ?)',
+                            [(pid, i, p) for i, p in enumerate(paths)])
+
+    def playlists(self) -> List[str]:
+        return [row[0] for row in self.query('SELECT name FROM playlists ORDER BY name')]
+
+    def playlist(self, name: str) -> List[str]:
+        return [row[0] for row in self.query(
+            'SELECT i.path FROM playlist_items i JOIN playlists p ON p.id = i.playlist_id '
+            'WHERE p.name = ? ORDER BY i.position', (name,))]
+
+    # ----------------- Migration -----------------
+    def migrate(self, data_dir: str) -> bool:
+        """Imports the JSON state files written by earlier versions, once.
+        The files are left in place (they are no longer written)."""
+        if self.read_only or self.get_meta('json_migrated'):
+            return False
+
+        def read(name):
+            path = os.path.join(data_dir, name)
+            if not os.path.exists(path):
+                return None
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    return json.load(f)
+            except Exception as e:
+                print(f'Could not migrate {name}:', e)
+                return None
+
+        index = read('library.json') or {}
+        metadata = read('metadata.json') or {}
+        counts = read('play_counts.json') or {}
+        history = (read('recently_played.json') or {}).get('history', [])
+        with self.transaction() as cur:
+            references, manifest = index.get('references', {}), index.get('manifest', {})
+            self.save_index(cur, set(references) | set(manifest), references, manifest,
+                            index.get('folders', []))
+            self.save_metadata(cur, metadata)
+            # history entries become the oldest plays of the log
+            self.save_plays(cur, [(title, None, None) for title in history],
+                            {t: int(c) for t, c in counts.items()})
+            self.set_meta(cur, 'json_migrated', time.strftime('%Y-%m-%dT%H:%M:%S'))
+        return bool(index or metadata or counts or history)
@@ -0,0 +1,281 @@
+# library_index.py
+# Persistent library index: songs added by reference, registered folders and
+# the scan manifest used by the incremental folder scanner. Kept in memory,
+# stored in the songs and folders tables of library_db.
+import os
+import time
+import shutil
+import threading
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from hashmap import normalize_path
+from library_db import LibraryDB, TrackedDict
+from decoder import FORMATS
+
+AUDIO_EXTS = tuple(FORMATS)
+
+
+def title_from_path(path: str) -> str:
+    return os.path.splitext(os.path.basename(path))[0]
+
+
+def is_audio_file(name: str) -> bool:
+    return name.lower().endswith(AUDIO_EXTS)
+
+
+# ----------------- Incremental Scanner -----------------
+def iter_audio_files(folder: str) -> Iterator[Tuple[str, int, int]]:
+    # Yields (path, size, mtime_ns) for every audio file below folder
+    stack = [folder]
+    while stack:
+        cur = stack.pop()
+        try:
+            with os.scandir(cur) as it:
+                for entry in it:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(entry.path)
+                        elif is_audio_file(entry.name) and entry.is_file():
+                            st = entry.stat()
+                            yield entry.path, st.st_size, st.st_mtime_ns
+                    except OSError:
+                        continue
+        except OSError:
+            continue
+
+
+def folder_changes(folder: str, manifest: Dict[str, list]) -> List[Tuple[str, str, Optional[list]]]:
+    """Compares folder against manifest: ('added' | 'modified' | 'removed',
+    path, [size, mtime_ns] or None when removed) for every file that changed.
+    The manifest is only read, so this can run on a worker thread with a copy."""
+    folder = os.path.abspath(folder)
+    prefix = os.path.join(folder, '')
+    seen = set()
+    changes = []
+    for path, size, mtime in iter_audio_files(folder):
+        seen.add(path)
+        old = manifest.get(path)
+        if old is None:
+            changes.append(('added', path, [size, mtime]))
+        elif old[0] != size or old[1] != mtime:
+            changes.append(('modified', path, [size, mtime]))
+    changes += [('removed', p, None) for p in manifest if p.startswith(prefix) and p not in seen]
+    return changes
+
+
+# ----------------- Index -----------------
+class LibraryIndex:
+    def __init__(self, db: LibraryDB):
+        self.db = db
+        # external files added by reference: path -> title
+        self.references: Dict[str, str] = TrackedDict()
+        # folders registered with "add folder"
+        self.folders: List[str] = []
+        # path -> [size, mtime_ns] from the last scan of a registered folder
+        self.manifest: Dict[str, list] = TrackedDict()
+        # path -> when the song entered the library (time.time())
+        self.added: Dict[str, float] = TrackedDict()
+        # no dates recorded yet (a library from before they were kept): the
+        # songs already there take their file's mtime instead of "now"
+        self.seeding = False
+        self.dirty = False
+
+    def load(self) -> None:
+        try:
+            references, self.folders, manifest = self.db.load_index()
+            self.references, self.manifest = TrackedDict(references), TrackedDict(manifest)
+            self.added = TrackedDict(self.db.load_added())
+            self.seeding = not self.added
+        except Exception as e:
+            print('Could not load library index:', e)
+
+    def save(self) -> None:
+        # writes only the rows that changed, in one transaction
+        if not self.dirty or not self.db.writable:
+            return
+        self.dirty = False
+        references, manifest, added = self.references.take(), self.manifest.take(), self.added.take()
+        try:
+            with self.db.transaction() as cur:
+                self.db.save_index(cur, references | manifest, self.references, self.manifest,
+                                   list(self.folders))
+                self.db.save_added(cur, [(path, self.added[path]) for path in added])
+        except Exception as e:
+            self.references.changed |= references
+            self.manifest.changed |= manifest
+            self.added.changed |= added
+            self.dirty = True
+            print('Could not save library index:', e)
+
+    def add_reference(self, path: str) -> str:
+        path = os.path.abspath(path)
+        title = title_from_path(path)
+        self.references[path] = title
+        self.dirty = True
+        return title
+
+    def added_at(self, path: str, entry: Optional[dict] = None) -> float:
+        """When path entered the library; a song seen for the first time is
+        recorded now (or at its file's mtime while seeding)."""
+        when = self.added.get(path)
+        if when is None:
+            mtime = (entry or {}).get('mtime') if self.seeding else None
+            when = self.added[path] = mtime / 1e9 if mtime else time.time()
+            self.dirty = True
+        return when
+
+    def remove_path(self, path: str) -> None:
+        path = os.path.abspath(path)
+        self.references.pop(path, None)
+        self.manifest.pop(path, None)
+        self.dirty = True
+
+    def add_folder(self, folder: str) -> None:
+        folder = os.path.abspath(folder)
+        if folder not in self.folders:
+            self.folders.append(folder)
+            self.dirty = True
+
+    def _insert(self, playlist, song_map, path: str):
+        node = playlist.insert_song_end(title_from_path(path), path)
+        song_map.insert_to_hash(node.title, node)
+        return node
+
+    def scan_into(self, folder: str, playlist, song_map, changes: Optional[list] = None) -> List:
+        """Incrementally rescans one registered folder and applies the changes
+        to the manifest and playlist/song_map. changes are folder_changes()
+        taken earlier (e.g. off the event loop); None scans now. Returns the
+        nodes that were added."""
+        if changes is None:
+            changes = folder_changes(folder, self.manifest)
+        added = []
+        for kind, path, stat in changes:
+            self.dirty = True
+            if stat is None:
+                self.manifest.pop(path, None)
+            else:
+                self.manifest[path] = stat
+            if kind == 'added':
+                if song_map.search_path(path) is None:
+                    added.append(self._insert(playlist, song_map, path))
+            elif kind == 'removed':
+                node = song_map.search_path(path)
+                if node is not None:
+                    playlist.remove_node(node)
+                    song_map.remove_from_hash(node.title)
+        return added
+
+    def _in_folders(self, path: str) -> bool:
+        return any(path.startswith(os.path.join(f, '')) for f in self.folders)
+
+    def apply_events(self, events, playlist, song_map, bst=None, metadata=None) -> Tuple[List, List]:
+        """Applies watcher events to the in-memory library without a rescan.
+        A 'removed' path that is not a known song is treated as a removed
+        directory. Returns (added_nodes, removed_nodes)."""
+        added, removed = [], []
+
+        def drop(node):
+            playlist.remove_node(node)
+            song_map.remove_from_hash(node.title)
+            if bst is not None:
+                bst.delete(node.title)
+            removed.append(node)
+
+        for kind, path in events:
+            path = os.path.abspath(path)
+            node = song_map.search_path(path)
+            if kind == 'removed':
+                if node is not None:
+                    drop(node)
+                    nodes = [node]
+                    if metadata is not None:
+                        metadata.invalidate(path)
+                else:
+                    prefix = normalize_path(os.path.join(path, ''))
+                    nodes = [n for p, n in list(song_map.paths.items()) if p.startswith(prefix)]
+                    for n in nodes:
+                        drop(n)
+                    if metadata is not None:
+                        metadata.remove_prefix(os.path.join(path, ''))
+                for n in nodes:
+                    self.manifest.pop(n.path, None)
+                    self.references.pop(n.path, None)
+                self.dirty = True
+                continue
+            if metadata is not None:
+                metadata.invalidate(path)
+            if node is None:
+                node = self._insert(playlist, song_map, path)
+                if bst is not None:
+                    bst.insert(node.title)
+                added.append(node)
+            if self._in_folders(path):
+                try:
+                    st = os.stat(path)
+                    self.manifest[path] = [st.st_size, st.st_mtime_ns]
+                    self.dirty = True
+                except OSError:
+                    pass
+        return added, removed
+
+    def populate(self, playlist, song_map) -> None:
+        # Known files come straight from the index; the folder rescans then
+        # only touch what changed since the last run
+        for path in list(self.references) + list(self.manifest):
+            if song_map.search_path(path) is None:
+                self._insert(playlist, song_map, path)
+        for folder in self.folders:
+            self.scan_into(folder, playlist, song_map)
+
+
+# ----------------- Copy Mode -----------------
+FICLONE = 0x40049409  # Linux ioctl for copy-on-write clones (btrfs, xfs)
+
+
+def _reflink(src: str, dst: str) -> bool:
+    try:
+        import fcntl
+    except ImportError:
+        return False
+    try:
+        with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+        shutil.copystat(src, dst)
+        return True
+    except OSError:
+        try:
+            os.remove(dst)
+        except OSError:
+            pass
+        return False
+
+
+def link_or_copy(src: str, dst: str) -> str:
+    # Hardlink on the same filesystem, then reflink, then a plain copy.
+    # Writes go to a temp name so a half-copied file never shows up in songs/.
+    tmp = dst + '.part'
+    try:
+        os.link(src, tmp)
+    except OSError:
+        if not _reflink(src, tmp):
+            shutil.copy2(src, tmp)
+    os.replace(tmp, dst)
+    return dst
+
+
+def copy_in_background(src: str, dst: str,
+                       on_done: Optional[Callable[[Optional[str], Optional[Exception]], None]] = None
+                       ) -> threading.Thread:
+    def worker():
+        try:
+            result = link_or_copy(src, dst)
+        except Exception as e:
+            if on_done:
+                on_done(None, e)
+            return
+        if on_done:
+            on_done(result, None)
+
+    t = threading.Thread(target=worker, daemon=True)
+    t.start()
+    return t
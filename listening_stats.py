@@ -0,0 +1,192 @@
+# listening_stats.py
+# Time-windowed listening statistics: "top this week", "trending".
+# Every play lands in three time buckets (its hour, day and calendar month,
+# UTC). Each bucket is a Space-Saving summary holding at most `capacity`
+# counters, so memory is bounded however many plays a bucket sees, and
+# summaries merge by adding counters. A query covers its window with the
+# fewest buckets (whole months, then whole days, then hours at the edges)
+# and merges only those: a few hundred small dicts for years of history.
+# Old hour and day buckets are dropped after HOUR_KEEP / DAY_KEEP; queries
+# reaching further back round their edges to days or months.
+import time
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Optional, Tuple
+
+HOUR, DAY = 3600, 86400
+LEVELS = ('hour', 'day', 'month')
+HOUR_KEEP = 31 * DAY
+DAY_KEEP = 2 * 366 * DAY
+WINDOWS = {'day': DAY, 'week': 7 * DAY, 'month': 30 * DAY, 'year': 365 * DAY}
+
+
+def month_start(ts: float) -> int:
+    d = datetime.fromtimestamp(ts, timezone.utc)
+    return int(datetime(d.year, d.month, 1, tzinfo=timezone.utc).timestamp())
+
+
+def next_month(start: int) -> int:
+    d = datetime.fromtimestamp(start, timezone.utc)
+    year, month = (d.year + 1, 1) if d.month == 12 else (d.year, d.month + 1)
+    return int(datetime(year, month, 1, tzinfo=timezone.utc).timestamp())
+
+
+def bucket_start(level: int, ts: float) -> int:
+    if level == 0:
+        return int(ts // HOUR * HOUR)
+    if level == 1:
+        return int(ts // DAY * DAY)
+    return month_start(ts)
+
+
+class SpaceSaving:
+    """Top-k counter in bounded memory (Metwally et al.). While fewer than
+    capacity titles were seen the counts are exact; after that a new title
+    replaces the smallest counter and inherits its count as error, so a
+    count never underestimates and is at most error too high."""
+
+    __slots__ = ('capacity', 'counters')
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.counters: Dict[str, list] = {}   # title -> [count, error]
+
+    def add(self, title: str, count: int = 1) -> None:
+        c = self.counters.get(title)
+        if c is not None:
+            c[0] += count
+        elif len(self.counters) < self.capacity:
+            self.counters[title] = [count, 0]
+        else:
+            # O(capacity) scan; only once the bucket is full
+            victim = min(self.counters, key=lambda t: self.counters[t][0])
+            floor = self.counters.pop(victim)[0]
+            self.counters[title] = [floor + count, floor]
+
+    def full(self) -> bool:
+        return len(self.counters) >= self.capacity
+
+    def floor(self) -> int:
+        # what an unlisted title may have had
+        return min(c[0] for c in self.counters.values()) if self.full() else 0
+
+
+def merge(summaries: Iterable[SpaceSaving], capacity: Optional[int] = None) -> Dict[str, list]:
+    """Adds summaries up. A title missing from a full summary may still have
+    been played up to its floor, which is added to its count and error so
+    the result keeps the Space-Saving guarantee."""
+    acc: Dict[str, list] = {}
+    penalty = 0
+    for s in summaries:
+        floor = s.floor()
+        penalty += floor
+        for title, (count, error) in s.counters.items():
+            a = acc.get(title)
+            if a is None:
+                acc[title] = [count, error, floor]
+            else:
+                a[0] += count
+                a[1] += error
+                a[2] += floor
+    result = {t: [a[0] + penalty - a[2], a[1] + penalty - a[2]] for t, a in acc.items()}
+    if capacity is not None and len(result) > capacity:
+        keep = sorted(result, key=lambda t: -result[t][0])[:capacity]
+        result = {t: result[t] for t in keep}
+    return result
+
+
+class ListeningStats:
+    def __init__(self, capacity: int = 200):
+        self.capacity = capacity
+        self.buckets: List[Dict[int, SpaceSaving]] = [{}, {}, {}]   # per level: start -> summary
+        self.dirty = set()       # (level, start) changed since the last save
+        self.pruned = [0, 0]     # hour/day buckets before these starts are gone
+
+    def add(self, title: str, ts: Optional[float] = None, count: int = 1) -> None:
+        ts = time.time() if ts is None else ts
+        for level in range(3):
+            start = bucket_start(level, ts)
+            bucket = self.buckets[level].get(start)
+            if bucket is None:
+                bucket = self.buckets[level][start] = SpaceSaving(self.capacity)
+            bucket.add(title, count)
+            self.dirty.add((level, start))
+
+    def prune(self, now: Optional[float] = None) -> None:
+        now = time.time() if now is None else now
+        for level, keep in ((0, HOUR_KEEP), (1, DAY_KEEP)):
+            horizon = bucket_start(level, now - keep)
+            if horizon <= self.pruned[level]:
+                continue
+            self.pruned[level] = horizon
+            for start in [s for s in self.buckets[level] if s < horizon]:
+                del self.buckets[level][start]
+                self.dirty.discard((level, start))
+
+    # ----------------- Queries -----------------
+    def cover(self, since: float, until: float) -> List[SpaceSaving]:
+        """The buckets that make up [since, until), at hour resolution."""
+        hours, days, months = self.buckets
+        t = bucket_start(0, since)
+        out = []
+        while t < until:
+            m_end = next_month(t) if t == month_start(t) else None
+            if m_end is not None and m_end <= until:
+                level, end = 2, m_end
+            elif t % DAY == 0 and t + DAY <= until and t >= self.pruned[1]:
+                level, end = 1, t + DAY
+            elif t >= self.pruned[0]:
+                level, end = 0, t + HOUR
+            elif t >= self.pruned[1]:
+                # hours are gone this far back: widen to the whole day
+                level, t = 1, bucket_start(1, t)
+                end = t + DAY
+            else:
+                level, t = 2, month_start(t)
+                end = next_month(t)
+            bucket = self.buckets[level].get(t)
+            if bucket is not None:
+                out.append(bucket)
+            t = end
+        return out
+
+    def top(self, since: float, until: Optional[float] = None, n: int = 10) -> List[Tuple[str, int]]:
+        until = time.time() if until is None else until
+        counts = merge(self.cover(since, until))
+        best = sorted(counts, key=lambda t: (-counts[t][0], t))[:n]
+        return [(t, counts[t][0]) for t in best]
+
+    def window(self, name: str, n: int = 10, now: Optional[float] = None) -> List[Tuple[str, int]]:
+        now = time.time() if now is None else now
+        if name == 'trending':
+            return self.trending(n, now)
+        return self.top(now - WINDOWS[name], now, n)
+
+    def trending(self, n: int = 10, now: Optional[float] = None,
+                 recent: float = 7 * DAY, baseline: float = 28 * DAY) -> List[Tuple[str, int]]:
+        """Titles played more in the last week than their usual weekly rate
+        over the four weeks before. Returns (title, plays this week)."""
+        now = time.time() if now is None else now
+        new = merge(self.cover(now - recent, now))
+        old = merge(self.cover(now - recent - baseline, now - recent))
+        scale = recent / baseline
+        score = {t: c[0] - (old[t][0] * scale if t in old else 0) for t, c in new.items()}
+        best = sorted((t for t in score if score[t] > 0), key=lambda t: (-score[t], t))[:n]
+        return [(t, new[t][0]) for t in best]
+
+    # ----------------- Persistence -----------------
+    def snapshot(self) -> list:
+        # dirty buckets as rows, taken on the loop thread for a later save
+        rows = []
+        for level, start in self.dirty:
+            bucket = self.buckets[level].get(start)
+            if bucket is not None:
+                rows.append((level, start, [(t, c[0], c[1]) for t, c in bucket.counters.items()]))
+        self.dirty = set()
+        return rows
+
+    def load_rows(self, rows: Iterable[tuple]) -> None:
+        for level, start, title, count, error in rows:
+            bucket = self.buckets[level].get(start)
+            if bucket is None:
+                bucket = self.buckets[level][start] = SpaceSaving(self.capacity)
+            bucket.counters[title] = [count, error]
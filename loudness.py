@@ -0,0 +1,129 @@
+# loudness.py
+# Offline loudness analysis (ITU-R BS.1770 integrated loudness + sample peak)
+# for ReplayGain-style normalization. Each track is decoded once in a worker
+# process; results go into the metadata cache ('loudness', 'peak', 'gain')
+# and are saved as they arrive, so an interrupted run resumes where it
+# stopped and later runs only analyze new or changed files.
+import os
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from typing import Callable, Iterable, Optional, Tuple
+
+TARGET_LUFS = -18.0      # ReplayGain 2.0 reference level
+BLOCK_SECONDS = 0.4
+BLOCK_OVERLAP = 0.75
+ABSOLUTE_GATE = -70.0
+RELATIVE_GATE = -10.0
+
+# BS.1770 K-weighting biquads, specified at 48 kHz
+_SHELF = ((1.53512485958697, -2.69169618940638, 1.19839281085285),
+          (1.0, -1.69065929318241, 0.73248077421585))
+_HIGHPASS = ((1.0, -2.0, 1.0),
+             (1.0, -1.99004745483398, 0.99007225036621))
+
+
+def _k_weight_power(freqs):
+    # |H(f)|^2 of the K-weighting chain, evaluated on the 48 kHz unit circle
+    import numpy as np
+    z = np.exp(-2j * np.pi * np.minimum(freqs, 23999.0) / 48000.0)
+    response = np.ones_like(z)
+    for b, a in (_SHELF, _HIGHPASS):
+        response *= (b[0] + b[1] * z + b[2] * z * z) / (a[0] + a[1] * z + a[2] * z * z)
+    return np.abs(response) ** 2
+
+
+def measure_loudness(path: str) -> Tuple[float, float]:
+    """Returns (integrated loudness in LUFS, sample peak as linear amplitude)."""
+    import numpy as np
+    from decoder import decode_array
+    samples, rate = decode_array(path)
+    if len(samples) == 0:
+        return ABSOLUTE_GATE, 0.0
+    peak = float(np.abs(samples).max())
+    block = int(rate * BLOCK_SECONDS)
+    hop = max(1, int(block * (1 - BLOCK_OVERLAP)))
+    if len(samples) < block:
+        samples = np.pad(samples, ((0, block - len(samples)), (0, 0)))
+    n_blocks = 1 + (len(samples) - block) // hop
+    ch = samples.shape[1]
+    blocks = np.lib.stride_tricks.as_strided(
+        samples, shape=(n_blocks, block, ch),
+        strides=(samples.strides[0] * hop, samples.strides[0], samples.strides[1]))
+    # filter in the frequency domain and read mean square off Parseval
+    spectrum = np.abs(np.fft.rfft(blocks, axis=1)) ** 2
+    weight = _k_weight_power(np.fft.rfftfreq(block, 1.0 / rate))
+    spectrum *= weight[None, :, None]
+    spectrum[:, 1:(block + 1) // 2] *= 2
+    mean_square = spectrum.sum(axis=1) / (block * block)      # (blocks, channels)
+    power = mean_square[:, :2].sum(axis=1) if ch >= 2 else mean_square[:, 0]
+    with np.errstate(divide='ignore'):
+        block_lufs = -0.691 + 10 * np.log10(power)
+    gated = power[block_lufs > ABSOLUTE_GATE]
+    if len(gated) == 0:
+        return ABSOLUTE_GATE, peak
+    relative = -0.691 + 10 * np.log10(gated.mean()) + RELATIVE_GATE
+    gated = power[block_lufs > max(relative, ABSOLUTE_GATE)]
+    return float(-0.691 + 10 * np.log10(gated.mean())), peak
+
+
+def _analyze_worker(path: str):
+    try:
+        return path, measure_loudness(path), None
+    except Exception as e:
+        return path, None, str(e)
+
+
+def gain_for(loudness: float, target: float = TARGET_LUFS) -> float:
+    # silent (or all below the gate): nothing to normalize, no +52 dB boost
+    if loudness <= ABSOLUTE_GATE:
+        return 0.0
+    return round(target - loudness, 2)
+
+
+class LoudnessAnalyzer:
+    def __init__(self, metadata, workers: Optional[int] = None, save_every: int = 100):
+        self.metadata = metadata
+        self.workers = workers or os.cpu_count() or 2
+        self.save_every = save_every
+
+    def pending(self, paths: Iterable[str]):
+        # metadata.get drops an entry whose file changed, so stale results vanish
+        for path in paths:
+            if 'loudness' not in self.metadata.get(path):
+                yield path
+
+    def run(self, paths: Iterable[str], progress: Optional[Callable[[str, int], None]] = None) -> int:
+        """Analyzes every path without a loudness result. Returns the number of
+        tracks analyzed. Safe to interrupt; finished results are kept."""
+        todo = self.pending(paths)
+        done = 0
+        with ProcessPoolExecutor(max_workers=self.workers) as pool:
+            # keep a bounded window of jobs in flight instead of submitting all
+            running = set()
+            try:
+                while True:
+                    while len(running) < self.workers * 2:
+                        path = next(todo, None)
+                        if path is None:
+                            break
+                        running.add(pool.submit(_analyze_worker, path))
+                    if not running:
+                        break
+                    finished, running = wait(running, return_when=FIRST_COMPLETED)
+                    for fut in finished:
+                        path, result, err = fut.result()
+                        if err:
+                            print(f'Could not analyze {path}: {err}')
+                            continue
+                        loudness, peak = result
+                        self.metadata.update(path, loudness=round(loudness, 2), peak=round(peak, 5),
+                                             gain=gain_for(loudness))
+                        done += 1
+                        if progress:
+                            progress(path, done)
+                        if done % self.save_every == 0:
+                            self.metadata.save()
+            finally:
+                for fut in running:
+                    fut.cancel()
+                self.metadata.save()
+        return done
@@ -1,57 +1,38 @@
 # main.py
+# Command-line front end: a thin async REPL over the player daemon (started
+# on first use), or over an in-process MusicService with MUZIC_DAEMON=0.
+# Input is read on a helper thread, so the loop keeps running between
+# commands and tracks auto-advance while the menu waits.
 import os
-import json
-import shutil
-from playlist_dll import Playlist
-from hashmap import SongMap
-from stack_queue import RecentlyPlayed, UpcomingSongs
-from heap_bst import SongHeap, SongBST
-from player import MusicPlayer
-
-BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-DATA_DIR = os.path.join(BASE_DIR, 'data')
-SONG_DIR = os.path.join(BASE_DIR, 'songs')
-PLAY_COUNTS = os.path.join(DATA_DIR, 'play_counts.json')
-
-
-def ensure_dirs():
-    os.makedirs(DATA_DIR, exist_ok=True)
-    os.makedirs(SONG_DIR, exist_ok=True)
-
-
-def load_play_counts(heap: SongHeap):
-    if os.path.exists(PLAY_COUNTS):
+import asyncio
+import threading
+from client import RemoteService, open_service
+from library_index import is_audio_file
+
+
+def ainput(prompt: str = '') -> asyncio.Future:
+    # input() on a daemon thread; an abandoned read never blocks exit
+    loop = asyncio.get_running_loop()
+    fut = loop.create_future()
+
+    def settle(value=None, error=None):
+        if fut.done():
+            return
+        if error is not None:
+            fut.set_exception(error)
+        else:
+            fut.set_result(value)
+
+    def read():
         try:
-            with open(PLAY_COUNTS, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                for title, cnt in data.items():
-                    heap.counter[title] = cnt
-        except Exception:
-            pass
-
+            line = input(prompt)
+        except Exception as e:  # EOFError on closed stdin
+            loop.call_soon_threadsafe(settle, None, e)
+            return
+        loop.call_soon_threadsafe(settle, line)
 
-def save_play_counts(heap: SongHeap):
-    try:
-        with open(PLAY_COUNTS, 'w', encoding='utf-8') as f:
-            json.dump(heap.counter, f, indent=2)
-    except Exception as e:
-        print('Could not save play counts:', e)
-
-
-def init_music_manager():
-    playlist = Playlist()
-    song_map = SongMap()
-    history = RecentlyPlayed(max_size=500)
-    upcoming = UpcomingSongs(capacity=10)
-    heap = SongHeap()
-    bst = SongBST()
-    player = MusicPlayer()
-
-    playlist.load_from_folder(SONG_DIR)
-    song_map.rebuild_from_playlist(playlist)
-
-    load_play_counts(heap)
-    return playlist, song_map, history, upcoming, heap, bst, player
+    threading.Thread(target=read, daemon=True).start()
+    return fut
 
 
 def print_menu():
@@ -67,134 +48,138 @@ def print_menu():
     print('8. Search')
     print('9. Shuffle playlist')
     print('10. Delete song from playlist')
-    print('11. Add song (copy mp3 to songs/ folder)')
+    print('11. Add song (by reference, or copy to songs/ folder)')
     print('12. Show recently played')
     print('13. Clear history')
     print('14. Top played')
+    print('16. Import playlist (M3U/M3U8/PLS) into upcoming')
+    print('17. Export playlist (M3U/M3U8/PLS)')
+    print('18. Add folder (by reference)')
+    print('19. Find duplicate songs')
+    print('20. Analyze loudness (normalization)')
+    print('21. Quit the player daemon')
+    print('22. Similar songs / queue autofill')
+    print('23. Browse by facets (artist, album, genre, year, format, plays)')
+    print('24. Show library sorted (title, artist, album, duration, plays, added, played)')
     print('15. Save & Exit')
 
 
-def main():
-    ensure_dirs()
-    playlist, song_map, history, upcoming, heap, bst, player = init_music_manager()
-    current_node = None
+def show_list(model, header, empty, fmt=str, limit=None):
+    # works on local structures and daemon mirrors alike (at/len)
+    n = len(model) if limit is None else min(limit, len(model))
+    if n == 0:
+        print(empty)
+        return
+    print(header)
+    for i in range(n):
+        print(f"{i + 1}. {fmt(model.at(i))}")
+
+
+def on_event(event, data):
+    if event == 'track':
+        print(f"\nNow playing: {data['node'].title}")
+    elif event == 'message':
+        print(data['text'])
+    elif event == 'library' and data['reason'] == 'watch':
+        print(f"\nLibrary updated: {len(data['added'])} added, {len(data['removed'])} removed")
+
+
+async def main():
+    service = await open_service(history_size=500)
+    service.subscribe(on_event)
+    await service.start()
+    remote = isinstance(service, RemoteService)
+    playlist = service.playlist
 
     if len(playlist) == 0:
-        print("No MP3 files found in 'songs/' folder. Add up to 50 .mp3 files and restart.")
+        print("No audio files found in 'songs/' folder. Add up to 50 songs (MP3, FLAC, OGG, M4A, WAV...) and restart.")
 
     try:
         while True:
             print_menu()
-            choice = input('Choose an option: ').strip()
+            choice = (await ainput('Choose an option: ')).strip()
 
             if choice == '1':
                 playlist.display_playlist()
 
             elif choice == '2':
                 playlist.display_playlist()
-                idx = input('Enter number to play: ').strip()
+                idx = (await ainput('Enter number to play: ')).strip()
                 if not idx.isdigit():
                     print('Invalid number')
                     continue
-                idx = int(idx)
-                cur = playlist.head
-                i = 1
-                found = False
-                while cur and i <= idx:
-                    if i == idx:
-                        found = True
-                        break
-                    cur = cur.next
-                    i += 1
-                if not found or cur is None:
+                if not await service.play_index(int(idx)):
                     print('Index out of range')
-                    continue
-                current_node = cur
-                print(f"Now playing: {cur.title}")
-                player.play(cur.path)
-                history.push(cur.title)
-                heap.add_play(cur.title)
 
             elif choice == '3':
-                title = input('Enter song title: ').strip()
-                node = song_map.search_song(title)
-                if not node:
+                title = (await ainput('Enter song title: ')).strip()
+                if not await service.play_title(title):
                     print('Song not found in playlist.')
-                    continue
-                current_node = node
-                print(f"Now playing: {node.title}")
-                player.play(node.path)
-                history.push(node.title)
-                heap.add_play(node.title)
 
             elif choice == '4':
                 # Offer controls if a track is loaded (playing or paused)
-                if current_node or player.is_playing() or player.is_paused():
-                    sub = input('P=Pause, R=Resume, S=Stop: ').strip().lower()
+                if service.current:
+                    sub = (await ainput('P=Pause, R=Resume, S=Stop: ')).strip().lower()
                     if sub == 'p':
-                        player.pause(); print('Paused')
+                        await service.pause(); print('Paused')
                     elif sub == 'r':
-                        player.resume(); print('Resumed')
+                        await service.resume(); print('Resumed')
                     elif sub == 's':
-                        player.stop(); print('Stopped')
+                        await service.stop(); print('Stopped')
                     else:
                         print('Invalid')
                 else:
                     print('No song is currently loaded.')
 
             elif choice == '5':
-                if current_node is None:
+                if service.current is None:
                     print('No active song. Start playing first.')
                     continue
-                ctrl = input('N=Next, P=Previous: ').strip().lower()
-                if ctrl == 'n' and current_node.next:
-                    current_node = current_node.next
-                elif ctrl == 'p' and current_node.prev:
-                    current_node = current_node.prev
-                else:
+                ctrl = (await ainput('N=Next, P=Previous: ')).strip().lower()
+                node = None
+                if ctrl == 'n':
+                    node = await service.next()
+                elif ctrl == 'p':
+                    node = await service.prev()
+                if node is None:
                     print('No next/previous song available.')
-                    continue
-                print(f"Now playing: {current_node.title}")
-                player.play(current_node.path)
-                history.push(current_node.title)
-                heap.add_play(current_node.title)
 
             elif choice == '6':
                 playlist.display_playlist()
-                title = input('Enter exact title to add to upcoming queue: ').strip()
-                node = song_map.search_song(title)
+                title = (await ainput('Enter exact title to add to upcoming queue: ')).strip()
+                nxt = (await ainput('Play it next? (y/N): ')).strip().lower() == 'y'
+                node = await service.enqueue(title, next=nxt)
                 if not node:
                     print('Song not found.')
                     continue
-                upcoming.enqueue(node.title)
-                print(f'Enqueued {node.title} to upcoming')
+                print(f"Enqueued {node.title} {'to play next' if nxt else 'to upcoming'}")
 
             elif choice == '7':
-                upcoming.show()
+                show_list(service.upcoming, "\n🎶 Upcoming Songs:", "No upcoming songs.")
+                if not len(service.upcoming):
+                    continue
+                ctrl = (await ainput('R=Remove, M=Move, D=Remove duplicates, Enter=Back: ')).strip().lower()
+                try:
+                    if ctrl == 'r':
+                        n = int((await ainput('Number to remove: ')).strip())
+                        title = await service.queue_remove(n - 1)
+                        print(f'Removed {title}.' if title else 'No such entry.')
+                    elif ctrl == 'm':
+                        src = int((await ainput('Move number: ')).strip())
+                        dst = int((await ainput('To position: ')).strip())
+                        if not await service.queue_move(src - 1, dst - 1):
+                            print('No such entry.')
+                    elif ctrl == 'd':
+                        print(f'Removed {await service.queue_dedupe()} duplicate(s).')
+                except ValueError:
+                    print('Invalid number.')
 
             elif choice == '7.5':
-                title = upcoming.dequeue()
-                if not title:
-                    print('Upcoming queue is empty.')
-                else:
-                    node = song_map.search_song(title)
-                    if not node:
-                        print('Song not found in playlist.')
-                    else:
-                        current_node = node
-                        print(f"Now playing: {node.title}")
-                        player.play(node.path)
-                        history.push(node.title)
-                        heap.add_play(node.title)
+                await service.play_next_from_queue()
 
             elif choice == '8':
-                q = input('Search by substring: ').strip().lower()
-                matches = []
-                cur = playlist.head
-                while cur:
-                    if q in cur.title.lower():
-                        matches.append(cur.title)
-                    cur = cur.next
+                q = (await ainput('Search by substring: ')).strip()
+                matches = await service.search(q)
                 if not matches:
                     print('No matches')
                 else:
@@ -203,61 +188,189 @@ def main():
                         print(f"{i}. {t}")
 
             elif choice == '9':
-                playlist.shuffle_playlist()
-                song_map.rebuild_from_playlist(playlist)
-                current_node = playlist.head
-                print('Playlist shuffled. Reset to first track.')
+                await service.shuffle()
+                print('Playlist shuffled.')
 
             elif choice == '10':
                 playlist.display_playlist()
-                title = input('Enter exact title to delete: ').strip()
-                ok = playlist.delete_song_by_title(title)
-                if ok:
-                    song_map.remove_from_hash(title)
-                    print('Deleted')
-                else:
-                    print('Not found')
+                title = (await ainput('Enter exact title to delete: ')).strip()
+                print('Deleted' if await service.delete(title) else 'Not found')
 
             elif choice == '11':
-                p = input('Enter full path to .mp3 (or leave blank to skip): ').strip()
+                p = (await ainput('Enter full path to an audio file (or leave blank to skip): ')).strip()
                 if not p:
                     continue
-                if not os.path.exists(p) or not p.lower().endswith('.mp3'):
-                    print('File not found or not an mp3')
+                if not os.path.exists(p) or not is_audio_file(p):
+                    print('File not found or not a supported audio format')
                     continue
-                dst = os.path.join(SONG_DIR, os.path.basename(p))
-                shutil.copy2(p, dst)
-                node = playlist.insert_song_end(os.path.splitext(os.path.basename(dst))[0], dst)
-                song_map.insert_to_hash(node.title, node)
-                bst.insert(node.title)
-                print('Copied and added to playlist')
+                copy = (await ainput('Copy into songs/ folder? (y/N): ')).strip().lower() == 'y'
+                # The song is playable from its original location right away;
+                # in copy mode the node is re-pointed once the copy lands
+                if not await service.add_file(p, copy=copy):
+                    print('Already in library')
+                elif copy:
+                    print('Added to playlist, copying in background')
+                else:
+                    print('Added to playlist by reference')
 
             elif choice == '12':
-                history.show()
+                show_list(service.history, "\n🕘 Recently Played:", "No history.")
 
             elif choice == '13':
-                confirm = input('Clear history? (y/N): ').strip().lower()
+                confirm = (await ainput('Clear history? (y/N): ')).strip().lower()
                 if confirm == 'y':
-                    history.clear(); print('History cleared')
+                    await service.clear_history(); print('History cleared')
 
             elif choice == '14':
-                heap.show_top(10)
+                window = (await ainput('All time, Day, Week, Month, Year or Trending? [A/d/w/m/y/t]: ')).strip().lower()
+                window = {'d': 'day', 'w': 'week', 'm': 'month', 'y': 'year', 't': 'trending'}.get(window[:1], 'all')
+                if window == 'all':
+                    show_list(service.heap, "\n🎯 Top Played Songs:", "No plays recorded yet.",
+                              lambda v: f"{v[0]} — {v[1]} plays", limit=10)
+                    continue
+                top = await service.top_played(window, 10)
+                if not top:
+                    print('No plays in that window.')
+                    continue
+                print(f"\n🎯 Top Played Songs ({window}):")
+                for i, (title, plays) in enumerate(top, 1):
+                    print(f"{i}. {title} — {plays} plays")
+
+            elif choice == '16':
+                p = (await ainput('Enter path to .m3u/.m3u8/.pls: ')).strip()
+                if not os.path.isfile(p):
+                    print('Playlist file not found')
+                    continue
+                try:
+                    importer = await service.import_playlist(p)
+                except (OSError, ValueError) as e:
+                    print('Could not import playlist:', e)
+                    continue
+                print(f'Imported {importer.matched + importer.added} songs '
+                      f'({importer.added} new, {importer.missing} not found)')
+
+            elif choice == '17':
+                p = (await ainput('Export to (.m3u/.m3u8/.pls): ')).strip()
+                if not p:
+                    continue
+                try:
+                    count = await service.export_playlist(p)
+                except (OSError, ValueError) as e:
+                    print('Could not export playlist:', e)
+                    continue
+                print(f'Exported {count} songs to {p}')
+
+            elif choice == '18':
+                folder = (await ainput('Enter folder path: ')).strip()
+                if not os.path.isdir(folder):
+                    print('Folder not found')
+                    continue
+                added = await service.add_folder(folder)
+                print(f'Registered {len(added)} songs from {folder}')
+
+            elif choice == '19':
+                print('Scanning for duplicates (first run decodes every song)...')
+                try:
+                    groups = await service.find_duplicates()
+                except ImportError as e:
+                    print('Duplicate detection needs numpy:', e)
+                    continue
+                if not groups:
+                    print('No duplicates found')
+                for i, group in enumerate(groups, 1):
+                    print(f'{i}. ' + '\n   '.join(group))
+
+            elif choice == '20':
+                print('Analyzing loudness (progress is kept between runs)...')
+                try:
+                    done = await service.analyze_loudness(
+                        progress=lambda path, n: print(f'{n}. {os.path.basename(path)}'))
+                except ImportError as e:
+                    print('Loudness analysis needs numpy:', e)
+                    continue
+                print(f'Analyzed {done} songs')
+
+            elif choice == '21':
+                if not remote:
+                    print('Not connected to a daemon (MUZIC_DAEMON=0).')
+                    continue
+                await service.quit_daemon()
+                print('Daemon stopped.')
+                break
+
+            elif choice == '22':
+                title = (await ainput('Song title (blank = current song): ')).strip()
+                if not title and service.current:
+                    title = service.current.title
+                similar = await service.similar(title, 10) if title else []
+                if not similar:
+                    print('Nothing similar yet: songs become similar by being played in the same session.')
+                else:
+                    print(f"\n✨ Similar to {title}:")
+                    for i, (t, weight) in enumerate(similar, 1):
+                        print(f"{i}. {t} ({weight:.1f})")
+                    if (await ainput('Add them to the queue? (y/N): ')).strip().lower() == 'y':
+                        for t, _ in similar:
+                            await service.enqueue(t)
+                rule = (await ainput(f'When the queue runs dry, add songs like: Off, the current Track, '
+                                     f'the whole Session [o/t/s] (now {service.autofill}, blank = keep): ')).strip().lower()
+                rule = {'o': 'off', 't': 'track', 's': 'session'}.get(rule[:1])
+                if rule:
+                    service.set_autofill(rule)
+                    print(f'Autofill: {rule}')
+
+            elif choice == '23':
+                print('e.g. genre=synthwave AND year>=2020 AND plays>5, artist="Daft Punk" OR format=flac')
+                query = (await ainput('Filter: ')).strip()
+                try:
+                    result = await service.filter_songs(query, limit=50, facets=('genre', 'year', 'artist'), top=5)
+                except ValueError as e:
+                    print('Bad filter:', e)
+                    continue
+                if result['indexing']:
+                    print('(still indexing the library, results may be incomplete)')
+                print(f"{result['count']} songs")
+                for field, counts in result['facets'].items():
+                    if counts:
+                        print(f"  {field}: " + ', '.join(f'{value} ({n})' for value, n in counts))
+                for i, title in enumerate(result['titles'], 1):
+                    print(f"{i}. {title}")
+                if result['count'] > len(result['titles']):
+                    print(f"... and {result['count'] - len(result['titles'])} more")
+                if result['titles'] and (await ainput('Queue these? (y/N): ')).strip().lower() == 'y':
+                    for title in result['titles']:
+                        await service.enqueue(title)
+
+            elif choice == '24':
+                order = (await ainput('Sort by [t]itle, a[r]tist, a[l]bum, [d]uration, [p]lays, [n]ewest '
+                                      'or last pla[y]ed? (add - to reverse): ')).strip().lower()
+                reverse = order.endswith('-')
+                order = {'r': 'artist', 'l': 'album', 'd': 'duration', 'p': 'plays', 'n': 'added',
+                         'y': 'played'}.get(order.rstrip('-')[:1], 'title')
+                titles = await service.sorted_titles(order, reverse, limit=50)
+                print(f"\n📚 Library by {order}{' (reversed)' if reverse else ''}:")
+                for i, title in enumerate(titles, 1):
+                    print(f"{i}. {title}")
+                if not titles:
+                    print('Library is empty (or still being indexed).')
 
             elif choice == '15':
-                print('Saving state...')
-                save_play_counts(heap)
-                player.stop()
-                print('Bye!')
+                # the daemon keeps playing (and saving) after the client exits
+                print('Exiting client; the player daemon keeps running.' if remote else 'Saving state...')
                 break
 
             else:
                 print('Invalid option')
 
-    except KeyboardInterrupt:
+    except (KeyboardInterrupt, asyncio.CancelledError, EOFError):
         print('\nExiting...')
-        save_play_counts(heap)
-        player.stop()
+    finally:
+        await service.close()
+    print('Bye!')
 
 
 if __name__ == "__main__":
-    main()
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
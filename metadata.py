@@ -0,0 +1,109 @@
+# metadata.py
+# Per-file metadata cache (duration and tags read with mutagen, the format
+# probed from the file's first bytes).
+# Entries are keyed by path and validated against size/mtime, so a file is
+# only parsed again after it changed on disk. Stored in the metadata table of
+# library_db; a save writes the entries that changed.
+import os
+import threading
+from typing import Dict, Optional
+
+from library_db import LibraryDB, TrackedDict
+from decoder import probe_format
+
+TAG_FIELDS = ('artist', 'album', 'genre', 'date', 'tracknumber')
+
+
+def read_metadata(path: str) -> dict:
+    info = {'duration': 0, 'codec': probe_format(path)}
+    try:
+        from mutagen import File as MutagenFile
+        mf = MutagenFile(path, easy=True)
+        if mf is None:
+            return info
+        info['duration'] = int(getattr(mf.info, 'length', 0) or 0)
+        tags = mf.tags or {}
+        for field in TAG_FIELDS:
+            value = tags.get(field)
+            if value:
+                info[field] = str(value[0])
+    except Exception:
+        pass
+    return info
+
+
+class MetadataCache:
+    # Used from the loop, the executor, the play-request worker and transcode
+    # callbacks: the lock guards the dict, and cached entries are replaced,
+    # never changed in place, so save() can write them outside the lock.
+    def __init__(self, db: LibraryDB):
+        self.db = db
+        # path -> {'size', 'mtime', 'duration', tag fields...}
+        self.entries: Dict[str, dict] = TrackedDict()
+        self.dirty = False
+        self.lock = threading.RLock()
+
+    def load(self) -> None:
+        try:
+            entries = TrackedDict(self.db.load_metadata())
+            with self.lock:
+                self.entries = entries
+        except Exception as e:
+            print('Could not load metadata cache:', e)
+
+    def save(self) -> None:
+        with self.lock:
+            if not self.dirty or not self.db.writable:
+                return
+            self.dirty = False
+            paths = self.entries.take()
+            rows = {p: self.entries.get(p) for p in paths}
+        try:
+            with self.db.transaction() as cur:
+                self.db.save_metadata(cur, rows)
+        except Exception as e:
+            with self.lock:
+                self.entries.changed |= paths
+                self.dirty = True
+            print('Could not save metadata cache:', e)
+
+    def get(self, path: str) -> dict:
+        try:
+            st = os.stat(path)
+        except OSError:
+            return self.entries.get(path, {})
+        entry = self.entries.get(path)
+        if entry and entry.get('size') == st.st_size and entry.get('mtime') == st.st_mtime_ns:
+            return entry
+        entry = read_metadata(path)
+        entry['size'] = st.st_size
+        entry['mtime'] = st.st_mtime_ns
+        with self.lock:
+            self.entries[path] = entry
+            self.dirty = True
+        return entry
+
+    def update(self, path: str, **fields) -> None:
+        # adds results (content hash, loudness) to a cached entry, as a new dict
+        entry = self.get(path)
+        with self.lock:
+            self.entries[path] = {**self.entries.get(path, entry), **fields}
+            self.dirty = True
+
+    def peek(self, path: str) -> Optional[dict]:
+        # cached entry without touching the disk
+        return self.entries.get(path)
+
+    def duration(self, path: str) -> int:
+        return int(self.get(path).get('duration', 0))
+
+    def invalidate(self, path: str) -> None:
+        with self.lock:
+            if self.entries.pop(path, None) is not None:
+                self.dirty = True
+
+    def remove_prefix(self, prefix: str) -> None:
+        with self.lock:
+            for path in [p for p in self.entries if p.startswith(prefix)]:
+                del self.entries[path]
+                self.dirty = True
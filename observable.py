@@ -0,0 +1,25 @@
+# observable.py
+# Fine-grained change notifications for the list-like data structures.
+# Listeners are called as fn(op, index, value) with op one of:
+#   'insert'  value now sits at index
+#   'remove'  the item at index was removed
+#   'move'    index is (src, dst): item removed at src, then inserted at dst
+#   'update'  the item at index changed in place to value
+#   'reset'   everything changed; re-read the structure
+from typing import Callable, List
+
+
+class Observable:
+    def __init__(self):
+        self.listeners: List[Callable] = []
+
+    def subscribe(self, fn: Callable) -> None:
+        self.listeners.append(fn)
+
+    def unsubscribe(self, fn: Callable) -> None:
+        if fn in self.listeners:
+            self.listeners.remove(fn)
+
+    def _notify(self, op: str, index=None, value=None) -> None:
+        for fn in self.listeners:
+            fn(op, index, value)
@@ -1,47 +1,145 @@
 
-# --- pygame-based MusicPlayer backend ---
+# --- MusicPlayer on top of a pluggable audio backend (pygame by default) ---
 import os
-import pygame
 import threading
 import time
+import instrument
+from instrument import timed
+from audio_backend import AudioBackend, make_backend
+from loudness import ABSOLUTE_GATE
+
+# Normalized tracks play this far below full scale, so that quiet ones can
+# be raised by their (positive) gain instead of hitting the 1.0 volume cap
+HEADROOM_DB = -6.0
 
 class MusicPlayer:
-    def __init__(self):
-        pygame.mixer.init()
+    def __init__(self, gain_source=None, backend: AudioBackend | None = None):
+        self.backend = backend or make_backend()
+        # how often the worker checks whether the track has ended
+        self.poll_interval = 0.1
         self.play_thread = None
         self.stop_event = threading.Event()
+        # held while seek() reloads the stream so the worker doesn't mistake
+        # the brief idle mixer for the end of the track
+        self.lock = threading.Lock()
         self.paused = False
         self.current_path: str | None = None
+        # Per-track normalization: gain_source.peek(path) returns a metadata
+        # entry with 'gain' (dB) and 'peak' from loudness analysis
+        self.gain_source = gain_source
+        self.normalize = True
+        self.volume = 1.0
+        self.track_gain = 1.0
+        # Position = anchor_pos + time since anchor_time (monotonic clock),
+        # re-anchored on play/seek/resume; anchor_time is None while stopped
+        # or paused, so reading the position never touches the mixer
+        self.anchor_pos = 0.0
+        self.anchor_time: float | None = None
+        # Crossfade/gapless joins need a backend that mixes tracks itself
+        # (StreamBackend); it reports each join here from the audio thread,
+        # and on_track_change(path) is passed the news
+        self.on_track_change = None
+        # resolve(path, wait) -> the file the backend should load for path
+        # (e.g. a transcoded copy), or None if wait is False and it is not
+        # ready; current_path and callbacks always use the library path
+        self.resolve = None
+        self.sources = {}   # loaded file -> library path, where they differ
+        if self.supports_crossfade():
+            self.backend.on_track_change = self._track_changed
+
+    def _track_gain(self, path: str) -> float:
+        entry = self.gain_source.peek(path) if self.gain_source and self.normalize else None
+        if not entry or 'gain' not in entry:
+            return 1.0
+        db = entry['gain']
+        if entry.get('loudness', 0.0) <= ABSOLUTE_GATE:
+            db = 0.0  # measured at the gate: silence, not a quiet master
+        gain = 10 ** ((db + HEADROOM_DB) / 20)
+        peak = entry.get('peak') or 0
+        # never boost a track past clipping
+        if peak > 0:
+            gain = min(gain, 1.0 / peak)
+        return gain
+
+    def _source(self, path: str, wait: bool = True) -> str | None:
+        if not self.resolve:
+            return path
+        source = self.resolve(path, wait)
+        if source and source != path:
+            self.sources[source] = path
+        return source
+
+    def _apply_volume(self) -> None:
+        try:
+            self.backend.set_volume(max(0.0, min(1.0, self.volume * self.track_gain)))
+        except Exception:
+            pass
 
     def _play_worker(self, path: str, start: float = 0.0):
         try:
-            pygame.mixer.music.load(path)
-            pygame.mixer.music.play(start=start)
-            while not self.stop_event.is_set() and pygame.mixer.music.get_busy():
-                time.sleep(0.1)
+            self.backend.load(self._source(path))
+            # loading new music resets the mixer volume
+            self._apply_volume()
+            self.backend.play(start=start)
+            self.anchor_time = time.monotonic()
+            instrument.finish('player.time_to_first_audio')
+            while not self.stop_event.is_set():
+                # get_busy() is False while paused in pygame 2
+                with self.lock:
+                    if not (self.paused or self.backend.get_busy()):
+                        break
+                time.sleep(self.poll_interval)
         except Exception as e:
             print("Playback error:", e)
         finally:
             try:
-                pygame.mixer.music.stop()
+                self.backend.stop()
             except Exception:
                 pass
 
+    @timed('player.play')
     def play(self, path: str, start: float = 0.0) -> None:
         if not os.path.exists(path):
             print("File not found:", path)
             return
         self.stop()
+        self.queue_next(None)
         self.stop_event.clear()
         self.paused = False
         self.current_path = path
+        self.track_gain = self._track_gain(path)
+        self.anchor_pos = start
+        self.anchor_time = None
+        instrument.start('player.time_to_first_audio')
         self.play_thread = threading.Thread(target=self._play_worker, args=(path, start), daemon=True)
         self.play_thread.start()
 
+    @timed('player.seek')
+    def seek(self, position: float) -> None:
+        if not self.current_path:
+            return
+        try:
+            with self.lock:
+                self.backend.stop()
+                self.backend.load(self._source(self.current_path))
+                self._apply_volume()
+                self.backend.play(start=float(position))
+                self.anchor_pos = float(position)
+                self.anchor_time = None if self.paused else time.monotonic()
+                if self.paused:
+                    self.backend.pause()
+        except Exception as e:
+            print("Seek error:", e)
+
+    def position(self) -> float:
+        if self.anchor_time is None:
+            return self.anchor_pos
+        return self.anchor_pos + (time.monotonic() - self.anchor_time)
+
     def stop(self) -> None:
         self.stop_event.set()
         try:
-            pygame.mixer.music.stop()
+            self.backend.stop()
         except Exception:
             pass
         if self.play_thread and self.play_thread.is_alive():
@@ -49,32 +147,166 @@ class MusicPlayer:
         self.play_thread = None
         self.stop_event.clear()
         self.paused = False
+        self.anchor_pos = 0.0
+        self.anchor_time = None
 
     def pause(self) -> None:
         try:
-            pygame.mixer.music.pause()
+            self.backend.pause()
         except Exception:
             pass
+        if not self.paused:
+            self.anchor_pos = self.position()
+            self.anchor_time = None
         self.paused = True
 
     def resume(self) -> None:
         try:
-            pygame.mixer.music.unpause()
+            self.backend.unpause()
         except Exception:
             pass
+        if self.paused and self.current_path:
+            self.anchor_time = time.monotonic()
         self.paused = False
 
     def is_playing(self) -> bool:
         try:
-            return pygame.mixer.music.get_busy()
+            return self.backend.get_busy()
         except Exception:
             return False
 
     def is_paused(self) -> bool:
         return self.paused
 
+    def finished(self) -> bool:
+        # the play worker ran to the end of the track (rather than being stopped);
+        # unlike is_playing() this stays False while a track is still loading
+        return self.play_thread is not None and not self.play_thread.is_alive()
+
     def set_volume(self, vol: float) -> None:
-        try:
-            pygame.mixer.music.set_volume(max(0.0, min(1.0, vol)))
-        except Exception:
-            pass
\ No newline at end of file
+        self.volume = max(0.0, min(1.0, vol))
+        self._apply_volume()
+    # ----------------- Crossfade -----------------
+    def supports_crossfade(self) -> bool:
+        return hasattr(self.backend, 'crossfade_to')
+
+    def set_crossfade(self, seconds: float) -> None:
+        if self.supports_crossfade():
+            self.backend.set_crossfade(seconds)
+
+    def queue_next(self, path: str | None) -> None:
+        """Tells the backend what follows the current track so it can join it
+        without a gap (or crossfade into it). No-op on other backends."""
+        if self.supports_crossfade():
+            # a song still being transcoded is left to auto-advance
+            self.backend.queue_next(self._source(path, wait=False) if path else None)
+
+    def next_queued(self) -> bool:
+        # True while a queued track is still to come, including one already
+        # joined into the buffer that the listener hasn't reached yet
+        if not self.supports_crossfade() or not self.is_playing():
+            return False
+        return bool(self.backend.next_path or self.backend.markers)
+
+    def skip_to(self, path: str) -> None:
+        # crossfades from the current position when possible, else plays normally
+        if self.supports_crossfade() and not self.paused and os.path.exists(path):
+            with self.lock:
+                if self.backend.crossfade_to(self._source(path)):
+                    self.current_path = path
+                    self.track_gain = self._track_gain(path)
+                    self._apply_volume()
+                    self.anchor_pos = 0.0
+                    self.anchor_time = time.monotonic()
+                    return
+        self.play(path)
+
+    def _track_changed(self, path: str) -> None:
+        path = self.sources.get(path, path)
+        if path != self.current_path:
+            self.current_path = path
+            self.track_gain = self._track_gain(path)
+            self._apply_volume()
+            self.anchor_pos = 0.0
+            self.anchor_time = time.monotonic()
+        if self.on_track_change:
+            self.on_track_change(path)
+
+
+class PlayRequests:
+    """Starts playback on a background thread, honouring only the latest request.
+
+    request() returns at once. A request that is superseded before the
+    worker gets to it is dropped without touching the disk, and one
+    superseded during prepare() is dropped before the audio is switched, so
+    skipping through ten tracks costs at most one stop/start of the player.
+    prepare(path) runs on the worker first (e.g. a metadata lookup) and its
+    result is passed to on_ready(path, result) once audio was started.
+    """
+
+    def __init__(self, player: MusicPlayer, prepare=None, on_ready=None):
+        self.player = player
+        self.prepare = prepare
+        self.on_ready = on_ready
+        self.lock = threading.Condition()
+        self.pending = None
+        self.generation = 0
+        self.thread: threading.Thread | None = None
+        self.stopped = False
+        self.active = False
+
+    def request(self, path: str, start: float = 0.0, fade: bool = False) -> None:
+        with self.lock:
+            self.generation += 1
+            self.pending = (path, start, fade)
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._run, daemon=True)
+                self.thread.start()
+            self.lock.notify()
+
+    def busy(self) -> bool:
+        # a request is waiting or being carried out
+        with self.lock:
+            return self.pending is not None or self.active
+
+    def cancel(self) -> None:
+        with self.lock:
+            self.generation += 1
+            self.pending = None
+
+    def stop(self) -> None:
+        with self.lock:
+            self.stopped = True
+            self.pending = None
+            self.lock.notify()
+
+    def _run(self) -> None:
+        while True:
+            with self.lock:
+                while self.pending is None and not self.stopped:
+                    self.active = False
+                    self.lock.wait()
+                if self.stopped:
+                    self.active = False
+                    return
+                (path, start, fade), gen = self.pending, self.generation
+                self.pending = None
+                self.active = True
+            try:
+                result = self.prepare(path) if self.prepare else None
+                if gen != self.generation:
+                    continue
+                if fade:
+                    self.player.skip_to(path)
+                else:
+                    self.player.play(path, start)
+                with self.lock:
+                    latest = gen == self.generation
+                    # cancelled (not superseded) while starting: don't leave it playing
+                    dropped = not latest and self.pending is None
+                if dropped:
+                    self.player.pause()
+                elif latest and self.on_ready:
+                    self.on_ready(path, result)
+            except Exception as e:
+                print("Play request failed:", e)
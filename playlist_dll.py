@@ -1,7 +1,11 @@
 # playlist_dll.py
 # Doubly Linked List implementation for the playlist
 import os
-from typing import Optional, List, Tuple
+from typing import Optional, List, Tuple, Iterator
+from instrument import timed
+from decoder import FORMATS
+
+AUDIO_EXTS = tuple(FORMATS)
 
 class Node:
     def __init__(self, title: str, path: str):
@@ -45,6 +49,21 @@ class Playlist:
             cur = cur.next
         return False
 
+    def remove_node(self, node: Node) -> None:
+        # O(1) unlink when the caller already holds the node
+        if node.prev:
+            node.prev.next = node.next
+        elif self.head is node:
+            self.head = node.next
+        else:
+            return
+        if node.next:
+            node.next.prev = node.prev
+        else:
+            self.tail = node.prev
+        node.prev = node.next = None
+        self.size -= 1
+
     def find_node_by_title(self, title: str) -> Optional[Node]:
         cur = self.head
         while cur:
@@ -53,6 +72,12 @@ class Playlist:
             cur = cur.next
         return None
 
+    def iter_nodes(self) -> Iterator[Node]:
+        cur = self.head
+        while cur:
+            yield cur
+            cur = cur.next
+
     def to_list(self) -> List[Tuple[str, str]]:
         res = []
         cur = self.head
@@ -82,12 +107,13 @@ class Playlist:
         for title, path in songs:
             self.insert_song_end(title, path)
 
+    @timed('playlist.load_from_folder')
     def load_from_folder(self, folder: str, limit: int = 50) -> None:
-        # scans for mp3 files and inserts them
+        # scans for audio files (any format in decoder.FORMATS) and inserts them
         if not os.path.exists(folder):
             os.makedirs(folder)
             return
-        files = [f for f in os.listdir(folder) if f.lower().endswith('.mp3')]
+        files = [f for f in os.listdir(folder) if f.lower().endswith(AUDIO_EXTS)]
         files = files[:limit]
         for f in files:
             title = os.path.splitext(f)[0]
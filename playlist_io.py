@@ -0,0 +1,217 @@
+# playlist_io.py
+# Streaming M3U/M3U8/PLS import and export.
+# Playlists are parsed line by line with generators and resolved against the
+# library (SongMap path index) in batches, so huge files never sit in memory
+# and no audio is ever copied.
+import os
+from itertools import islice
+from typing import Iterable, Iterator, List, Optional, Tuple
+from urllib.parse import unquote, urlparse
+
+from library_index import title_from_path
+
+BATCH_SIZE = 1000
+PLAYLIST_EXTS = ('.m3u', '.m3u8', '.pls')
+
+
+class PlaylistEntry:
+    __slots__ = ('location', 'title')
+
+    def __init__(self, location: str, title: Optional[str] = None):
+        self.location = location
+        self.title = title
+
+
+def _open_text(path: str):
+    # M3U8 is UTF-8 by definition; plain M3U/PLS are usually UTF-8 too, and
+    # surrogateescape keeps undecodable bytes round-trippable as paths
+    return open(path, 'r', encoding='utf-8-sig', errors='surrogateescape')
+
+
+def iter_m3u(path: str) -> Iterator[PlaylistEntry]:
+    title = None
+    with _open_text(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith('#'):
+                if line.startswith('#EXTINF:'):
+                    # #EXTINF:<seconds>,<title>
+                    _, _, title = line.partition(',')
+                    title = title.strip() or None
+                continue
+            yield PlaylistEntry(line, title)
+            title = None
+
+
+def iter_pls(path: str) -> Iterator[PlaylistEntry]:
+    # FileN/TitleN keys normally arrive grouped by N, so only the entry being
+    # built is kept in memory
+    cur_num = None
+    cur = {}
+    with _open_text(path) as f:
+        for line in f:
+            key, sep, value = line.strip().partition('=')
+            if not sep:
+                continue
+            key = key.strip().lower()
+            for field in ('file', 'title'):
+                if key.startswith(field) and key[len(field):].isdigit():
+                    num = int(key[len(field):])
+                    if num != cur_num:
+                        if cur.get('file'):
+                            yield PlaylistEntry(cur['file'], cur.get('title'))
+                        cur_num, cur = num, {}
+                    cur[field] = value.strip()
+                    break
+    if cur.get('file'):
+        yield PlaylistEntry(cur['file'], cur.get('title'))
+
+
+def iter_playlist(path: str) -> Iterator[PlaylistEntry]:
+    ext = os.path.splitext(path)[1].lower()
+    if ext == '.pls':
+        return iter_pls(path)
+    if ext in ('.m3u', '.m3u8'):
+        return iter_m3u(path)
+    raise ValueError(f'Unsupported playlist format: {ext or path}')
+
+
+def to_local_path(location: str, base_dir: str) -> Optional[str]:
+    # Returns a filesystem path for the entry, or None for remote streams
+    if '://' in location:
+        parsed = urlparse(location)
+        if parsed.scheme != 'file':
+            return None
+        location = unquote(parsed.path)
+        if os.name == 'nt' and location.startswith('/') and location[2:3] == ':':
+            location = location[1:]
+    location = os.path.expanduser(location)
+    if not os.path.isabs(location):
+        location = os.path.join(base_dir, location)
+    return location
+
+
+class PlaylistImporter:
+    """Resolves a playlist file against the library in fixed-size batches.
+
+    Entries already in the library are matched through the SongMap path
+    index (falling back to the file-name title). With add_missing, files that
+    exist on disk but are not in the library are appended to the playlist by
+    reference. Counters are updated as batches are consumed.
+    """
+
+    def __init__(self, path: str, playlist, song_map, add_missing: bool = True,
+                 batch_size: int = BATCH_SIZE):
+        self.path = path
+        self.playlist = playlist
+        self.song_map = song_map
+        self.add_missing = add_missing
+        self.batch_size = batch_size
+        self.base_dir = os.path.dirname(os.path.abspath(path))
+        self.matched = 0
+        self.added = 0
+        self.missing = 0
+
+    def _lookup(self, entry: PlaylistEntry):
+        # read-only, so it can run off the loop: a library node, a file to add, or None
+        path = to_local_path(entry.location, self.base_dir)
+        if path is None:
+            return None
+        node = self.song_map.search_path(path) or self.song_map.search_song(title_from_path(path))
+        if node is not None:
+            return node
+        if self.add_missing and os.path.isfile(path):
+            return path
+        return None
+
+    def resolve(self, batch: List[PlaylistEntry]) -> list:
+        """Looks up one batch of entries, checking files on disk."""
+        return [self._lookup(entry) for entry in batch]
+
+    def place(self, found: list) -> Tuple[List, List]:
+        """Turns resolve() results into nodes, adding new files to the
+        playlist and SongMap. Returns (nodes in playlist order, added nodes)."""
+        nodes, added = [], []
+        for item in found:
+            if item is None:
+                self.missing += 1
+                continue
+            if isinstance(item, str):
+                # an earlier entry may have added the same file already
+                node = self.song_map.search_path(item) or self.song_map.search_song(title_from_path(item))
+                if node is None:
+                    node = self.playlist.insert_song_end(title_from_path(item), item)
+                    self.song_map.insert_to_hash(node.title, node)
+                    added.append(node)
+                    self.added += 1
+                    nodes.append(node)
+                    continue
+                item = node
+            self.matched += 1
+            nodes.append(item)
+        return nodes, added
+
+    def entry_batches(self) -> Iterator[List[PlaylistEntry]]:
+        entries = iter_playlist(self.path)
+        while True:
+            batch = list(islice(entries, self.batch_size))
+            if not batch:
+                return
+            yield batch
+
+    def batches(self) -> Iterator[List]:
+        for batch in self.entry_batches():
+            yield self.place(self.resolve(batch))[0]
+
+    def __iter__(self):
+        for nodes in self.batches():
+            yield from nodes
+
+
+# ----------------- Export -----------------
+def _entry_path(node, dest_dir: Optional[str]) -> str:
+    path = os.path.abspath(node.path)
+    if dest_dir:
+        try:
+            return os.path.relpath(path, dest_dir)
+        except ValueError:
+            # different drive on Windows
+            pass
+    return path
+
+
+def export_m3u(nodes: Iterable, dest: str, relative: bool = False) -> int:
+    dest_dir = os.path.dirname(os.path.abspath(dest)) if relative else None
+    count = 0
+    with open(dest, 'w', encoding='utf-8', errors='surrogateescape', newline='\n') as f:
+        f.write('#EXTM3U\n')
+        for node in nodes:
+            f.write(f'#EXTINF:-1,{node.title}\n{_entry_path(node, dest_dir)}\n')
+            count += 1
+    return count
+
+
+def export_pls(nodes: Iterable, dest: str, relative: bool = False) -> int:
+    dest_dir = os.path.dirname(os.path.abspath(dest)) if relative else None
+    count = 0
+    with open(dest, 'w', encoding='utf-8', errors='surrogateescape', newline='\n') as f:
+        f.write('[playlist]\n')
+        for node in nodes:
+            count += 1
+            f.write(f'File{count}={_entry_path(node, dest_dir)}\n'
+                    f'Title{count}={node.title}\n'
+                    f'Length{count}=-1\n')
+        # PLS allows the entry count after the entries, which keeps export streaming
+        f.write(f'NumberOfEntries={count}\nVersion=2\n')
+    return count
+
+
+def export_playlist(nodes: Iterable, dest: str, relative: bool = False) -> int:
+    ext = os.path.splitext(dest)[1].lower()
+    if ext == '.pls':
+        return export_pls(nodes, dest, relative)
+    if ext in ('.m3u', '.m3u8'):
+        return export_m3u(nodes, dest, relative)
+    raise ValueError(f'Unsupported playlist format: {ext or dest}')
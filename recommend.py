@@ -0,0 +1,104 @@
+# recommend.py
+# "Play similar": songs that are listened to together. The play log is cut
+# into sessions (a gap of SESSION_GAP ends one), and within a session every
+# play is paired with the WINDOW plays before it, weighted 1/distance. The
+# weights form a sparse symmetric song x song matrix kept as a dict of dicts,
+# updated play by play. Each song's NEIGHBORS heaviest partners are kept in a
+# small sorted list, so a lookup is a dict access: weights only grow, so a
+# partner that drops out can only come back through a bump of its own pair,
+# which re-checks it.
+import heapq
+from collections import deque
+from typing import Dict, Iterable, List, Optional, Tuple
+
+SESSION_GAP = 30 * 60
+WINDOW = 5
+NEIGHBORS = 20
+AUTOFILL_RULES = ('off', 'track', 'session')
+
+
+class CoOccurrence:
+    def __init__(self, neighbors: int = NEIGHBORS, window: int = WINDOW, gap: float = SESSION_GAP):
+        self.k = neighbors
+        self.gap = gap
+        self.weights: Dict[str, Dict[str, float]] = {}
+        self.neighbors: Dict[str, List[list]] = {}   # title -> [[weight, title]], heaviest first
+        self.session = deque(maxlen=window)          # (title, time) of the latest plays
+        self.dirty = set()                           # (a, b) pairs with a < b, changed since the last save
+
+    def add(self, title: str, ts: float, rank: bool = True) -> None:
+        if self.session and ts - self.session[-1][1] > self.gap:
+            self.session.clear()
+        seen = {title}
+        for dist, (other, _) in enumerate(reversed(self.session), 1):
+            if other not in seen:
+                seen.add(other)
+                self._bump(title, other, 1.0 / dist, rank)
+        self.session.append((title, ts))
+
+    def add_plays(self, plays: Iterable[tuple]) -> None:
+        # a whole play log at once: the neighbor lists are ranked at the end
+        for title, ts in plays:
+            self.add(title, ts, rank=False)
+        self._rank_all()
+
+    def _bump(self, a: str, b: str, w: float, rank: bool) -> None:
+        row = self.weights.setdefault(a, {})
+        weight = row[b] = row.get(b, 0.0) + w
+        self.weights.setdefault(b, {})[a] = weight
+        if rank:
+            self._rank(a, b, weight)
+            self._rank(b, a, weight)
+        self.dirty.add((a, b) if a < b else (b, a))
+
+    def _rank(self, a: str, b: str, weight: float) -> None:
+        # O(k): the lists are short
+        top = self.neighbors.setdefault(a, [])
+        for entry in top:
+            if entry[1] == b:
+                entry[0] = weight
+                break
+        else:
+            if len(top) >= self.k:
+                if weight <= top[-1][0]:
+                    return
+                top.pop()
+            top.append([weight, b])
+        top.sort(key=lambda e: (-e[0], e[1]))
+
+    def _rank_all(self) -> None:
+        for a, row in self.weights.items():
+            top = heapq.nsmallest(self.k, row.items(), key=lambda e: (-e[1], e[0]))
+            self.neighbors[a] = [[w, t] for t, w in top]
+
+    def similar(self, title: str, n: int = 10) -> List[Tuple[str, float]]:
+        return [(t, w) for w, t in self.neighbors.get(title, [])[:n]]
+
+    def recommend(self, seeds: Iterable[str], n: int = 10, exclude=()) -> List[str]:
+        """Songs close to all of seeds (most recent first): neighbor weights
+        summed, later seeds counting less."""
+        score: Dict[str, float] = {}
+        seeds = list(seeds)
+        for rank, seed in enumerate(seeds):
+            for w, t in self.neighbors.get(seed, []):
+                score[t] = score.get(t, 0.0) + w / (rank + 1)
+        skip = set(exclude) | set(seeds)
+        best = sorted((t for t in score if t not in skip), key=lambda t: (-score[t], t))
+        return best[:n]
+
+    # ----------------- Persistence -----------------
+    def snapshot(self) -> list:
+        rows = [(a, b, self.weights[a][b]) for a, b in self.dirty]
+        self.dirty = set()
+        return rows
+
+    def load_rows(self, rows: Iterable[tuple], recent: Iterable[tuple] = ()) -> None:
+        # rows: (a, b, weight) pairs; recent: (title, time) of the last plays
+        for a, b, weight in rows:
+            self.weights.setdefault(a, {})[b] = weight
+            self.weights.setdefault(b, {})[a] = weight
+        self._rank_all()
+        for title, ts in recent:
+            if self.session and ts - self.session[-1][1] > self.gap:
+                self.session.clear()
+            self.session.append((title, ts))
@@ -0,0 +1,1126 @@
+# service.py
+# asyncio command core shared by the CLI and the GUI.
+# MusicService owns the library structures, the upcoming queue, the play
+# statistics and the player, and exposes them as async commands. Everything
+# runs on one event loop: blocking work (scanning, decoding, saving) goes to
+# a small shared executor, and background jobs (auto-advance, autosave,
+# library watching, next-track prefetch) are tasks on the same loop.
+# Front ends subscribe to events instead of re-implementing the logic:
+#   'track'    {'node', 'position', 'duration'}
+#              a track became current (before its audio starts)
+#   'ready'    {'node', 'duration'}  its audio is playing
+#   'state'    {'state'}             'playing' | 'paused' | 'stopped'
+#   'library'  {'added', 'removed', 'reason'}
+#              the library changed: 'watch' (on disk), 'add', 'delete', 'shuffle'
+#   'message'  {'text'}              something worth telling the user
+# State lives in data/library.db (library_db.py); the structures above are
+# hydrated from it by load_state()/load_library() and written back in
+# batched transactions by the autosave. data/snapshot.bin (snapshot.py)
+# holds them ready-built for the next start.
+import os
+import time
+import marshal
+import asyncio
+import functools
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional, Tuple
+
+from playlist_dll import Playlist
+from hashmap import SongMap, normalize_path
+from stack_queue import RecentlyPlayed, UpcomingSongs
+from heap_bst import SongHeap
+from bst import BST, Node as BSTNode
+from player import MusicPlayer, PlayRequests
+from playlist_io import PlaylistImporter, export_playlist
+from library_index import (LibraryIndex, copy_in_background, folder_changes, title_from_path,
+                           iter_audio_files, is_audio_file)
+from watcher import LibraryWatcher
+from metadata import MetadataCache
+from library_db import LibraryDB, TrackedDict
+from listening_stats import ListeningStats, WINDOWS
+from recommend import CoOccurrence, AUTOFILL_RULES, WINDOW
+from facets import FacetIndex, FIELDS
+from sorting import SortIndex, ORDERS
+from transcode import TranscodeCache
+from decoder import probe_format
+import snapshot
+import instrument
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DATA_DIR = os.path.join(BASE_DIR, 'data')
+SONG_DIR = os.path.join(BASE_DIR, 'songs')
+AUTOSAVE_SECONDS = 5.0
+SNAPSHOT_SECONDS = 600.0  # library snapshot at most this often (and on shutdown)
+AUTOFILL_COUNT = 5      # songs added when the queue runs dry
+AUTOFILL_SKIP = 50      # recently played songs that are not suggested again
+
+
+class MusicService:
+    def __init__(self, history_size: int = 500, player: Optional[MusicPlayer] = None,
+                 data_dir: str = DATA_DIR, song_dir: str = SONG_DIR):
+        self.data_dir = data_dir
+        self.song_dir = song_dir
+        self.fingerprint_dir = os.path.join(data_dir, 'fingerprints')
+
+        self.playlist = Playlist()
+        self.song_map = SongMap()
+        self.history = RecentlyPlayed(max_size=history_size)
+        self.upcoming = UpcomingSongs()
+        self.heap = SongHeap()
+        self.stats = ListeningStats()  # plays per hour/day/month, for windowed top lists
+        self.co_plays = CoOccurrence()  # songs heard together, for "play similar"
+        self.facets = FacetIndex()      # bitmaps per artist/album/genre/year/format/plays
+        self.sorts = SortIndex()        # cached sort orders (title, artist, plays, ...)
+        self.index_pending: Optional[list] = None  # facet/sort updates that arrive while they are rebuilt
+        self.index_lock = asyncio.Lock()
+        self.indexes_built = False      # facets/sorts cover the library (built or restored)
+        self.last_played = {}           # title -> time of its latest play
+        self.bst = BST()
+        self.db = LibraryDB(os.path.join(data_dir, 'library.db'))
+        self.library = LibraryIndex(self.db)
+        self.metadata = MetadataCache(self.db)
+        # copies of songs the audio backend cannot decode
+        self.transcoder = TranscodeCache(os.path.join(data_dir, 'transcoded'), self.metadata)
+        self.player = player or MusicPlayer(gain_source=self.metadata)
+        self.player.on_track_change = self._engine_track_change
+        self.player.resolve = self._playable
+        self.requests = PlayRequests(self.player, prepare=self.metadata.duration,
+                                     on_ready=self._audio_ready)
+
+        self.current = None          # playlist node shown as playing
+        self.duration = 0
+        self.state = 'stopped'
+        self.autoplay_queue = True   # auto-advance takes the queue head first
+        self.autofill = 'session'    # refill a drained queue: off, track or session (see recommend.py)
+        self.listeners: List[Callable] = []
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='music-service')
+        self.tasks = set()
+        self.stats_dirty = False
+        self.pending_plays = []      # (title, path, time) not yet in the play log
+        self.queue_dirty = False
+        self.history_cleared = False
+        self.snapshot_path = os.path.join(data_dir, 'snapshot.bin')
+        self.warm: Optional[dict] = None    # snapshot state between load_state() and load_library()
+        self.snapshot_dirty = True   # structures changed since the last snapshot
+        self.snapshot_gens = None    # database generations it was taken at
+        self.snapshot_time = time.monotonic()
+        # a snapshot must be what a cold start would build: the index
+        # generation the library was loaded from, and whether it changed since
+        self.library_gen = None
+        self.library_diverged = False
+        self.owner_lock = None
+        self.read_only = False       # another process owns data_dir
+        self.watcher: Optional[LibraryWatcher] = None
+        self.wake = asyncio.Event()  # pokes the auto-advance task
+        # the engine's idea of the next track follows the queue
+        self.upcoming.subscribe(self._on_queue_change)
+
+    # ----------------- Events & Scheduling -----------------
+    def subscribe(self, fn: Callable[[str, dict], None]) -> None:
+        self.listeners.append(fn)
+
+    def _emit(self, event: str, **data) -> None:
+        for fn in self.listeners:
+            try:
+                fn(event, data)
+            except Exception as e:
+                print(f'Listener failed on {event}:', e)
+
+    def spawn(self, coro, name: Optional[str] = None) -> asyncio.Task:
+        """Runs coro as a background task on the service loop; failures are
+        reported instead of vanishing with the task. Usable before start()
+        from the thread that will run the loop."""
+        task = (self.loop or asyncio.get_event_loop()).create_task(coro, name=name)
+        self.tasks.add(task)
+
+        def done(t):
+            self.tasks.discard(t)
+            if not t.cancelled() and t.exception():
+                print(f'{t.get_name()} failed:', t.exception())
+        task.add_done_callback(done)
+        return task
+
+    async def run_blocking(self, fn, *args, **kwargs):
+        return await self.loop.run_in_executor(self.executor, functools.partial(fn, *args, **kwargs))
+
+    def _threadsafe(self, fn, *args) -> None:
+        # callbacks from player/watcher threads hop onto the loop
+        if self.loop and not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(fn, *args)
+
+    # ----------------- Lifecycle -----------------
+    def claim_data_dir(self) -> bool:
+        """Takes the data directory's owner lock. Two owners would interleave
+        their writes to the state files, so a second one runs read-only."""
+        try:
+            import fcntl
+        except ImportError:
+            return True  # no advisory locks on this platform
+        f = open(os.path.join(self.data_dir, 'owner.lock'), 'a')
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            f.close()
+            self.read_only = True
+            return False
+        self.owner_lock = f
+        return True
+
+    def open_db(self) -> bool:
+        self.db.read_only = self.read_only
+        if self.read_only and not os.path.exists(self.db.path):
+            return False
+        try:
+            self.db.open()
+            if self.db.migrate(self.data_dir):
+                print('Imported the JSON library state into library.db.')
+            return True
+        except Exception as e:
+            print('Could not open the library database:', e)
+            return False
+
+    def load_state(self) -> None:
+        os.makedirs(self.data_dir, exist_ok=True)
+        os.makedirs(self.song_dir, exist_ok=True)
+        if not self.read_only and not self.claim_data_dir():
+            print('Another Music Manager process owns data/; changes will not be saved.')
+        with instrument.phase('startup.load_state'):
+            if not self.open_db():
+                return
+            self.library_gen = self.db.generations()[0]
+            self.warm = self._read_snapshot()
+            try:
+                if self.warm:
+                    self._restore_plays(self.warm)
+                else:
+                    self.heap.counter.update(self.db.load_counts())
+                    self.heap._rebuild_heap()
+                    self.last_played = self.db.last_played()
+            except Exception as e:
+                print('Could not load play counts:', e)
+            try:
+                self._load_stats()
+            except Exception as e:
+                print('Could not load listening stats:', e)
+            try:
+                self._load_co_plays()
+            except Exception as e:
+                print('Could not load song recommendations:', e)
+            rule = self.db.get_meta('autofill')
+            if rule in AUTOFILL_RULES:
+                self.autofill = rule
+            try:
+                self.history.stack = self.db.load_history(self.history.max_size)
+                self.history._notify('reset')
+            except Exception as e:
+                print('Could not load recently played history:', e)
+            try:
+                for title in self.db.load_queue():
+                    self.upcoming.enqueue(title)
+                self.queue_dirty = False
+            except Exception as e:
+                print('Could not load the upcoming queue:', e)
+            if self.warm:
+                self.metadata.entries = TrackedDict(self.warm['metadata'])
+            else:
+                self.metadata.load()
+
+    def load_library(self) -> None:
+        if self.warm:
+            try:
+                with instrument.phase('startup.snapshot'):
+                    self._restore_library(self.warm)
+                return
+            except Exception as e:
+                print('Could not restore the library snapshot:', e)
+                self.playlist.__init__()
+                self.song_map.__init__()
+                self.bst.root = None
+                self.indexes_built = False
+                self.snapshot_dirty = True
+            finally:
+                self.warm = None
+        with instrument.phase('startup.scan_songs'):
+            self.playlist.load_from_folder(self.song_dir)
+            self.song_map.rebuild_from_playlist(self.playlist)
+        with instrument.phase('startup.library_index'):
+            self.library.load()
+            self.library.populate(self.playlist, self.song_map)
+            self.library.save()
+        for node in self.playlist.iter_nodes():
+            self.bst.insert(node.title)
+
+    async def start(self, load: bool = True) -> None:
+        """Attaches to the running loop, loads state (unless the caller already
+        did) and starts the background tasks."""
+        self.loop = asyncio.get_running_loop()
+        if load:
+            await self.run_blocking(self.load_state)
+            await self.run_blocking(self.load_library)
+        self.watcher = LibraryWatcher([self.song_dir] + self.library.folders,
+                                      lambda events: self._threadsafe(self.apply_library_events, events))
+        self.watcher.start()
+        self.spawn(self._advance_loop(), name='auto-advance')
+        self.spawn(self._autosave_loop(), name='autosave')
+        self.spawn(self.build_indexes(), name='indexes')
+
+    def _load_stats(self) -> None:
+        self.stats.load_rows(self.db.load_stat_rows())
+        self.stats.prune()
+        if self.db.get_meta('stats_built') or not self.db.writable:
+            self.stats.dirty.clear()
+            return
+        # first run with windowed stats: build them from the play log
+        for title, played_at in self.db.timed_plays():
+            self.stats.add(title, played_at)
+        self.stats.prune()
+        with self.db.transaction() as cur:
+            self.db.save_stat_buckets(cur, self.stats.snapshot(), self.stats.pruned)
+            self.db.set_meta(cur, 'stats_built', 1)
+
+    def _load_co_plays(self) -> None:
+        self.co_plays.load_rows(self.db.load_co_plays(), self.db.last_plays(WINDOW))
+        if self.db.get_meta('co_plays_built') or not self.db.writable:
+            self.co_plays.dirty.clear()
+            return
+        # first run with recommendations: mine the sessions of the play log
+        self.co_plays.session.clear()
+        self.co_plays.add_plays(self.db.timed_plays())
+        with self.db.transaction() as cur:
+            self.db.save_co_plays(cur, self.co_plays.snapshot())
+            self.db.set_meta(cur, 'co_plays_built', 1)
+
+    def _stats_snapshot(self) -> tuple:
+        # taken on the loop thread: what changed since the last save
+        plays, self.pending_plays = self.pending_plays, []
+        counts = {title: self.heap.counter[title] for title, _, _ in plays}
+        queue = list(self.upcoming) if self.queue_dirty else None
+        cleared, self.history_cleared = self.history_cleared, False
+        self.stats.prune()
+        buckets = self.stats.snapshot()
+        pairs = self.co_plays.snapshot()
+        self.queue_dirty = False
+        self.stats_dirty = False
+        return plays, counts, queue, cleared, buckets, list(self.stats.pruned), pairs
+
+    def _write_stats(self, plays: list, counts: dict, queue: Optional[list], cleared: bool,
+                     buckets: list, pruned: list, pairs: list) -> None:
+        try:
+            with self.db.transaction() as cur:
+                self.db.save_plays(cur, plays, counts)
+                self.db.save_stat_buckets(cur, buckets, pruned)
+                self.db.save_co_plays(cur, pairs)
+                if cleared:
+                    self.db.clear_history(cur)
+                if queue is not None:
+                    self.db.save_queue(cur, queue)
+        except Exception as e:
+            print('Could not save play stats:', e)
+
+    def save_now(self) -> None:
+        snapshot = self._stats_snapshot()
+        if self.read_only or not self.db.writable:
+            return
+        self._write_stats(*snapshot)
+        self.metadata.save()
+        self.library.save()
+
+    async def save(self) -> None:
+        # snapshot on the loop thread, write on the executor
+        snapshot = self._stats_snapshot()
+        if self.read_only or not self.db.writable:
+            return
+        await self.run_blocking(self._write_stats, *snapshot)
+
+    def shutdown(self) -> None:
+        # synchronous teardown for front ends whose loop may already be gone
+        self.loop = None  # late player callbacks are dropped from here on
+        for task in list(self.tasks):
+            task.cancel()
+        if self.watcher:
+            self.watcher.stop()
+        self.requests.stop()
+        self.player.stop()
+        self.transcoder.close()
+        self.save_now()
+        self.save_snapshot_now()
+        self.executor.shutdown(wait=False)
+        self.db.close()
+        if self.owner_lock:
+            self.owner_lock.close()  # releases the flock
+            self.owner_lock = None
+
+    async def close(self) -> None:
+        tasks = list(self.tasks)
+        self.shutdown()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    # ----------------- Warm Start -----------------
+    def _read_snapshot(self) -> Optional[dict]:
+        # the saved structures, if nothing was written to the database after them
+        found = snapshot.read(self.snapshot_path)
+        if found is None:
+            return None
+        state, dirs = found
+        try:
+            if (state['token'] != self.db.get_meta('snapshot')
+                    or state['generations'] != self.db.generations()
+                    or state['song_dir'] != os.path.abspath(self.song_dir)):
+                return None
+        except (KeyError, ValueError) as e:
+            print('Could not read the library snapshot:', e)
+            return None
+        state['dirs'] = dirs
+        self.snapshot_gens = state['generations']
+        self.snapshot_dirty = False
+        return state
+
+    def _restore_plays(self, state: dict) -> None:
+        # counts and ranking as saved, then the plays logged after the snapshot
+        self.heap.restore(*state['plays'])
+        self.last_played = state['last_played']
+        replayed = set()
+        for title, played_at in self.db.plays_since(state['play_id']):
+            self.heap.add_play(title)
+            if played_at:
+                self.last_played[title] = max(played_at, self.last_played.get(title, 0.0))
+            replayed.add(title)
+        state['replayed'] = replayed
+
+    def _restore_library(self, state: dict) -> None:
+        titles, paths = state['playlist']
+        nodes = [self.playlist.insert_song_end(title, path) for title, path in zip(titles, paths)]
+        self.song_map.map = {key: nodes[i] for key, i in state['titles'].items()}
+        self.song_map.paths = {key: nodes[i] for key, i in state['paths'].items()}
+        self.bst.root = snapshot.restore_bst(*state['bst'], BSTNode)
+        self.library.references = TrackedDict(state['references'])
+        self.library.manifest = TrackedDict(state['manifest'])
+        self.library.added = TrackedDict(state['added'])
+        self.library.folders = state['folders']
+        if state['facets'] is not None:
+            self.facets = FacetIndex.restore(state['facets'])
+            self.sorts = SortIndex.restore(state['sorts'])
+            self.indexes_built = True
+        for title in state.get('replayed', ()):
+            node = self.song_map.search_song(title)
+            if node:
+                self._index('play', node.path, node.title)
+        self._rescan_changed(state['dirs'])
+
+    def _rescan_changed(self, times: dict) -> None:
+        """Applies what changed in the directories modified since the
+        snapshot: files added or removed there, and new subdirectories.
+        Edited files are caught as on a cold start, by the metadata cache's
+        size/mtime check when they are next read."""
+        changed = snapshot.changed_directories(times)
+        if not changed:
+            return
+        song_dir = os.path.abspath(self.song_dir)
+        in_dir = {}     # directory -> {path key: path} of the songs directly in it
+        for key, node in self.song_map.paths.items():
+            in_dir.setdefault(os.path.dirname(key), {})[key] = node.path
+        events = []
+        for d in changed:
+            if not os.path.isdir(d):
+                events.append(('removed', d))
+                continue
+            known = in_dir.get(normalize_path(d), {})
+            seen = set()
+            try:
+                with os.scandir(d) as it:
+                    for entry in it:
+                        if entry.is_dir(follow_symlinks=False):
+                            # songs/ itself is not scanned recursively
+                            if d != song_dir and entry.path not in times:
+                                events += [('added', path) for path, _, _ in iter_audio_files(entry.path)]
+                        elif is_audio_file(entry.name) and entry.is_file():
+                            key = normalize_path(entry.path)
+                            seen.add(key)
+                            if key not in known:
+                                events.append(('added', entry.path))
+            except OSError:
+                continue
+            events += [('removed', path) for key, path in known.items() if key not in seen]
+        added, removed = self.library.apply_events(events, self.playlist, self.song_map,
+                                                   self.bst, self.metadata)
+        if added or removed:
+            self.library_diverged = True
+            self.library.save()
+        for node in removed:
+            self._index('remove', node.path)
+        for node in added:
+            self._index('update', node.path, node.title, self.metadata.peek(node.path) or {})
+
+    def _snapshot_state(self) -> Optional[tuple]:
+        # marshalled on the loop thread in one step; None while a save is outstanding
+        if self.pending_plays or self.library.dirty or self.metadata.dirty:
+            return None
+        nodes = list(self.playlist.iter_nodes())
+        ids = {id(node): i for i, node in enumerate(nodes)}
+        built = self.indexes_built and self.index_pending is None
+        state = {
+            'token': os.urandom(8).hex(),
+            'generations': self.db.generations(),
+            'play_id': self.db.last_play_id(),
+            'song_dir': os.path.abspath(self.song_dir),
+            'playlist': ([node.title for node in nodes], [node.path for node in nodes]),
+            'titles': {key: ids[id(node)] for key, node in self.song_map.map.items() if id(node) in ids},
+            'paths': {key: ids[id(node)] for key, node in self.song_map.paths.items() if id(node) in ids},
+            'bst': snapshot.dump_bst(self.bst.root),
+            'plays': (dict(self.heap.counter), self.heap.ranking),
+            'last_played': self.last_played,
+            'references': dict(self.library.references),
+            'manifest': dict(self.library.manifest),
+            'added': dict(self.library.added),
+            'folders': self.library.folders,
+            'metadata': dict(self.metadata.entries),
+            'facets': self.facets.dump() if built else None,
+            'sorts': self.sorts.dump() if built else None,
+        }
+        self.snapshot_dirty = False
+        return marshal.dumps(state), state['token'], state['generations']
+
+    def _store_snapshot(self, blob: bytes, token: str, generations: tuple, times: dict) -> None:
+        try:
+            snapshot.write(self.snapshot_path, blob, marshal.dumps(times))
+            with self.db.transaction() as cur:
+                self.db.set_meta(cur, 'snapshot', token)
+            self.snapshot_gens = generations
+        except Exception as e:
+            self.snapshot_dirty = True
+            print('Could not save the library snapshot:', e)
+
+    def _snapshot_due(self) -> bool:
+        # not once the library differs from a cold load of the database
+        # (a delete, shuffle or import, files found since, or an index written
+        # while loading): the next start is cold and snapshots that instead
+        if self.read_only or not self.db.writable or self.library_diverged:
+            return False
+        if self.db.generations()[0] != self.library_gen:
+            return False
+        return self.snapshot_dirty or self.db.generations() != self.snapshot_gens
+
+    def _snapshot_dirs(self) -> tuple:
+        return [self.song_dir] + self.library.folders, list(self.library.manifest)
+
+    async def save_snapshot(self) -> None:
+        """Writes data/snapshot.bin if the library changed since the last
+        one. Directory times are read before the structures, so a change in
+        between is rescanned at the next start rather than missed."""
+        try:
+            if not self._snapshot_due():
+                return
+            await self.run_blocking(self.library.save)
+            await self.run_blocking(self.metadata.save)
+            times = await self.run_blocking(snapshot.directory_times, *self._snapshot_dirs())
+            taken = self._snapshot_state()
+            if taken:
+                await self.run_blocking(self._store_snapshot, *taken, times)
+        except Exception as e:
+            print('Could not save the library snapshot:', e)
+
+    def save_snapshot_now(self) -> None:
+        # shutdown: right after save_now(), so nothing is outstanding
+        try:
+            if self._snapshot_due():
+                times = snapshot.directory_times(*self._snapshot_dirs())
+                taken = self._snapshot_state()
+                if taken:
+                    self._store_snapshot(*taken, times)
+        except Exception as e:
+            print('Could not save the library snapshot:', e)
+
+    # ----------------- Background Tasks -----------------
+    async def _autosave_loop(self) -> None:
+        while True:
+            await asyncio.sleep(AUTOSAVE_SECONDS)
+            if self.stats_dirty:
+                await self.save()
+            if time.monotonic() - self.snapshot_time >= SNAPSHOT_SECONDS:
+                self.snapshot_time = time.monotonic()
+                await self.save_snapshot()
+
+    async def _advance_loop(self) -> None:
+        # Sleeps until the current track should be over, then checks whether
+        # the audio really stopped; any play/pause/seek wakes it to re-plan
+        while True:
+            self.wake.clear()
+            delay = None
+            if self.state == 'playing' and self.current:
+                left = self.duration - self.player.position() if self.duration else 0.5
+                delay = min(max(left, 0.2), 5.0)
+                if self._track_ended():
+                    await self.advance()
+                    continue
+            # asyncio.wait rather than wait_for: on 3.11 wait_for can swallow
+            # a cancel that lands as the event fires, and close() would hang
+            waiter = asyncio.ensure_future(self.wake.wait())
+            try:
+                await asyncio.wait((waiter,), timeout=delay)
+            finally:
+                waiter.cancel()
+
+    def _track_ended(self) -> bool:
+        return (not self.requests.busy() and self.player.finished()
+                and self.player.current_path == self.current.path)
+
+    def apply_library_events(self, events) -> None:
+        added, removed = self.library.apply_events(events, self.playlist, self.song_map,
+                                                   self.bst, self.metadata)
+        if added or removed:
+            self.library.save()
+            self._library_changed(added, removed, 'watch')
+
+    def _library_changed(self, added: list, removed: list, reason: str) -> None:
+        self.library_diverged = True
+        for node in removed:
+            self._index('remove', node.path)
+        untagged = []
+        for node in added:
+            entry = self.metadata.peek(node.path)
+            self._index('update', node.path, node.title, entry or {})
+            if entry is None:
+                untagged.append(node)
+        if untagged and self.loop:
+            self.spawn(self._read_tags(untagged), name='read-tags')
+        if added and self.loop:
+            self.spawn(self.transcode_ahead([node.path for node in added]), name='transcode')
+        self._emit('library', added=added, removed=removed, reason=reason)
+
+    # ----------------- Facets & Sorting -----------------
+    def _index(self, op: str, *args) -> None:
+        # keeps the facet and sort indexes in step; queued while one is rebuilt off the loop
+        self.snapshot_dirty = True
+        if self.index_pending is not None:
+            self.index_pending.append((op, args))
+        else:
+            getattr(self, '_index_' + op)(*args)
+
+    def _index_update(self, path: str, title: str, entry: dict) -> None:
+        plays = self.heap.counter.get(title, 0)
+        self.facets.update(path, entry, plays)
+        self.sorts.update(path, title, entry, plays, self.last_played.get(title, 0.0),
+                          self.library.added_at(path, entry))
+
+    def _index_remove(self, path: str) -> None:
+        self.facets.remove(path)
+        self.sorts.remove(path)
+
+    def _index_play(self, path: str, title: str) -> None:
+        plays = self.heap.counter.get(title, 0)
+        self.facets.set_plays(path, plays)
+        self.sorts.set_plays(path, plays, self.last_played.get(title, 0.0))
+
+    async def _offload_index(self, fn, install=None):
+        """Runs fn on the executor while index updates queue up, hands its
+        result to install (on the loop), then applies the queued updates."""
+        async with self.index_lock:
+            self.index_pending = []
+            try:
+                result = await self.run_blocking(fn)
+                if install:
+                    install(result)
+                return result
+            finally:
+                pending, self.index_pending = self.index_pending, None
+                for op, args in pending:
+                    getattr(self, '_index_' + op)(*args)
+
+    async def build_indexes(self) -> None:
+        """Rebuilds the facet index (numbering songs in artist/album order)
+        and the sort index (title order ready) on the executor, unless they
+        came from the snapshot, then reads the tags of songs the metadata
+        cache has never seen."""
+        if not self.indexes_built:
+            await self._build_indexes()
+        await self._read_tags([node for node in self.playlist.iter_nodes()
+                               if self.metadata.peek(node.path) is None])
+        await self.transcode_ahead([node.path for node in self.playlist.iter_nodes()])
+
+    async def _build_indexes(self) -> None:
+        songs = []
+        for node in self.playlist.iter_nodes():
+            entry = self.metadata.peek(node.path) or {}
+            songs.append((node.path, node.title, entry, self.heap.counter.get(node.title, 0),
+                          self.last_played.get(node.title, 0.0), self.library.added_at(node.path, entry)))
+        self.library.seeding = False
+
+        def build():
+            facets, sorts = FacetIndex(), SortIndex()
+            facets.build([(path, entry, plays) for path, _, entry, plays, _, _ in songs])
+            sorts.build(songs, ('title',))
+            return facets, sorts
+
+        def install(indexes):
+            self.facets, self.sorts = indexes
+            self.indexes_built = True
+        try:
+            await self._offload_index(build, install)
+        except Exception as e:
+            print('Could not build the facet and sort indexes:', e)
+
+    async def _sort_order(self, order: str) -> List[str]:
+        # the cached permutation for order; a new one is sorted off the loop
+        if order not in ORDERS:
+            raise ValueError(f'unknown sort order {order!r} (one of {", ".join(ORDERS)})')
+        if order not in self.sorts.perms:
+            await self._offload_index(lambda: self.sorts.prepare(order))
+        return self.sorts.order(order)
+
+    def _titles(self, paths) -> List[str]:
+        titles = []
+        for path in paths:
+            node = self.song_map.search_path(path)
+            if node:
+                titles.append(node.title)
+        return titles
+
+    async def _read_tags(self, nodes: list) -> None:
+        def read(paths):
+            return [self.metadata.get(path) for path in paths]
+        for k in range(0, len(nodes), 100):
+            batch = nodes[k:k + 100]
+            entries = await self.run_blocking(read, [node.path for node in batch])
+            for node, entry in zip(batch, entries):
+                self._index('update', node.path, node.title, entry)
+        if nodes and not self.read_only:
+            await self.run_blocking(self.metadata.save)
+
+    # ----------------- Formats -----------------
+    def _needs_transcode(self, path: str) -> bool:
+        entry = self.metadata.peek(path)
+        fmt = entry.get('codec') if entry and 'codec' in entry else probe_format(path)
+        return fmt is not None and not self.player.backend.can_play(fmt) and self.transcoder.available
+
+    def _playable(self, path: str, wait: bool = True) -> Optional[str]:
+        # player hook (play-request and audio threads): the file to load for path
+        return self.transcoder.resolve(path, wait) if self._needs_transcode(path) else path
+
+    async def transcode_ahead(self, paths: List[str]) -> int:
+        """Queues songs the backend cannot decode for conversion in the
+        background, so they are ready before they are played."""
+        if self.read_only or not self.transcoder.available:
+            return 0
+        return await self.run_blocking(
+            lambda: self.transcoder.prefetch([p for p in paths if self._needs_transcode(p)]))
+
+    # ----------------- Playback -----------------
+    def record_play(self, node) -> None:
+        self.history.push(node.title)
+        self.heap.add_play(node.title)
+        now = time.time()
+        self.last_played[node.title] = now
+        self._index('play', node.path, node.title)
+        self.stats.add(node.title, now)
+        self.co_plays.add(node.title, now)
+        self.pending_plays.append((node.title, node.path, now))
+        self.stats_dirty = True
+
+    def _set_current(self, node, position: float = 0.0) -> None:
+        self.current = node
+        entry = self.metadata.peek(node.path)
+        self.duration = int(entry.get('duration', 0)) if entry else 0
+        self.record_play(node)
+        self._set_state('playing')
+        self._emit('track', node=node, position=position, duration=self.duration)
+
+    def _set_state(self, state: str) -> None:
+        if state != self.state:
+            self.state = state
+            self._emit('state', state=state)
+        self.wake.set()
+
+    async def play(self, node, fade: bool = False, start: float = 0.0):
+        """Makes node current right away; the audio follows on the play-request
+        worker, and a newer play() supersedes one still on its way."""
+        if node is None:
+            return None
+        self.requests.request(node.path, start=start, fade=fade and self.state == 'playing')
+        self._set_current(node, start)
+        return node
+
+    def _audio_ready(self, path: str, duration) -> None:
+        self._threadsafe(self._on_ready, path, duration)
+
+    def _on_ready(self, path: str, duration) -> None:
+        if not self.current or self.current.path != path:
+            return
+        self.duration = int(duration or 0)
+        self.queue_next_track()
+        self._emit('ready', node=self.current, duration=self.duration)
+        self.wake.set()
+
+    def _engine_track_change(self, path: str) -> None:
+        self._threadsafe(self._on_engine_track_change, path)
+
+    def _on_engine_track_change(self, path: str) -> None:
+        # the engine joined the queued track by itself (gapless or crossfade)
+        if self.current and self.current.path == path:
+            return
+        node = self.song_map.search_path(path)
+        if not node:
+            return
+        queued = self.autoplay_queue and len(self.upcoming) and self.upcoming.at(0) == node.title
+        # current first: the dequeue re-queues the engine's next track from it
+        self._set_current(node)
+        if queued:
+            self.upcoming.dequeue()
+            self.refill_queue()
+        self.spawn(self._refresh_duration(node))
+
+    async def _refresh_duration(self, node) -> None:
+        duration = await self.run_blocking(self.metadata.duration, node.path)
+        if self.current is node:
+            self._on_ready(node.path, duration)
+
+    def next_node(self):
+        # what auto-advance plays: the queue head, else the next song
+        if self.autoplay_queue and len(self.upcoming):
+            return self.song_map.search_song(self.upcoming.at(0))
+        return self.current.next if self.current else None
+
+    def queue_next_track(self) -> None:
+        node = self.next_node() if self.current else None
+        self.player.queue_next(node.path if node else None)
+        if node and self.loop:
+            # prefetch: warm the metadata cache for the track that comes next
+            self.spawn(self.run_blocking(self.metadata.duration, node.path), name='prefetch')
+
+    def _on_queue_change(self, op, index, value) -> None:
+        self.queue_dirty = True
+        self.stats_dirty = True
+        self.queue_next_track()
+
+    def set_autoplay_queue(self, enabled: bool) -> None:
+        self.autoplay_queue = enabled
+        self.queue_next_track()
+
+    def set_autofill(self, rule: str) -> None:
+        if rule not in AUTOFILL_RULES:
+            raise ValueError(f'unknown autofill rule: {rule}')
+        self.autofill = rule
+        if self.read_only or not self.db.writable:
+            return
+        try:
+            with self.db.transaction() as cur:
+                self.db.set_meta(cur, 'autofill', rule)
+        except Exception as e:
+            print('Could not save the autofill setting:', e)
+
+    def refill_queue(self) -> int:
+        """When the queue has run dry, queues songs heard together with the
+        current track ('track') or the last few plays ('session'). Songs
+        played recently come last."""
+        if self.autofill == 'off' or len(self.upcoming) or not self.current:
+            return 0
+        recent = self.history.get_all()
+        seeds = [self.current.title] if self.autofill == 'track' else recent[:WINDOW]
+        skip = set(recent[:AUTOFILL_SKIP])
+        candidates = [title for title in self.co_plays.recommend(seeds, self.co_plays.k, exclude=[self.current.title])
+                      if self.song_map.search_song(title)]
+        candidates.sort(key=lambda title: title in skip)  # stable: fresh songs first
+        picks = candidates[:AUTOFILL_COUNT]
+        for title in picks:
+            self.upcoming.enqueue(title)
+        return len(picks)
+
+    async def advance(self):
+        """End of track: queue head (with autoplay on), else the next song."""
+        if self.autoplay_queue and len(self.upcoming):
+            return await self.play_next_from_queue()
+        if self.current and self.current.next:
+            return await self.play(self.current.next)
+        await self.stop()
+        return None
+
+    async def next(self, fade: bool = True):
+        if self.current and self.current.next:
+            return await self.play(self.current.next, fade=fade)
+        return None
+
+    async def prev(self):
+        if self.current and self.current.prev:
+            return await self.play(self.current.prev)
+        return None
+
+    async def play_next_from_queue(self, fade: bool = True):
+        title = self.upcoming.dequeue()
+        if not title:
+            self._emit('message', text='Upcoming queue is empty.')
+            return None
+        node = self.song_map.search_song(title)
+        if not node:
+            self._emit('message', text=f'Song not found in playlist: {title}')
+            return None
+        played = await self.play(node, fade=fade)
+        self.refill_queue()
+        return played
+
+    async def play_title(self, title: str):
+        return await self.play(self.song_map.search_song(title))
+
+    async def play_index(self, index: int):
+        # 1-based, as shown by the playlist listing
+        for i, node in enumerate(self.playlist.iter_nodes(), 1):
+            if i == index:
+                return await self.play(node)
+        return None
+
+    async def pause(self) -> None:
+        self.requests.cancel()
+        self.player.pause()
+        self._set_state('paused')
+
+    async def resume(self) -> None:
+        if not self.current:
+            return
+        if self.player.is_paused() and self.player.current_path == self.current.path:
+            self.player.resume()
+            self._set_state('playing')
+        else:
+            await self.play(self.current)
+
+    async def toggle(self) -> None:
+        if self.state == 'playing':
+            await self.pause()
+        else:
+            await self.resume()
+
+    async def stop(self) -> None:
+        self.requests.cancel()
+        await self.run_blocking(self.player.stop)
+        self._set_state('stopped')
+
+    async def seek(self, position: float) -> None:
+        if not self.current:
+            return
+        if self.player.current_path == self.current.path and not self.requests.busy():
+            await self.run_blocking(self.player.seek, position)
+        else:
+            # still switching tracks: start the pending one there instead
+            self.requests.request(self.current.path, start=float(position))
+        self.wake.set()
+
+    def position(self) -> float:
+        if self.current and self.player.current_path == self.current.path:
+            return self.player.position()
+        return 0.0
+
+    def status(self) -> dict:
+        return {'state': self.state, 'title': self.current.title if self.current else None,
+                'path': self.current.path if self.current else None,
+                'position': self.position(), 'duration': self.duration,
+                'queue': len(self.upcoming), 'songs': len(self.playlist),
+                'audio_path': self.player.current_path, 'autoplay_queue': self.autoplay_queue,
+                'autofill': self.autofill, 'transcoding': len(self.transcoder.jobs)}
+
+    # ----------------- Library & Queue -----------------
+    async def enqueue(self, title: str, next: bool = False):
+        """Queues a song at the end, or right after the current track."""
+        node = self.song_map.search_song(title)
+        if node:
+            if next:
+                self.upcoming.insert_next(node.title)
+            else:
+                self.upcoming.enqueue(node.title)
+        return node
+
+    async def queue_remove(self, index: int):
+        return self.upcoming.remove_at(index)
+
+    async def queue_move(self, src: int, dst: int) -> bool:
+        return self.upcoming.move(src, dst)
+
+    async def queue_dedupe(self) -> int:
+        return self.upcoming.dedupe()
+
+    async def search(self, query: str) -> List[str]:
+        q = query.lower()
+        return [node.title for node in self.playlist.iter_nodes() if q in node.title.lower()]
+
+    async def shuffle(self) -> None:
+        self.playlist.shuffle_playlist()
+        self.song_map.rebuild_from_playlist(self.playlist)
+        # shuffling rebuilds the nodes; keep pointing at the playing song
+        if self.current:
+            self.current = self.song_map.search_path(self.current.path) or self.playlist.head
+        self._library_changed([], [], 'shuffle')
+
+    async def delete(self, title: str) -> bool:
+        node = self.song_map.search_song(title)
+        if not node:
+            return False
+        self.playlist.remove_node(node)
+        self.song_map.remove_from_hash(node.title)
+        self.bst.delete(node.title)
+        self.library.remove_path(node.path)
+        await self.run_blocking(self.library.save)
+        self._library_changed([], [node], 'delete')
+        return True
+
+    async def add_file(self, path: str, copy: bool = False):
+        """Adds a song by reference, or copies it into the songs folder in the
+        background (it plays from the original location until then)."""
+        path = os.path.abspath(path)
+        if self.song_map.search_path(path):
+            return None
+        node = self.playlist.insert_song_end(title_from_path(path), path)
+        self.song_map.insert_to_hash(node.title, node)
+        self.bst.insert(node.title)
+        if copy:
+            def on_copied(dst, err):
+                if err:
+                    self._emit('message', text=f'Copy failed: {err}')
+                    return
+                self.song_map.remove_from_hash(node.title)
+                self._index('remove', node.path)
+                node.path = dst
+                self.song_map.insert_to_hash(node.title, node)
+                self._index('update', dst, node.title, self.metadata.peek(dst) or {})
+            copy_in_background(path, os.path.join(self.song_dir, os.path.basename(path)),
+                               lambda dst, err: self._threadsafe(on_copied, dst, err))
+        else:
+            self.library.add_reference(path)
+            await self.run_blocking(self.library.save)
+        self._library_changed([node], [], 'add')
+        return node
+
+    async def add_folder(self, folder: str) -> list:
+        self.library.add_folder(folder)
+        if self.watcher:
+            watcher = self.watcher
+
+            def rewatch():
+                # stopping joins the watcher thread
+                watcher.stop()
+                watcher.folders.append(os.path.abspath(folder))
+                watcher.start()
+            await self.run_blocking(rewatch)
+        # the walk runs on the executor against a copy of the manifest
+        changes = await self.run_blocking(folder_changes, folder, dict(self.library.manifest))
+        added = self.library.scan_into(folder, self.playlist, self.song_map, changes)
+        for node in added:
+            self.bst.insert(node.title)
+        await self.run_blocking(self.library.save)
+        self._library_changed(added, [], 'add')
+        return added
+
+    async def import_playlist(self, path: str) -> PlaylistImporter:
+        importer = PlaylistImporter(path, self.playlist, self.song_map)
+        batches = importer.entry_batches()
+
+        def resolve_next():
+            # reads and checks the next batch of entries on the executor
+            batch = next(batches, None)
+            return None if batch is None else importer.resolve(batch)
+        paths, added = [], []
+        while True:
+            found = await self.run_blocking(resolve_next)
+            if found is None:
+                break
+            nodes, new = importer.place(found)
+            for node in new:
+                self.library.add_reference(node.path)
+                self.bst.insert(node.title)
+            added += new
+            for node in nodes:
+                self.upcoming.enqueue(node.title)
+                paths.append(node.path)
+        if added:
+            await self.run_blocking(self.library.save)
+            self._library_changed(added, [], 'add')
+        if paths and self.db.writable:
+            # kept under the file's name for later sessions
+            name = os.path.splitext(os.path.basename(path))[0]
+            try:
+                await self.run_blocking(self.db.save_playlist, name, paths)
+            except Exception as e:
+                print('Could not save the playlist:', e)
+        return importer
+
+    async def export_playlist(self, path: str) -> int:
+        nodes = list(self.playlist.iter_nodes())
+        return await self.run_blocking(export_playlist, nodes, path)
+
+    async def top_played(self, window: str = 'all', n: int = 10) -> List[Tuple[str, int]]:
+        """Most played titles: 'all' time, over the last 'day', 'week',
+        'month' or 'year', or 'trending' (up on their usual rate)."""
+        if window == 'all':
+            return self.heap.get_top(n)
+        if window != 'trending' and window not in WINDOWS:
+            raise ValueError(f'unknown window: {window}')
+        return self.stats.window(window, n)
+
+    async def filter_songs(self, query: str, limit: int = 0, facets=('genre', 'year'), top: int = 10,
+                           order: Optional[str] = None, reverse: bool = False) -> dict:
+        """Songs matching a facet query such as "genre=synthwave AND
+        year>=2020 AND plays>5" (see facets.py), in artist/album order or a
+        sort order of sorting.ORDERS, with the most common values of each of
+        facets among them. Raises ValueError for a malformed query."""
+        for field in facets:
+            if field not in FIELDS:
+                raise ValueError(f'unknown facet {field!r}')
+        index = self.facets
+        matched = index.filter(query)
+        if order is None and not reverse:
+            paths = index.paths_of(matched, limit)
+        else:
+            paths = index.paths_of(matched, 0)
+            if order is not None:
+                perm = await self._sort_order(order)
+                sorts = self.sorts
+                if len(paths) * 16 < len(perm):
+                    # a few matches: sort them by their cached keys
+                    paths = sorted((p for p in paths if p in sorts.songs), key=lambda p: sorts.key(order, p))
+                else:
+                    wanted = set(paths)
+                    paths = [p for p in perm if p in wanted]
+            if reverse:
+                paths.reverse()
+            if limit:
+                paths = paths[:limit]
+        return {'count': len(matched), 'titles': self._titles(paths), 'indexing': self.index_pending is not None,
+                'facets': {field: index.counts(field, matched, top) for field in facets}}
+
+    async def sorted_titles(self, order: str = 'title', reverse: bool = False, limit: int = 0) -> List[str]:
+        """Every song in a sort order of sorting.ORDERS ('title', 'artist',
+        'album', 'duration', 'plays', 'added', 'played') or 'playlist'.
+        Raises ValueError for an unknown order."""
+        if order == 'playlist':
+            titles = [node.title for node in self.playlist.iter_nodes()]
+            if reverse:
+                titles.reverse()
+            return titles[:limit] if limit else titles
+        perm = await self._sort_order(order)
+        return self._titles(itertools.islice(reversed(perm) if reverse else perm, limit or None))
+
+    async def similar(self, title: str, n: int = 10) -> List[Tuple[str, float]]:
+        """Songs most often heard in the same session as title."""
+        found = []
+        for other, weight in self.co_plays.similar(title, self.co_plays.k):
+            if self.song_map.search_song(other):
+                found.append((other, weight))
+                if len(found) == n:
+                    break
+        return found
+
+    async def clear_history(self) -> None:
+        self.history.clear()
+        self.history_cleared = True
+        await self.save()
+
+    async def find_duplicates(self) -> List[List[str]]:
+        from duplicates import DuplicateFinder
+        finder = DuplicateFinder(self.metadata, self.fingerprint_dir)
+        paths = [node.path for node in self.playlist.iter_nodes()]
+        groups = await self.run_blocking(finder.find, paths)
+        await self.run_blocking(self.metadata.save)
+        return groups
+
+    async def analyze_loudness(self, progress=None) -> int:
+        from loudness import LoudnessAnalyzer
+        analyzer = LoudnessAnalyzer(self.metadata)
+        paths = [node.path for node in self.playlist.iter_nodes()]
+        return await self.run_blocking(analyzer.run, paths, progress)
@@ -0,0 +1,145 @@
+# snapshot.py
+# Warm start: the in-memory library written to data/snapshot.bin, so a
+# launch does not rebuild it from the database and rescan every folder.
+# The file is a fixed header (magic, format version, the marshal and Python
+# versions that wrote it, section sizes, CRC-32) and two marshal sections,
+# read through mmap: the state (playlist order, BST shape, ranking, library
+# index, metadata cache, facet and sort indexes) and the modification times
+# of the library's directories. The service trusts the state only while the
+# database's generation counters match it; then only directories whose
+# mtime changed are rescanned and plays logged since are replayed, so an
+# unchanged library starts without listing a single folder.
+import os
+import sys
+import mmap
+import time
+import zlib
+import struct
+import marshal
+from typing import Dict, Iterable, List, Optional, Tuple
+
+MAGIC = b'MZSN'
+VERSION = 2
+# magic, format version, marshal version, Python major/minor, state bytes, dirs bytes, CRC-32
+HEADER = struct.Struct('<4sHHBBQQI')
+SETTLE_NS = 2_000_000_000
+
+
+def write(path: str, state: bytes, dirs: bytes) -> int:
+    """Writes marshalled state and dirs atomically; returns the file size."""
+    crc = zlib.crc32(dirs, zlib.crc32(state))
+    header = HEADER.pack(MAGIC, VERSION, marshal.version, *sys.version_info[:2], len(state), len(dirs), crc)
+    tmp = path + '.part'
+    with open(tmp, 'wb') as f:
+        f.write(header)
+        f.write(state)
+        f.write(dirs)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    return HEADER.size + len(state) + len(dirs)
+
+
+def read(path: str) -> Optional[Tuple[dict, Dict[str, int]]]:
+    """(state, directory mtimes), or None for a missing, damaged or foreign
+    (other format or Python version) snapshot."""
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            if size < HEADER.size:
+                return None
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                magic, version, marshal_version, major, minor, n_state, n_dirs, crc = HEADER.unpack_from(mm)
+                if ((magic, version, marshal_version, (major, minor))
+                        != (MAGIC, VERSION, marshal.version, sys.version_info[:2])
+                        or HEADER.size + n_state + n_dirs != size):
+                    return None
+                with memoryview(mm) as view, view[HEADER.size:] as body:
+                    if zlib.crc32(body) != crc:
+                        return None
+                    with body[:n_state] as state, body[n_state:] as dirs:
+                        return marshal.loads(state), marshal.loads(dirs)
+    except (OSError, ValueError, EOFError, TypeError) as e:
+        print('Could not read the library snapshot:', e)
+        return None
+
+
+# ----------------- BST -----------------
+def dump_bst(root) -> Tuple[List[str], bytes]:
+    # preorder titles, and per node 1 = has a left child | 2 = has a right child
+    titles, shape = [], bytearray()
+    stack = [root] if root else []
+    while stack:
+        node = stack.pop()
+        titles.append(node.title)
+        shape.append((node.left is not None) | (node.right is not None) << 1)
+        if node.right:
+            stack.append(node.right)
+        if node.left:
+            stack.append(node.left)
+    return titles, bytes(shape)
+
+
+def restore_bst(titles: List[str], shape: bytes, node_cls):
+    """The tree dump_bst() saw, rebuilt in one pass without comparisons."""
+    root = None
+    waiting = []    # [node, wants left, wants right], innermost last
+    for title, flags in zip(titles, shape):
+        node = node_cls(title)
+        if waiting:
+            parent = waiting[-1]
+            if parent[1]:
+                parent[0].left = node
+                parent[1] = False
+            else:
+                parent[0].right = node
+                parent[2] = False
+            if not (parent[1] or parent[2]):
+                waiting.pop()
+        else:
+            root = node
+        if flags:
+            waiting.append([node, bool(flags & 1), bool(flags & 2)])
+    return root
+
+
+# ----------------- Directories -----------------
+def directory_times(roots: Iterable[str], paths: Iterable[str]) -> Dict[str, int]:
+    """mtime_ns of every root and of each directory between a root and a
+    file in paths (files outside the roots are ignored)."""
+    dirs = {os.path.abspath(root) for root in roots}
+    for path in paths:
+        chain, d = [], os.path.dirname(path)
+        while d not in dirs:
+            parent = os.path.dirname(d)
+            if parent == d:
+                chain = None
+                break
+            chain.append(d)
+            d = parent
+        if chain:
+            dirs.update(chain)
+    times, now = {}, time.time_ns()
+    for d in dirs:
+        try:
+            mtime = os.stat(d).st_mtime_ns
+        except OSError:
+            continue
+        # modified just now: on coarse timestamps a second change could keep
+        # this mtime, so such a directory is always rescanned
+        times[d] = mtime if now - mtime > SETTLE_NS else -1
+    return times
+
+
+def changed_directories(times: Dict[str, int]) -> List[str]:
+    # an entry was added, removed or renamed in these since the snapshot
+    changed = []
+    for d, mtime in times.items():
+        try:
+            if os.stat(d).st_mtime_ns != mtime:
+                changed.append(d)
+        except OSError:
+            changed.append(d)
+    return changed
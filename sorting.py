@@ -0,0 +1,125 @@
+# sorting.py
+# Library sort orders: title, artist, album (then track), duration, play
+# count, date added and last played. Collation keys are computed once per
+# song: case and accents are folded and digit runs compare as numbers, so
+# "b" follows "A" and "Track 2" comes before "Track 10". Each order is a
+# permutation (the song paths, sorted by that order's key), built the first
+# time it is asked for and then kept in place with bisect as songs are
+# added, retagged or played: showing an order is a walk over a ready list.
+import re
+import unicodedata
+from bisect import bisect_left, insort
+from typing import Dict, Iterable, List, Optional
+
+ORDERS = ('title', 'artist', 'album', 'duration', 'plays', 'added', 'played')
+DIGITS = re.compile(r'(\d+)')
+LEADING_NUMBER = re.compile(r'\s*(\d+)')
+MISSING = (1,)  # songs without an artist/album go after the tagged ones
+
+
+def collate(text) -> tuple:
+    """Sort key for a display string: (0, 'track ', 10, '') for 'Track 10'."""
+    text = str(text).strip() if text else ''
+    if not text:
+        return MISSING
+    if not text.isascii():
+        text = ''.join(c for c in unicodedata.normalize('NFKD', text) if not unicodedata.combining(c))
+    parts = DIGITS.split(text.casefold())
+    return (0,) + tuple(int(p) if i % 2 else p for i, p in enumerate(parts))
+
+
+def describe(title: str, entry: Optional[dict], plays: int, played: float, added: float) -> tuple:
+    # (title, artist, album, track, duration, added, plays, last played)
+    entry = entry or {}
+    track = LEADING_NUMBER.match(str(entry.get('tracknumber') or ''))
+    return (collate(title), collate(entry.get('artist')), collate(entry.get('album')),
+            int(track.group(1)) if track else 0, int(entry.get('duration') or 0),
+            added or 0.0, plays, played or 0.0)
+
+
+class SortIndex:
+    def __init__(self):
+        self.songs: Dict[str, tuple] = {}       # path -> describe()
+        self.perms: Dict[str, List[str]] = {}   # order -> paths, ascending by key()
+
+    def key(self, order: str, path: str) -> tuple:
+        # the path breaks ties, so every song has exactly one place
+        title, artist, album, track, duration, added, plays, played = self.songs[path]
+        if order == 'title':
+            return title, path
+        if order == 'artist':
+            return artist, album, track, title, path
+        if order == 'album':
+            return album, track, title, path
+        if order == 'duration':
+            return duration, title, path
+        if order == 'plays':
+            return -plays, title, path
+        if order == 'added':
+            return -added, title, path     # most recently added first
+        return -played, title, path        # most recently played first
+
+    def build(self, songs: Iterable[tuple], orders: Iterable[str] = ()) -> None:
+        # songs: (path, title, metadata entry, plays, last played, added)
+        self.songs = {path: describe(title, entry, plays, played, added)
+                      for path, title, entry, plays, played, added in songs}
+        self.perms = {}
+        for order in orders:
+            self.prepare(order)
+
+    def prepare(self, order: str) -> None:
+        if order not in ORDERS:
+            raise ValueError(f'unknown sort order {order!r} (one of {", ".join(ORDERS)})')
+        if order not in self.perms:
+            self.perms[order] = sorted(self.songs, key=lambda path: self.key(order, path))
+
+    def order(self, order: str) -> List[str]:
+        """The permutation itself, ascending; callers must not modify it."""
+        self.prepare(order)
+        return self.perms[order]
+
+    # ----------------- Updates -----------------
+    def _unplace(self, path: str) -> None:
+        for order, perm in self.perms.items():
+            i = bisect_left(perm, self.key(order, path), key=lambda p: self.key(order, p))
+            del perm[i]
+
+    def _place(self, path: str) -> None:
+        for order, perm in self.perms.items():
+            insort(perm, path, key=lambda p: self.key(order, p))
+
+    def update(self, path: str, title: str, entry: Optional[dict], plays: int, played: float,
+               added: float) -> None:
+        song = describe(title, entry, plays, played, added)
+        old = self.songs.get(path)
+        if old == song:
+            return
+        if old is not None:
+            self._unplace(path)
+        self.songs[path] = song
+        self._place(path)
+
+    def set_plays(self, path: str, plays: int, played: float) -> None:
+        song = self.songs.get(path)
+        if song is not None:
+            self._unplace(path)
+            self.songs[path] = song[:6] + (plays, played)
+            self._place(path)
+
+    def remove(self, path: str) -> None:
+        if path in self.songs:
+            self._unplace(path)
+            del self.songs[path]
+
+    def __len__(self) -> int:
+        return len(self.songs)
+
+    # ----------------- Snapshot -----------------
+    def dump(self) -> tuple:
+        return self.songs, self.perms
+
+    @classmethod
+    def restore(cls, state: tuple) -> 'SortIndex':
+        index = cls()
+        index.songs, index.perms = state
+        return index
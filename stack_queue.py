@@ -1,36 +1,57 @@
 # stack_queue.py
-# RecentlyPlayed (Stack) and UpcomingSongs (Circular Queue with dynamic resize)
+# RecentlyPlayed (Stack) and UpcomingSongs (indexed play queue)
+import random
 from collections import deque
-from typing import Optional
+from typing import Dict, Iterator, List, Optional
+from observable import Observable
+from instrument import timed
 
-class RecentlyPlayed:
+class RecentlyPlayed(Observable):
+    # Change notifications use get_all() positions (0 = most recent)
     def __init__(self, max_size: int | None = None):
+        super().__init__()
         # Optional bounded stack; if max_size is set, trim oldest when exceeding
         self.stack = []
         self.max_size = max_size
 
+    @timed('recently_played.push')
     def push(self, title):
-        # Remove ALL previous instances of this title to prevent duplicates
-        self.stack = [song for song in self.stack if song != title]
-            
+        # Titles are unique in the stack, so a replay just moves it to the top
+        if title in self.stack:
+            k = self.stack.index(title)
+            pos = len(self.stack) - 1 - k
+            del self.stack[k]
+            self.stack.append(title)
+            if pos != 0:
+                self._notify('move', (pos, 0), title)
+            return
+
         # Add the title to the top (end) of the stack
         self.stack.append(title)
-        
+        self._notify('insert', 0, title)
+
         if self.max_size is not None and len(self.stack) > self.max_size:
             # Remove the oldest (bottom of stack)
             self.stack.pop(0)
+            self._notify('remove', len(self.stack))
 
     def pop(self):
         if self.stack:
-            return self.stack.pop()
+            title = self.stack.pop()
+            self._notify('remove', 0)
+            return title
         return None
 
     def get_all(self):
         # Return list of songs most recent first
         return self.stack[::-1]
 
+    def at(self, index: int):
+        return self.stack[-1 - index]
+
     def clear(self):
         self.stack.clear()
+        self._notify('reset')
 
     def __len__(self):
         return len(self.stack)
@@ -44,50 +65,223 @@ class RecentlyPlayed:
             print(f"{i}. {title}")
 
 
-class UpcomingSongs:
-    def __init__(self, capacity: int = 10):
-        self.capacity = capacity
-        self.queue = [None] * capacity
-        self.front = 0
-        self.rear = -1
-        self.size = 0
+class _Entry:
+    # one queue slot: a treap node ordered by position (implicit key)
+    __slots__ = ('title', 'prio', 'left', 'right', 'parent', 'size')
 
-    def is_full(self) -> bool:
-        return self.size == self.capacity
+    def __init__(self, title: str, prio: float):
+        self.title = title
+        self.prio = prio
+        self.left = self.right = self.parent = None
+        self.size = 1
 
-    def is_empty(self) -> bool:
-        return self.size == 0
-
-    def _resize(self) -> None:
-        new_cap = self.capacity * 2
-        new_q = [None] * new_cap
-        for i in range(self.size):
-            new_q[i] = self.queue[(self.front + i) % self.capacity]
-        self.queue = new_q
-        self.front = 0
-        self.rear = self.size - 1
-        self.capacity = new_cap
-        print(f"🔄 Upcoming queue resized -> {self.capacity}")
+
+class UpcomingSongs(Observable):
+    """Play queue with positional edits for DJ-style use.
+
+    Entries live in a treap keyed by position (an order-statistics tree:
+    every node knows its subtree size), so at(), insert(), remove_at() and
+    move() are O(log n). A title -> entries hash finds a song's slots
+    without a scan, for membership, remove(title) and index_of(). A title
+    may be queued more than once; dedupe() keeps the first of each.
+    Notifications follow observable.py with queue positions (0 = next).
+    """
+
+    def __init__(self, seed=None):
+        super().__init__()
+        self.root: Optional[_Entry] = None
+        self.entries: Dict[str, List[_Entry]] = {}
+        self.rng = random.Random(seed)
+
+    # ----------------- Tree Internals -----------------
+    def _node_at(self, index: int) -> _Entry:
+        node = self.root
+        while True:
+            left = node.left.size if node.left else 0
+            if index < left:
+                node = node.left
+            elif index == left:
+                return node
+            else:
+                index -= left + 1
+                node = node.right
+
+    def _index(self, node: _Entry) -> int:
+        i = node.left.size if node.left else 0
+        while node.parent:
+            parent = node.parent
+            if parent.right is node:
+                i += (parent.left.size if parent.left else 0) + 1
+            node = parent
+        return i
+
+    def _replace_child(self, parent, old, new) -> None:
+        if parent is None:
+            self.root = new
+        elif parent.left is old:
+            parent.left = new
+        else:
+            parent.right = new
+        if new:
+            new.parent = parent
+
+    def _rotate_up(self, node: _Entry) -> None:
+        # node takes its parent's place; sizes of the two are recomputed
+        parent = node.parent
+        self._replace_child(parent.parent, parent, node)
+        if parent.left is node:
+            parent.left = node.right
+            if node.right:
+                node.right.parent = parent
+            node.right = parent
+        else:
+            parent.right = node.left
+            if node.left:
+                node.left.parent = parent
+            node.left = parent
+        parent.parent = node
+        node.size = parent.size
+        parent.size = 1 + (parent.left.size if parent.left else 0) + (parent.right.size if parent.right else 0)
+
+    def _attach(self, node: _Entry, index: int) -> None:
+        # leaf insert at position index, then rotate up by priority
+        node.left = node.right = node.parent = None
+        node.size = 1
+        if self.root is None:
+            self.root = node
+            return
+        cur = self.root
+        while True:
+            cur.size += 1
+            left = cur.left.size if cur.left else 0
+            if index <= left:
+                if cur.left is None:
+                    cur.left = node
+                    break
+                cur = cur.left
+            else:
+                index -= left + 1
+                if cur.right is None:
+                    cur.right = node
+                    break
+                cur = cur.right
+        node.parent = cur
+        while node.parent and node.parent.prio < node.prio:
+            self._rotate_up(node)
+
+    def _detach(self, node: _Entry) -> None:
+        # rotate node down to a leaf, unlink it, shrink the sizes above
+        while node.left and node.right:
+            child = node.left if node.left.prio > node.right.prio else node.right
+            self._rotate_up(child)
+        child = node.left or node.right
+        parent = node.parent
+        self._replace_child(parent, node, child)
+        while parent:
+            parent.size -= 1
+            parent = parent.parent
+        node.left = node.right = node.parent = None
+
+    def _forget(self, node: _Entry) -> None:
+        slots = self.entries[node.title]
+        slots.remove(node)
+        if not slots:
+            del self.entries[node.title]
+
+    # ----------------- Queue Operations -----------------
+    def insert(self, index: int, title: str) -> None:
+        index = max(0, min(index, len(self)))
+        node = _Entry(title, self.rng.random())
+        self._attach(node, index)
+        self.entries.setdefault(title, []).append(node)
+        self._notify('insert', index, title)
 
     def enqueue(self, title: str) -> None:
-        if self.is_full():
-            self._resize()
-        self.rear = (self.rear + 1) % self.capacity
-        self.queue[self.rear] = title
-        self.size += 1
+        self.insert(len(self), title)
 
-    def dequeue(self) -> Optional[str]:
-        if self.is_empty():
+    def insert_next(self, title: str) -> None:
+        # jumps the queue: plays after the current track
+        self.insert(0, title)
+
+    def remove_at(self, index: int) -> Optional[str]:
+        if not 0 <= index < len(self):
             return None
-        val = self.queue[self.front]
-        self.front = (self.front + 1) % self.capacity
-        self.size -= 1
-        return val
+        node = self._node_at(index)
+        self._detach(node)
+        self._forget(node)
+        self._notify('remove', index)
+        return node.title
+
+    def dequeue(self) -> Optional[str]:
+        return self.remove_at(0)
+
+    def remove(self, title: str) -> int:
+        # every queued copy of title; returns how many were removed
+        slots = sorted(self.entries.get(title, []), key=self._index, reverse=True)
+        for node in slots:
+            self.remove_at(self._index(node))
+        return len(slots)
+
+    def move(self, src: int, dst: int) -> bool:
+        n = len(self)
+        if not (0 <= src < n and 0 <= dst < n):
+            return False
+        if src != dst:
+            node = self._node_at(src)
+            self._detach(node)
+            self._attach(node, dst)
+            self._notify('move', (src, dst), node.title)
+        return True
+
+    def dedupe(self) -> int:
+        # keeps the first copy of every title; returns how many were removed
+        extra = []
+        for slots in self.entries.values():
+            if len(slots) > 1:
+                keep = min(slots, key=self._index)
+                extra += [node for node in slots if node is not keep]
+        for index in sorted(map(self._index, extra), reverse=True):
+            self.remove_at(index)
+        return len(extra)
+
+    def index_of(self, title: str) -> int:
+        slots = self.entries.get(title)
+        return min(map(self._index, slots)) if slots else -1
+
+    def clear(self) -> None:
+        self.root = None
+        self.entries.clear()
+        self._notify('reset')
+
+    def at(self, index: int):
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        return self._node_at(index).title
+
+    def __iter__(self) -> Iterator[str]:
+        # in-order walk, O(1) amortized per step
+        stack, node = [], self.root
+        while stack or node:
+            while node:
+                stack.append(node)
+                node = node.left
+            node = stack.pop()
+            yield node.title
+            node = node.right
+
+    def __contains__(self, title) -> bool:
+        return title in self.entries
+
+    def __len__(self):
+        return self.root.size if self.root else 0
+
+    def is_empty(self) -> bool:
+        return self.root is None
 
     def show(self) -> None:
         if self.is_empty():
             print("No upcoming songs.")
             return
         print("\n🎶 Upcoming Songs:")
-        for i in range(self.size):
-            print(f"{i+1}. {self.queue[(self.front + i) % self.capacity]}")
+        for i, title in enumerate(self, 1):
+            print(f"{i}. {title}")
@@ -0,0 +1,6 @@
+# conftest.py
+# The modules live at the repository root, not in a package.
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
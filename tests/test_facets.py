@@ -0,0 +1,165 @@
+# test_facets.py
+# FacetIndex queries and Bitmap arithmetic against brute-force set logic.
+import operator
+import random
+
+import pytest
+
+from facets import Bitmap, FacetIndex, union
+
+ARTISTS = ['Abba', 'Boards of Canada', 'Com Truise', 'daft punk', None]
+GENRES = ['synthwave', 'Drum and Bass', 'ambient', None]
+FORMATS = ['mp3', 'flac', 'wav']
+OPS = {'=': operator.eq, '!=': operator.ne, '<': operator.lt, '<=': operator.le,
+       '>': operator.gt, '>=': operator.ge}
+
+
+def make_library(rng, n):
+    songs = []
+    for i in range(n):
+        entry = {'artist': rng.choice(ARTISTS), 'album': rng.choice(['One', 'Two', None]),
+                 'genre': rng.choice(GENRES)}
+        if rng.random() < 0.8:
+            entry['date'] = f'{rng.randint(1965, 2024)}-01-01'
+        songs.append((f'/music/{i:04}.{rng.choice(FORMATS)}', entry, rng.choice([0, 1, 2, 3, 7, 40, 300])))
+    return songs
+
+
+def value_of(field, path, entry, plays):
+    if field == 'plays':
+        return plays
+    if field == 'year':
+        return int(entry['date'][:4]) if entry.get('date') else None
+    if field == 'format':
+        return path.rsplit('.', 1)[1]
+    value = entry.get(field)
+    return value.lower() if value else None
+
+
+def random_query(rng, songs, depth=0):
+    # (query text, predicate over a (path, entry, plays) song)
+    roll = rng.random()
+    if depth < 3 and roll < 0.3:
+        (a, pa), (b, pb) = random_query(rng, songs, depth + 1), random_query(rng, songs, depth + 1)
+        if rng.random() < 0.5:
+            return f'({a}) AND ({b})', lambda s: pa(s) and pb(s)
+        return f'({a}) or ({b})', lambda s: pa(s) or pb(s)
+    if depth < 3 and roll < 0.4:
+        text, pred = random_query(rng, songs, depth + 1)
+        return f'NOT ({text})', lambda s: not pred(s)
+    field = rng.choice(['artist', 'genre', 'format', 'year', 'plays'])
+    if field in ('year', 'plays'):
+        op = rng.choice(list(OPS))
+        key = rng.randint(1960, 2030) if field == 'year' else rng.choice([0, 1, 2, 5, 7, 100, 300, 1000])
+
+        def pred(s, field=field, op=op, key=key):
+            value = value_of(field, *s)
+            if value is None:
+                return op == '!='
+            return OPS[op](value, key)
+        return f'{field}{op}{key}', pred
+    op = rng.choice(['=', '!='])
+    value = rng.choice({'artist': ARTISTS, 'genre': GENRES, 'format': FORMATS}[field][:-1] + ['nobody'])
+    text = f'"{value}"' if ' ' in value else value
+    key = value.lower()
+    if op == '=':
+        return f'{field} = {text}', lambda s: value_of(field, *s) == key
+    return f'{field}!={text}', lambda s: value_of(field, *s) != key
+
+
+def matching(index, query):
+    return set(index.paths_of(index.filter(query)))
+
+
+def test_queries_match_brute_force():
+    rng = random.Random(11)
+    songs = make_library(rng, 400)
+    index = FacetIndex()
+    index.build(songs)
+    for _ in range(500):
+        query, pred = random_query(rng, songs)
+        assert matching(index, query) == {s[0] for s in songs if pred(s)}, query
+
+
+def test_incremental_updates_match_a_rebuild():
+    rng = random.Random(5)
+    songs = {path: (entry, plays) for path, entry, plays in make_library(rng, 300)}
+    index = FacetIndex()
+    index.build((p, e, n) for p, (e, n) in songs.items())
+    extra = iter(make_library(random.Random(6), 600))
+    for _ in range(600):
+        roll, path = rng.random(), rng.choice(list(songs))
+        if roll < 0.3:
+            plays = songs[path][1] + rng.randint(1, 50)
+            songs[path] = (songs[path][0], plays)
+            index.set_plays(path, plays)
+        elif roll < 0.5:
+            entry = dict(songs[path][0], genre=rng.choice(GENRES))
+            songs[path] = (entry, songs[path][1])
+            index.update(path, entry, songs[path][1])
+        elif roll < 0.7:
+            del songs[path]
+            index.remove(path)
+        else:
+            p, e, n = next(extra)
+            p = p.replace('/music/', '/new/')
+            songs[p] = (e, n)
+            index.update(p, e, n)
+    rebuilt = FacetIndex()
+    rebuilt.build((p, e, n) for p, (e, n) in songs.items())
+    assert len(index) == len(rebuilt) == len(songs)
+    flat = [(p, e, n) for p, (e, n) in songs.items()]
+    for _ in range(200):
+        query, pred = random_query(rng, flat)
+        expected = {s[0] for s in flat if pred(s)}
+        assert matching(index, query) == matching(rebuilt, query) == expected, query
+    for field in ('artist', 'genre', 'year'):
+        assert index.counts(field, top=100) == rebuilt.counts(field, top=100)
+
+
+def test_counts_within_a_filter():
+    songs = [('/a.mp3', {'artist': 'X', 'genre': 'rock'}, 1), ('/b.mp3', {'artist': 'X', 'genre': 'pop'}, 2),
+             ('/c.mp3', {'artist': 'Y', 'genre': 'rock'}, 3)]
+    index = FacetIndex()
+    index.build(songs)
+    assert index.counts('genre') == [('rock', 2), ('pop', 1)]
+    assert index.counts('artist', index.filter('genre=ROCK')) == [('X', 1), ('Y', 1)]
+    assert index.filter('') is index.all
+    assert len(index.filter('plays >= 2 AND NOT artist = y')) == 1
+
+
+@pytest.mark.parametrize('query', [
+    'genre', 'genre =', '= rock', 'genre = rock AND', 'genre = rock OR OR artist = x',
+    '(genre = rock', 'genre = rock)', 'NOT', 'mood = happy', 'year >= soon', 'genre > rock',
+    'genre ( rock', 'genre = "unterminated', 'genre = rock artist = x',
+])
+def test_malformed_queries_raise(query):
+    index = FacetIndex()
+    index.build([('/a.mp3', {'genre': 'rock', 'date': '2001'}, 1)])
+    with pytest.raises(ValueError):
+        index.filter(query)
+
+
+def test_bitmap_matches_sets():
+    rng = random.Random(3)
+    for _ in range(300):
+        a = sorted(rng.sample(range(rng.randint(0, 5000), 6000), rng.randint(0, 60)))
+        b = sorted(rng.sample(range(0, rng.randint(60, 9000)), rng.randint(0, 60)))
+        if rng.random() < 0.2:
+            a = list(range(a[0], a[0] + len(a))) if a else a    # one run
+        x, y = Bitmap.from_ids(a), Bitmap.from_ids(b)
+        assert list(x) == a and len(x) == len(a) and bool(x) == bool(a)
+        assert list(x & y) == sorted(set(a) & set(b))
+        assert list(x | y) == sorted(set(a) | set(b))
+        assert list(x - y) == sorted(set(a) - set(b))
+        assert list(union([x, y, Bitmap.from_ids(a[:3])])) == sorted(set(a) | set(b))
+        expected = set(a)
+        for i in rng.sample(range(9000), 20):
+            if rng.random() < 0.5:
+                x.add(i)
+                expected.add(i)
+            else:
+                x.discard(i)
+                expected.discard(i)
+        assert list(x) == sorted(expected)
+        assert x.off % 64 == 0 and (not x.bits or x.off <= min(expected))
@@ -0,0 +1,72 @@
+# test_snapshot.py
+# BST dump/restore, and the snapshot file's integrity checks.
+import marshal
+import os
+import random
+
+from bst import BST, Node
+import snapshot
+
+
+def shape(node):
+    return None if node is None else (node.title, shape(node.left), shape(node.right))
+
+
+def test_bst_round_trip():
+    rng = random.Random(2)
+    # the library tree keeps duplicate titles, to the right of the first
+    trees = [[], ['one'], ['dup'] * 20, [f'{i:03}' for i in range(50)], [f'{i:03}' for i in range(50, 0, -1)]]
+    trees += [[f't{rng.randrange(40)}' for _ in range(rng.randint(1, 300))] for _ in range(50)]
+    for titles in trees:
+        tree = BST()
+        for title in titles:
+            tree.insert(title)
+        remaining = list(titles)
+        for title in rng.sample(titles, len(titles) // 4):
+            assert tree.delete(title)
+            remaining.remove(title)
+        dumped = snapshot.dump_bst(tree.root)
+        assert sorted(dumped[0]) == sorted(remaining)
+        assert len(dumped[0]) == len(dumped[1])
+        restored = snapshot.restore_bst(*dumped, Node)
+        assert shape(restored) == shape(tree.root)
+
+
+def test_file_round_trip(tmp_path):
+    path = str(tmp_path / 'snapshot.bin')
+    state, dirs = {'playlist': (['a'], ['/a.mp3']), 'n': 3}, {'/music': 123}
+    size = snapshot.write(path, marshal.dumps(state), marshal.dumps(dirs))
+    assert size == os.path.getsize(path)
+    assert not os.path.exists(path + '.part')
+    assert snapshot.read(path) == (state, dirs)
+
+
+def test_damaged_files_read_as_missing(tmp_path):
+    path = str(tmp_path / 'snapshot.bin')
+    assert snapshot.read(path) is None
+    snapshot.write(path, marshal.dumps({'x': list(range(100))}), marshal.dumps({}))
+    with open(path, 'rb') as f:
+        good = f.read()
+    flipped = bytearray(good)
+    flipped[-5] ^= 0xFF
+    header = bytearray(good)
+    header[4] += 1    # format version
+    for damaged in (good[:snapshot.HEADER.size - 1], good[:-1], good + b'\0', bytes(flipped), bytes(header)):
+        with open(path, 'wb') as f:
+            f.write(damaged)
+        assert snapshot.read(path) is None
+
+
+def test_changed_directories(tmp_path):
+    root = tmp_path / 'music'
+    (root / 'a' / 'b').mkdir(parents=True)
+    song = root / 'a' / 'b' / 'song.mp3'
+    song.write_bytes(b'')
+    old = 1_000_000_000
+    for d in (root, root / 'a', root / 'a' / 'b'):
+        os.utime(d, (old, old))
+    times = snapshot.directory_times([str(root)], [str(song), '/elsewhere/x.mp3'])
+    assert sorted(times) == sorted(str(d) for d in (root, root / 'a', root / 'a' / 'b'))
+    assert snapshot.changed_directories(times) == []
+    (root / 'a' / 'new.mp3').write_bytes(b'')
+    assert snapshot.changed_directories(times) == [str(root / 'a')]
@@ -0,0 +1,77 @@
+# test_sorting.py
+# Collation, and permutations kept in place against a fresh sort.
+import random
+
+import pytest
+
+from sorting import ORDERS, SortIndex, collate
+
+
+def test_collate_folds_case_accents_and_numbers():
+    names = ['track 10', 'Track 2', 'track 1', 'Éclair', 'eclair 2', 'b', 'A', 'Zoë', 'zoe 1']
+    assert sorted(names, key=collate) == ['A', 'b', 'Éclair', 'eclair 2', 'track 1', 'Track 2',
+                                          'track 10', 'Zoë', 'zoe 1']
+    assert collate('Track 10') == (0, 'track ', 10, '')
+    assert collate('ÉCLAIR') == collate('eclair')
+    assert collate('  ') == collate(None) == (1,)
+    assert collate('z') < collate('')    # untagged sorts last
+
+
+def random_song(rng, i):
+    entry = {'artist': rng.choice(['Abba', 'abba', 'Björk', 'Can', None]),
+             'album': rng.choice(['Vol 2', 'vol 10', None]),
+             'tracknumber': rng.choice(['1', '2/12', '10', None]),
+             'duration': rng.randint(0, 400)}
+    return (f'/m/{i}.mp3', f'Song {rng.randint(1, 30)}', entry, rng.randint(0, 9), float(rng.randint(0, 9)),
+            float(rng.randint(0, 5)))
+
+
+def test_incremental_updates_match_a_rebuild():
+    rng = random.Random(9)
+    songs = {}
+    for i in range(200):
+        path, *rest = random_song(rng, i)
+        songs[path] = rest
+    index = SortIndex()
+    index.build(((p, *s) for p, s in songs.items()), ORDERS)
+    for step in range(1500):
+        roll, path = rng.random(), rng.choice(list(songs))
+        if roll < 0.4:
+            title, entry, plays, played, added = songs[path]
+            songs[path] = [title, entry, plays + 1, played + step, added]
+            index.set_plays(path, plays + 1, played + step)
+        elif roll < 0.6:
+            _, *rest = random_song(rng, 0)
+            songs[path] = rest
+            index.update(path, *rest)
+        elif roll < 0.75:
+            del songs[path]
+            index.remove(path)
+        else:
+            new, *rest = random_song(rng, 1000 + step)
+            songs[new] = rest
+            index.update(new, *rest)
+    rebuilt = SortIndex()
+    rebuilt.build((p, *s) for p, s in songs.items())
+    assert len(index) == len(songs)
+    for order in ORDERS:
+        assert index.order(order) == rebuilt.order(order), order
+
+
+def test_orders():
+    index = SortIndex()
+    index.build([('/a', 'b', {'artist': 'Y', 'album': 'X', 'tracknumber': '2', 'duration': 30, 'mtime': 9},
+                  5, 1.0, 200.0),
+                 ('/b', 'a', {'artist': 'y', 'album': 'X', 'tracknumber': '1', 'duration': 20, 'mtime': 1},
+                  5, 3.0, 100.0),
+                 ('/c', 'c', {'duration': 10, 'mtime': 5}, 9, 2.0, 300.0)])
+    assert index.order('title') == ['/b', '/a', '/c']
+    assert index.order('artist') == ['/b', '/a', '/c']
+    assert index.order('duration') == ['/c', '/b', '/a']
+    assert index.order('plays') == ['/c', '/b', '/a']
+    assert index.order('played') == ['/b', '/c', '/a']
+    assert index.order('added') == ['/c', '/a', '/b']    # not the files' mtimes
+    index.update('/b', 'a', {'artist': 'y', 'duration': 20, 'mtime': 50}, 5, 3.0, 100.0)
+    assert index.order('added') == ['/c', '/a', '/b']    # a retag keeps its place
+    with pytest.raises(ValueError):
+        index.order('mood')
@@ -0,0 +1,78 @@
+# test_stack_queue.py
+# UpcomingSongs against a plain list under random positional edits.
+import random
+
+from stack_queue import UpcomingSongs
+
+
+def check_tree(queue):
+    # sizes, parent links and the heap order of priorities
+    def walk(node, parent):
+        if node is None:
+            return 0
+        assert node.parent is parent
+        for child in (node.left, node.right):
+            if child:
+                assert child.prio <= node.prio
+        size = 1 + walk(node.left, node) + walk(node.right, node)
+        assert node.size == size
+        return size
+    walk(queue.root, None)
+
+
+def test_matches_list_model():
+    rng = random.Random(7)
+    queue, model = UpcomingSongs(seed=1), []
+    titles = [f'song{i}' for i in range(40)]
+    for step in range(20000):
+        op = rng.random()
+        if op < 0.4:
+            index, title = rng.randint(-2, len(model) + 2), rng.choice(titles)
+            queue.insert(index, title)
+            model.insert(max(0, min(index, len(model))), title)
+        elif op < 0.7:
+            index = rng.randint(-1, len(model))
+            expected = model.pop(index) if 0 <= index < len(model) else None
+            assert queue.remove_at(index) == expected
+        elif op < 0.9:
+            src, dst = rng.randint(-1, len(model)), rng.randint(-1, len(model))
+            ok = 0 <= src < len(model) and 0 <= dst < len(model)
+            assert queue.move(src, dst) == ok
+            if ok:
+                model.insert(dst, model.pop(src))
+        elif op < 0.93:
+            seen, kept = set(), []
+            for title in model:
+                if title not in seen:
+                    seen.add(title)
+                    kept.append(title)
+            assert queue.dedupe() == len(model) - len(kept)
+            model = kept
+        else:
+            title = rng.choice(titles)
+            assert queue.index_of(title) == (model.index(title) if title in model else -1)
+            assert (title in queue) == (title in model)
+        assert len(queue) == len(model)
+        if step % 250 == 0:
+            assert list(queue) == model
+            if model:
+                index = rng.randrange(len(model))
+                assert queue.at(index) == model[index]
+            check_tree(queue)
+    assert list(queue) == model
+    check_tree(queue)
+
+
+def test_remove_title_and_notifications():
+    queue, events = UpcomingSongs(seed=3), []
+    queue.subscribe(lambda *event: events.append(event))
+    for title in ['a', 'b', 'a', 'c', 'a']:
+        queue.enqueue(title)
+    events.clear()
+    assert queue.remove('a') == 3
+    assert list(queue) == ['b', 'c']
+    assert [op for op, *_ in events] == ['remove'] * 3
+    assert queue.move(1, 0)
+    assert events[-1] == ('move', (1, 0), 'c')
+    assert queue.dequeue() == 'c'
+    assert queue.index_of('a') == -1
@@ -0,0 +1,191 @@
+# transcode.py
+# Transcode cache for songs the audio backend cannot decode (M4A or WMA on
+# the pygame mixer, anything but WAV without ffmpeg's help). Copies are
+# made ahead of time by ffmpeg in a bounded process pool and kept in
+# data/transcoded/ named by the content hash of the source, so a file is
+# encoded once however often it is moved, renamed or duplicated. Once the
+# cache grows past max_bytes the least recently played copies are deleted;
+# recency survives restarts as the files' modification times.
+import os
+import subprocess
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Dict, Iterable, Optional
+
+from decoder import FFMPEG
+
+MAX_BYTES = 2 << 30
+# ffmpeg output options per target format; both decode everywhere
+TARGETS = {'ogg': ['-c:a', 'libvorbis', '-q:a', '6', '-f', 'ogg'],
+           'wav': ['-c:a', 'pcm_s16le', '-f', 'wav']}
+
+
+def _transcode_worker(path: str, cache_dir: str, target: str, sha: Optional[str]):
+    try:
+        from duplicates import content_hash
+        sha = sha or content_hash(path)
+        dst = os.path.join(cache_dir, f'{sha}.{target}')
+        if not os.path.exists(dst):
+            tmp = f'{dst}.{os.getpid()}.part'
+            cmd = [FFMPEG, '-v', 'error', '-nostdin', '-y', '-i', path, '-vn'] + TARGETS[target] + [tmp]
+            try:
+                subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, check=True)
+                os.replace(tmp, dst)
+            finally:
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+        return path, sha, os.path.getsize(dst), None
+    except subprocess.CalledProcessError as e:
+        return path, sha, 0, e.stderr.decode(errors='replace').strip() or str(e)
+    except Exception as e:
+        return path, sha, 0, str(e)
+
+
+class TranscodeCache:
+    def __init__(self, cache_dir: str, metadata, max_bytes: int = MAX_BYTES,
+                 workers: Optional[int] = None, target: str = 'ogg'):
+        self.cache_dir = cache_dir
+        self.metadata = metadata        # remembers each source's content hash ('sha')
+        self.max_bytes = max_bytes
+        self.workers = workers or max(1, (os.cpu_count() or 2) // 2)
+        self.target = target
+        self.entries: Dict[str, int] = OrderedDict()   # sha -> size, least recently used first
+        self.size = 0
+        self.jobs: Dict[str, Future] = {}               # source path -> running job
+        self.failed = set()                             # sources ffmpeg could not convert
+        self.lock = threading.Lock()
+        self.pool: Optional[ProcessPoolExecutor] = None
+        self.loaded = False
+
+    @property
+    def available(self) -> bool:
+        return FFMPEG is not None
+
+    def load(self) -> None:
+        # what earlier sessions left, oldest use first; half-written files go
+        with self.lock:
+            if self.loaded:
+                return
+            os.makedirs(self.cache_dir, exist_ok=True)
+            found = []
+            for entry in os.scandir(self.cache_dir):
+                if entry.name.endswith('.part'):
+                    os.remove(entry.path)
+                elif entry.name.endswith('.' + self.target):
+                    st = entry.stat()
+                    found.append((st.st_mtime, entry.name[:-len(self.target) - 1], st.st_size))
+            for _, sha, size in sorted(found):
+                self.entries[sha] = size
+                self.size += size
+            self.loaded = True
+        self._evict()
+
+    def _file(self, sha: str) -> str:
+        return os.path.join(self.cache_dir, f'{sha}.{self.target}')
+
+    def lookup(self, path: str) -> Optional[str]:
+        """The cached copy of path, marked as just used, or None."""
+        sha = self.metadata.get(path).get('sha')
+        with self.lock:
+            if sha not in self.entries:
+                return None
+            self.entries.move_to_end(sha)
+        dst = self._file(sha)
+        try:
+            os.utime(dst)
+        except OSError:
+            with self.lock:
+                self.size -= self.entries.pop(sha, 0)
+            return None
+        return dst
+
+    def submit(self, path: str) -> Optional[Future]:
+        with self.lock:
+            if path in self.failed:
+                return None
+            job = self.jobs.get(path)
+            if job is None:
+                if self.pool is None:
+                    self.pool = ProcessPoolExecutor(max_workers=self.workers)
+                entry = self.metadata.get(path)
+                job = self.jobs[path] = self.pool.submit(_transcode_worker, path, self.cache_dir,
+                                                         self.target, entry.get('sha'))
+                job.add_done_callback(self._finished)
+        return job
+
+    def _finished(self, job: Future) -> None:
+        if job.cancelled():
+            with self.lock:
+                for path in [p for p, j in self.jobs.items() if j is job]:
+                    del self.jobs[path]
+            return
+        try:
+            path, sha, size, err = job.result()
+        except Exception as e:  # the pool broke
+            with self.lock:
+                path = next((p for p, j in self.jobs.items() if j is job), None)
+            sha, size, err = None, 0, str(e)
+        with self.lock:
+            self.jobs.pop(path, None)
+            if err:
+                self.failed.add(path)
+        if err:
+            print(f'Could not transcode {path}: {err}')
+        else:
+            self._add(path, sha, size)
+
+    def _add(self, path: str, sha: str, size: int) -> str:
+        with self.lock:
+            new = sha not in self.entries
+            if new:
+                self.entries[sha] = size
+                self.size += size
+        if (self.metadata.peek(path) or {}).get('sha') != sha:
+            self.metadata.update(path, sha=sha)
+        if new:
+            self._evict()
+        return self._file(sha)
+
+    def _evict(self) -> None:
+        # least recently used first; the newest copy always stays
+        while True:
+            with self.lock:
+                if self.size <= self.max_bytes or len(self.entries) <= 1:
+                    return
+                sha, size = self.entries.popitem(last=False)
+                self.size -= size
+            try:
+                os.remove(self._file(sha))
+            except OSError:
+                pass
+
+    def resolve(self, path: str, wait: bool = True) -> Optional[str]:
+        """The transcoded copy of path, converting it first if needed (or
+        None when wait is False). Falls back to path if conversion fails."""
+        self.load()
+        dst = self.lookup(path)
+        if dst:
+            return dst
+        job = self.submit(path)
+        if job is None:
+            return path if wait else None
+        if not wait:
+            return None
+        _, sha, size, err = job.result()
+        # done callbacks may still be on their way: register it here as well
+        return path if err else self._add(path, sha, size)
+
+    def prefetch(self, paths: Iterable[str]) -> int:
+        # ahead of time: queue every path without a cached copy
+        self.load()
+        queued = 0
+        for path in paths:
+            if self.lookup(path) is None and self.submit(path) is not None:
+                queued += 1
+        return queued
+
+    def close(self) -> None:
+        if self.pool:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+            self.pool = None
@@ -0,0 +1,235 @@
+# watcher.py
+# Filesystem watcher for live library updates.
+# Uses inotify through libc (ctypes) on Linux and falls back to polling mtime
+# snapshots elsewhere. Raw events are coalesced per path, debounced and
+# delivered in batches of (kind, path) with kind in 'added'/'removed'/'modified'.
+import os
+import sys
+import time
+import ctypes
+import ctypes.util
+import select
+import struct
+import threading
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from library_index import iter_audio_files, is_audio_file
+
+Event = Tuple[str, str]
+
+# inotify flags (linux/inotify.h)
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF
+_EVENT_HEADER = struct.Struct('iIII')
+
+
+def coalesce(pending: Dict[str, str], kind: str, path: str) -> None:
+    # Folds a new event into the pending state for path so a burst of raw
+    # events turns into at most one event per file
+    old = pending.get(path)
+    if old is None:
+        pending[path] = kind
+    elif old == 'added':
+        if kind == 'removed':
+            del pending[path]
+    elif old == 'removed':
+        if kind == 'added':
+            pending[path] = 'modified'
+    else:
+        pending[path] = 'removed' if kind == 'removed' else 'modified'
+
+
+class _Inotify:
+    def __init__(self):
+        libc_name = ctypes.util.find_library('c')
+        self.libc = ctypes.CDLL(libc_name, use_errno=True)
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self.wds: Dict[int, str] = {}
+
+    def add_tree(self, folder: str) -> None:
+        stack = [folder]
+        while stack:
+            cur = stack.pop()
+            wd = self.libc.inotify_add_watch(self.fd, os.fsencode(cur), WATCH_MASK)
+            if wd < 0:
+                continue
+            self.wds[wd] = cur
+            try:
+                with os.scandir(cur) as it:
+                    stack.extend(e.path for e in it if e.is_dir(follow_symlinks=False))
+            except OSError:
+                pass
+
+    def read(self, timeout: float) -> List[Tuple[int, int, str]]:
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        events = []
+        offset = 0
+        while offset + _EVENT_HEADER.size <= len(data):
+            wd, mask, _cookie, length = _EVENT_HEADER.unpack_from(data, offset)
+            offset += _EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b'\0')
+            offset += length
+            events.append((wd, mask, os.fsdecode(name)))
+        return events
+
+    def close(self) -> None:
+        try:
+            os.close(self.fd)
+        except OSError:
+            pass
+
+
+class LibraryWatcher:
+    """Watches folders and calls on_events(batch) from a background thread.
+
+    A batch is flushed once no new event arrived for `debounce` seconds, or
+    after `max_delay` seconds of continuous activity.
+    """
+
+    def __init__(self, folders: Iterable[str], on_events: Callable[[List[Event]], None],
+                 debounce: float = 0.5, max_delay: float = 3.0, poll_interval: float = 2.0,
+                 use_inotify: bool = True):
+        self.folders = [os.path.abspath(f) for f in folders]
+        self.on_events = on_events
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self.poll_interval = poll_interval
+        self.use_inotify = use_inotify and sys.platform.startswith('linux')
+        self.stop_event = threading.Event()
+        self.thread: Optional[threading.Thread] = None
+        self.pending: Dict[str, str] = {}
+        self.first_pending = 0.0
+        self.last_event = 0.0
+        self.backend = None
+
+    def start(self) -> None:
+        if self.thread and self.thread.is_alive():
+            return
+        self.stop_event.clear()
+        target = self._run_polling
+        if self.use_inotify:
+            try:
+                self.backend = _Inotify()
+                target = self._run_inotify
+            except (OSError, AttributeError) as e:
+                print('inotify unavailable, polling for library changes:', e)
+        self.thread = threading.Thread(target=target, daemon=True)
+        self.thread.start()
+
+    def stop(self) -> None:
+        self.stop_event.set()
+        if self.thread and self.thread.is_alive():
+            self.thread.join(timeout=1.0)
+        self.thread = None
+        if isinstance(self.backend, _Inotify):
+            self.backend.close()
+        self.backend = None
+
+    # ----------------- Batching -----------------
+    def _push(self, kind: str, path: str) -> None:
+        now = time.monotonic()
+        if not self.pending:
+            self.first_pending = now
+        self.last_event = now
+        coalesce(self.pending, kind, path)
+
+    def _maybe_flush(self) -> None:
+        if not self.pending:
+            return
+        now = time.monotonic()
+        if now - self.last_event < self.debounce and now - self.first_pending < self.max_delay:
+            return
+        batch = list(self.pending.items())
+        self.pending = {}
+        try:
+            self.on_events([(kind, path) for path, kind in batch])
+        except Exception as e:
+            print('Library watcher callback error:', e)
+
+    # ----------------- inotify -----------------
+    def _run_inotify(self) -> None:
+        ino = self.backend
+        for folder in self.folders:
+            ino.add_tree(folder)
+        while not self.stop_event.is_set():
+            timeout = self.debounce if self.pending else 0.5
+            try:
+                raw = ino.read(timeout)
+            except OSError as e:
+                print('Library watcher error:', e)
+                break
+            for wd, mask, name in raw:
+                if mask & IN_Q_OVERFLOW:
+                    # kernel queue overflowed; reconcile with one polling pass
+                    self._rescan_all()
+                    continue
+                base = ino.wds.get(wd)
+                if base is None:
+                    continue
+                if mask & IN_DELETE_SELF:
+                    ino.wds.pop(wd, None)
+                    continue
+                path = os.path.join(base, name)
+                if mask & IN_ISDIR:
+                    if mask & (IN_CREATE | IN_MOVED_TO):
+                        ino.add_tree(path)
+                        for p, _size, _mtime in iter_audio_files(path):
+                            self._push('added', p)
+                    elif mask & (IN_DELETE | IN_MOVED_FROM):
+                        # receivers expand a removed directory by path prefix
+                        self._push('removed', path)
+                    continue
+                if not is_audio_file(name):
+                    continue
+                if mask & (IN_CLOSE_WRITE | IN_MOVED_TO):
+                    self._push('added' if mask & IN_MOVED_TO else 'modified', path)
+                elif mask & (IN_DELETE | IN_MOVED_FROM):
+                    self._push('removed', path)
+                # IN_CREATE on a file is followed by IN_CLOSE_WRITE once written
+            self._maybe_flush()
+
+    def _rescan_all(self) -> None:
+        for folder in self.folders:
+            for p, _size, _mtime in iter_audio_files(folder):
+                self._push('modified', p)
+
+    # ----------------- Polling fallback -----------------
+    def _snapshot(self) -> Dict[str, Tuple[int, int]]:
+        snap = {}
+        for folder in self.folders:
+            for path, size, mtime in iter_audio_files(folder):
+                snap[path] = (size, mtime)
+        return snap
+
+    def _run_polling(self) -> None:
+        prev = self._snapshot()
+        while not self.stop_event.wait(self.debounce if self.pending else self.poll_interval):
+            cur = self._snapshot()
+            for path, stamp in cur.items():
+                old = prev.get(path)
+                if old is None:
+                    self._push('added', path)
+                elif old != stamp:
+                    self._push('modified', path)
+            for path in prev.keys() - cur.keys():
+                self._push('removed', path)
+            prev = cur
+            self._maybe_flush()
@@ -0,0 +1,164 @@
+# waveform.py
+# Per-track min/max peak summaries for the waveform seek bar.
+# Peaks are computed once from decoded PCM in a background thread and stored
+# in a compact binary cache (int8 min/max per bucket), so the GUI only ever
+# reads a few kilobytes and never decodes audio itself.
+import os
+import struct
+import hashlib
+import threading
+from array import array
+from typing import Callable, Optional, Tuple
+
+BUCKETS = 2000
+BLOCK_FRAMES = 128   # frames per min/max pair kept while decoding
+_HEADER = struct.Struct('<4sH')
+_MAGIC = b'WPK1'
+
+Peaks = Tuple[array, array]
+
+
+def compute_peaks(path: str, buckets: int = BUCKETS,
+                  cancelled: Callable[[], bool] = lambda: False) -> Optional[Peaks]:
+    """Min/max of the mono mix in `buckets` slices. Decodes chunk by chunk,
+    keeping one min/max pair per BLOCK_FRAMES, and gives up (None) at the
+    first chunk after cancelled() turns true."""
+    import numpy as np
+    from decoder import open_pcm
+    _, ch, chunks = open_pcm(path)
+    frame = 2 * ch
+    step = frame * BLOCK_FRAMES
+    mins, maxs, rest = [], [], b''
+
+    def reduce(data: bytes, frames: int) -> None:
+        mono = np.frombuffer(data, dtype='<i2').reshape(-1, frames, ch).mean(axis=2, dtype=np.float32)
+        mins.append(mono.min(axis=1))
+        maxs.append(mono.max(axis=1))
+    try:
+        for data in chunks:
+            if cancelled():
+                return None
+            data = rest + bytes(data)
+            usable = len(data) - len(data) % step
+            if usable:
+                reduce(data[:usable], BLOCK_FRAMES)
+            rest = data[usable:]
+    finally:
+        chunks.close()
+    tail = len(rest) - len(rest) % frame
+    if tail:
+        reduce(rest[:tail], tail // frame)
+    if not mins:
+        return None
+    mins, maxs = np.concatenate(mins) / 32768.0, np.concatenate(maxs) / 32768.0
+    buckets = min(buckets, len(mins))
+    starts = np.linspace(0, len(mins), buckets, endpoint=False).astype(np.int64)
+    mins = np.minimum.reduceat(mins, starts)
+    maxs = np.maximum.reduceat(maxs, starts)
+    to_int8 = lambda a: np.clip(np.round(a * 127), -127, 127).astype(np.int8).tobytes()
+    return array('b', to_int8(mins)), array('b', to_int8(maxs))
+
+
+class PeaksCache:
+    def __init__(self, cache_dir: str):
+        self.cache_dir = cache_dir
+
+    def _file(self, path: str) -> Optional[str]:
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        key = f'{os.path.abspath(path)}|{st.st_size}|{st.st_mtime_ns}'
+        name = hashlib.blake2b(key.encode('utf-8', 'surrogateescape'), digest_size=12).hexdigest()
+        return os.path.join(self.cache_dir, name + '.wpk')
+
+    def load(self, path: str) -> Optional[Peaks]:
+        fname = self._file(path)
+        if not fname or not os.path.exists(fname):
+            return None
+        try:
+            with open(fname, 'rb') as f:
+                data = f.read()
+            magic, n = _HEADER.unpack_from(data)
+            if magic != _MAGIC or len(data) != _HEADER.size + 2 * n:
+                return None
+            body = data[_HEADER.size:]
+            return array('b', body[:n]), array('b', body[n:])
+        except (OSError, struct.error):
+            return None
+
+    def store(self, path: str, peaks: Peaks) -> None:
+        fname = self._file(path)
+        if not fname:
+            return
+        mins, maxs = peaks
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with open(fname + '.tmp', 'wb') as f:
+                f.write(_HEADER.pack(_MAGIC, len(mins)))
+                f.write(mins.tobytes())
+                f.write(maxs.tobytes())
+            os.replace(fname + '.tmp', fname)
+        except OSError as e:
+            print('Could not cache waveform:', e)
+
+
+class PeaksWorker:
+    """Computes peaks for one track at a time on a background thread.
+
+    request() supersedes any earlier request: a job that is no longer the
+    latest stops decoding at its next chunk, and one that finished anyway is
+    cached but never delivered.
+    """
+
+    def __init__(self, cache: PeaksCache, on_ready: Callable[[str, Peaks], None]):
+        self.cache = cache
+        self.on_ready = on_ready
+        self.lock = threading.Condition()
+        self.pending: Optional[str] = None
+        self.generation = 0
+        self.thread: Optional[threading.Thread] = None
+        self.stopped = False
+
+    def request(self, path: str) -> None:
+        with self.lock:
+            self.generation += 1
+            self.pending = path
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._run, daemon=True)
+                self.thread.start()
+            self.lock.notify()
+
+    def cancel(self) -> None:
+        with self.lock:
+            self.generation += 1
+            self.pending = None
+
+    def stop(self) -> None:
+        with self.lock:
+            self.stopped = True
+            self.pending = None
+            self.lock.notify()
+
+    def _run(self) -> None:
+        while True:
+            with self.lock:
+                while self.pending is None and not self.stopped:
+                    self.lock.wait()
+                if self.stopped:
+                    return
+                path, gen = self.pending, self.generation
+                self.pending = None
+            cancelled = lambda: gen != self.generation
+            peaks = self.cache.load(path)
+            if peaks is None:
+                try:
+                    peaks = compute_peaks(path, cancelled=cancelled)
+                except Exception as e:
+                    print(f'Could not compute waveform for {path}: {e}')
+                    continue
+                if peaks is None:
+                    continue
+                self.cache.store(path, peaks)
+            if not cancelled():
+                self.on_ready(path, peaks)